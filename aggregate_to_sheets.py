@@ -2,31 +2,68 @@
 Скрипт для агрегации данных из PostgreSQL и выгрузки в Google Sheets.
 Запускайте ТОЛЬКО после успешной загрузки данных через main.py.
 """
+import argparse
 import os
 import logging
 from database import create_table  # Проверим, что таблица есть
 from analytics import aggregate_data, upload_to_google_sheets
 from email_sender import send_email_report
-from config import DB_CONFIG
-import psycopg2
+from db_pool import get_connection, check_connection
+from config import SPREADSHEET_ID
 from datetime import datetime
+import metrics
 
 
 def has_data_in_table():
     """Проверяет, есть ли записи в таблице attempts"""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM attempts LIMIT 1;")
-        has_data = cur.fetchone() is not None
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM attempts LIMIT 1;")
+            has_data = cur.fetchone() is not None
+            cur.close()
         return has_data
     except Exception as e:
         logging.error(f"Ошибка при проверке данных: {e}")
         return False
 
-def main():
+def confirm_data_updated():
+    """Спрашивает пользователя, обновил ли он данные через main.py"""
+    print("\n" + "="*60)
+    print("ВАЖНО: Этот скрипт работает ТОЛЬКО после загрузки данных через main.py")
+    print("-" * 60)
+    response = input("Вы уже запустили main.py и обновили данные в PostgreSQL? (да/нет): ").strip().lower()
+
+    if response not in ['да', 'yes', 'y', 'д']:
+        logging.critical("❌ Операция отменена. Сначала запустите main.py для обновления данных.")
+        print("Совет: Запустите сначала: python main.py")
+        return False
+    return True
+
+def export_report(metrics_df):
+    """Выгружает метрики в Google Sheets и отправляет email-отчёт, возвращает True при успешной выгрузке"""
+    logging.info("=== Выгрузка в Google Sheets ===")
+    success = upload_to_google_sheets(
+        metrics_df=metrics_df,
+        credentials_path='credentials.json',
+        spreadsheet_id=SPREADSHEET_ID
+    )
+
+    logging.info("=== Отправка email-отчёта ===")
+    if success:
+        send_email_report(success=True, spreadsheet_url=f"https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}")
+    else:
+        send_email_report(success=False, local_file_path="metrics_backup.csv")
+    return success
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Агрегация данных из PostgreSQL и выгрузка в Google Sheets")
+    parser.add_argument('--yes', action='store_true', help="не спрашивать подтверждение (для запуска по расписанию)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Агрегация и выгрузка; возвращает код выхода (0 — успех)"""
+    args = parse_args(argv)
     os.makedirs("logs", exist_ok=True)
     # Настройка логирования
     logging.basicConfig(
@@ -38,62 +75,49 @@ def main():
         ]
     )
 
+    success = False
+    try:
+        success = run(args)
+    finally:
+        metrics.write_run_summary('aggregate', 'ok' if success else 'error')
+    return 0 if success else 1
+
+
+def run(args):
+    """Агрегация и выгрузка по аргументам командной строки; возвращает True, если выгрузка удалась"""
     logging.info("=== Запуск скрипта: агрегация и выгрузка в Google Sheets ===")
 
     # 0. Проверка есть ли данные в таблице?
     if not has_data_in_table():
         logging.critical("❌ В таблице attempts нет данных. Сначала запустите main.py")
-        return
-
-    # 1. Проверка: пользователь выполнил обновление?
-    print("\n" + "="*60)
-    print("ВАЖНО: Этот скрипт работает ТОЛЬКО после загрузки данных через main.py")
-    print("-" * 60)
-    response = input("Вы уже запустили main.py и обновили данные в PostgreSQL? (да/нет): ").strip().lower()
+        return False
 
-    if response not in ['да', 'yes', 'y', 'д']:
-        logging.critical("❌ Операция отменена. Сначала запустите main.py для обновления данных.")
-        print("Совет: Запустите сначала: python main.py")
-        return
+    # 1. Проверка: пользователь выполнил обновление? (--yes — без вопроса)
+    if not args.yes and not confirm_data_updated():
+        return False
 
     # 2. Проверка подключения к БД
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        conn.close()
+        check_connection()
         logging.info("✅ Подключение к PostgreSQL успешно")
     except Exception as e:
         logging.critical(f"❌ Ошибка подключения к PostgreSQL: {e}")
-        return
+        return False
 
     # 3. Агрегация данных
     logging.info("=== Агрегация данных ===")
     metrics_df = aggregate_data()
     if metrics_df is None:
         logging.critical("Не удалось агрегировать данные")
-        return
+        return False
 
         # Проверим, что df не пуст
     if metrics_df.empty:
         logging.critical("❌ DataFrame пустой — нет данных для выгрузки")
-        return
-
-    # 4. Выгрузка в Google Sheets
-    logging.info("=== Выгрузка в Google Sheets ===")
-
-    # Передаём metrics_df в функцию
-    success = upload_to_google_sheets(
-        metrics_df=metrics_df,
-        credentials_path='credentials.json',
-        spreadsheet_id='1KRFPLEfDkP-BbMv6fEj6nrEKogKGQR80QnZPPdHg85U'
-    )
-
-    # 5. Отправка email-отчёта
-    logging.info("=== Отправка email-отчёта ===")
+        return False
 
-    if success:
-        send_email_report(success=True, spreadsheet_url="https://docs.google.com/spreadsheets/d/1KRFPLEfDkP-BbMv6fEj6nrEKogKGQR80QnZPPdHg85U")
-    else:
-        send_email_report(success=False, local_file_path="metrics_backup.csv")
+    # 4. Выгрузка в Google Sheets и отправка email-отчёта
+    success = export_report(metrics_df)
 
     # Финальное сообщение
     if success:
@@ -102,7 +126,8 @@ def main():
     else:
         logging.critical("=== Скрипт агрегации завершён с частичным успехом ===")
         print("⚠️ Данные агрегированы, но выгрузка в Google Sheets не удалась. Сохранены локально.")
+    return success
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
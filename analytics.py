@@ -1,62 +1,395 @@
 import logging
 import os
-import pandas as pd
-import psycopg2
-import gspread
-from config import DB_CONFIG
+from datetime import date, datetime, timedelta
+from operator import attrgetter, itemgetter
+from config import EXPORT_DIR, READ_ITERSIZE
+from db_reader import iter_frames
+import metrics
+from progress import PROGRESS_COLUMNS
+
+# Измерения разбивки: выражение по attempts и по дневным агрегатам (None — в агрегатах измерения нет)
+DIMENSIONS = {
+    'day': ("created_at::date", "day"),
+    'week': ("date_trunc('week', created_at)::date", "date_trunc('week', day)::date"),
+    'oauth_consumer_key': ("oauth_consumer_key", None),
+    'attempt_type': ("attempt_type", None),
+    'user_id': ("user_id", None),
+}
+
+METRIC_COLUMNS = (
+    'total_attempts', 'correct_attempts', 'submits', 'runs', 'unique_users', 'first_attempt', 'last_attempt',
+)
+
+METRIC_LABELS = {
+    'total_attempts': 'Общее количество попыток',
+    'correct_attempts': 'Количество успешных попыток',
+    'submits': 'Количество submit',
+    'runs': 'Количество run',
+    'unique_users': 'Уникальные пользователи',
+    'first_attempt': 'Первая попытка',
+    'last_attempt': 'Последняя попытка',
+}
+
+
+def _is_day_boundary(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return True
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value == datetime(value.year, value.month, value.day)
+
+
+def _range_filter(column, start, end):
+    """Условие WHERE для полуинтервала [start, end) и его параметры"""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{column} < %s")
+        params.append(end)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
 
-def aggregate_data():
-    """Агрегирует данные из таблицы attempts и возвращает DataFrame"""
-    try:
-        import pandas as pd
-        import psycopg2
 
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
+def _attempts_query(dimensions, start, end):
+    """Метрики полным сканом attempts за период (сканируются только секции и строки периода)"""
+    where, params = _range_filter('created_at', start, end)
+    keys = [f"{DIMENSIONS[name][0]} AS {name}" for name in dimensions]
+    group = f"GROUP BY {', '.join(dimensions)} ORDER BY {', '.join(dimensions)}" if dimensions else ""
+    query = f'''
+        SELECT
+            {''.join(key + ', ' for key in keys)}
+            COUNT(*) AS total_attempts,
+            COUNT(CASE WHEN is_correct THEN 1 END) AS correct_attempts,
+            COUNT(CASE WHEN attempt_type = 'submit' THEN 1 END) AS submits,
+            COUNT(CASE WHEN attempt_type = 'run' THEN 1 END) AS runs,
+            COUNT(DISTINCT user_id) AS unique_users,
+            MIN(created_at) AS first_attempt,
+            MAX(created_at) AS last_attempt
+        FROM attempts
+        {where}
+        {group}
+    '''
+    return query, params
 
-        cur.execute("""
+
+def _rollup_query(dimensions, start, end):
+    """Метрики по дневным агрегатам: attempts_daily для счётчиков, attempts_daily_users для уникальных"""
+    where, params = _range_filter('day', start, end)
+    keys = [f"{DIMENSIONS[name][1]} AS {name}" for name in dimensions]
+    select_keys = ''.join(key + ', ' for key in keys)
+    group = f"GROUP BY {', '.join(dimensions)}" if dimensions else ""
+    join = f"LEFT JOIN users USING ({', '.join(dimensions)})" if dimensions else "CROSS JOIN users"
+    order = f"ORDER BY {', '.join(dimensions)}" if dimensions else ""
+    query = f'''
+        WITH totals AS (
             SELECT
-                COUNT(*) as total_attempts,
-                COUNT(CASE WHEN is_correct THEN 1 END) as correct_attempts,
-                COUNT(CASE WHEN attempt_type = 'submit' THEN 1 END) as submits,
-                COUNT(CASE WHEN attempt_type = 'run' THEN 1 END) as runs,
-                COUNT(DISTINCT user_id) as unique_users,
-                MIN(created_at) as first_attempt,
-                MAX(created_at) as last_attempt
-            FROM attempts;
-        """)
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        # Формируем DataFrame
-        data = [{
-            'Метрика': 'Общее количество попыток',
-            'Значение': result[0]
-        }, {
-            'Метрика': 'Количество успешных попыток',
-            'Значение': result[1]
-        }, {
-            'Метрика': 'Количество submit',
-            'Значение': result[2]
-        }, {
-            'Метрика': 'Количество run',
-            'Значение': result[3]
-        }, {
-            'Метрика': 'Уникальные пользователи',
-            'Значение': result[4]
-        }, {
-            'Метрика': 'Первая попытка',
-            'Значение': result[5]
-        }, {
-            'Метрика': 'Последняя попытка',
-            'Значение': result[6]
-        }]
-
-        df = pd.DataFrame(data)
+                {select_keys}
+                COALESCE(SUM(total_attempts), 0)::bigint AS total_attempts,
+                COALESCE(SUM(correct_attempts), 0)::bigint AS correct_attempts,
+                COALESCE(SUM(submits), 0)::bigint AS submits,
+                COALESCE(SUM(runs), 0)::bigint AS runs,
+                MIN(first_attempt) AS first_attempt,
+                MAX(last_attempt) AS last_attempt
+            FROM attempts_daily
+            {where}
+            {group}
+        ), users AS (
+            SELECT {select_keys} COUNT(DISTINCT user_id) AS unique_users
+            FROM attempts_daily_users
+            {where}
+            {group}
+        )
+        SELECT {''.join(name + ', ' for name in dimensions)}
+               total_attempts, correct_attempts, submits, runs,
+               COALESCE(unique_users, 0) AS unique_users, first_attempt, last_attempt
+        FROM totals {join}
+        {order}
+    '''
+    return query, params + params
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def _parquet_metrics(dimensions, start, end, directory=None):
+    """Те же метрики по выгрузке Parquet (см. export.py) средствами pyarrow, без обращения к БД
+        - читаются только нужные столбцы и секции дней, попадающие в период
+    """
+    import glob
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    from export import dataset_path
+
+    root = dataset_path(directory or EXPORT_DIR)
+    files = sorted(glob.glob(os.path.join(root, 'day=*', '*.parquet')))
+    files = [path for path in files if not os.path.dirname(path).endswith('.tmp')]
+    partitioning = ds.partitioning(pa.schema([('day', pa.date32())]), flavor='hive')
+    dataset = ds.dataset(files, format='parquet', partitioning=partitioning, partition_base_dir=root)
+
+    start, end = _as_datetime(start), _as_datetime(end)
+    condition = None
+    for expression in (
+        start is not None and (ds.field('day') >= pa.scalar(start.date(), pa.date32())),
+        start is not None and (ds.field('created_at') >= pa.scalar(start, pa.timestamp('us'))),
+        end is not None and (ds.field('day') <= pa.scalar(end.date(), pa.date32())),
+        end is not None and (ds.field('created_at') < pa.scalar(end, pa.timestamp('us'))),
+    ):
+        if expression is not False:
+            condition = expression if condition is None else condition & expression
+    columns = {'user_id', 'is_correct', 'attempt_type', 'created_at'} | \
+        {name for name in dimensions if name in ('oauth_consumer_key', 'attempt_type')}
+    table = dataset.to_table(columns=sorted(columns), filter=condition)
+
+    created_at = table['created_at']
+    attempt_type = pc.cast(table['attempt_type'], pa.string())
+    data = {
+        'day': lambda: pc.cast(created_at, pa.date32()),
+        'week': lambda: pc.cast(pc.floor_temporal(created_at, unit='week', week_starts_monday=True), pa.date32()),
+        'oauth_consumer_key': lambda: pc.cast(table['oauth_consumer_key'], pa.string()),
+        'attempt_type': lambda: attempt_type,
+        'user_id': lambda: table['user_id'],
+    }
+    frame = pa.table({
+        **{name: data[name]() for name in dimensions},
+        'correct': pc.cast(pc.fill_null(table['is_correct'], False), pa.int64()),
+        'submit': pc.cast(pc.fill_null(pc.equal(attempt_type, 'submit'), False), pa.int64()),
+        'run': pc.cast(pc.fill_null(pc.equal(attempt_type, 'run'), False), pa.int64()),
+        'user_id': table['user_id'],
+        'created_at': created_at,
+    })
+    grouped = frame.group_by(dimensions).aggregate([
+        ([], 'count_all'), ('correct', 'sum'), ('submit', 'sum'), ('run', 'sum'),
+        ('user_id', 'count_distinct'), ('created_at', 'min'), ('created_at', 'max'),
+    ])
+    grouped = grouped.rename_columns({
+        'count_all': 'total_attempts', 'correct_sum': 'correct_attempts', 'submit_sum': 'submits',
+        'run_sum': 'runs', 'user_id_count_distinct': 'unique_users',
+        'created_at_min': 'first_attempt', 'created_at_max': 'last_attempt',
+    }).select(dimensions + list(METRIC_COLUMNS))
+    if dimensions:
+        grouped = grouped.sort_by([(name, 'ascending') for name in dimensions])
+    df = grouped.to_pandas()
+    # Как и в SQL: без разбивки и без строк — нули
+    counters = ['total_attempts', 'correct_attempts', 'submits', 'runs', 'unique_users']
+    df[counters] = df[counters].fillna(0).astype('int64')
+    return df
+
+
+def _dimensions(group_by):
+    dimensions = list(group_by)
+    unknown = [name for name in dimensions if name not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Неизвестные измерения: {unknown}. Доступны: {list(DIMENSIONS)}")
+    return dimensions
+
+
+# Поля записи, которые читает records_metrics, и измерения по (created_at, oauth_consumer_key, attempt_type, user_id)
+_RECORD_FIELDS = ('user_id', 'lis_result_sourcedid', 'attempt_type', 'created_at', 'is_correct', 'oauth_consumer_key')
+_RECORD_DIMENSIONS = {
+    'day': lambda row: row[0].date(),
+    'week': lambda row: (row[0] - timedelta(days=row[0].weekday())).date(),
+    'oauth_consumer_key': itemgetter(1),
+    'attempt_type': itemgetter(2),
+    'user_id': itemgetter(3),
+}
+
+
+def records_metrics(records, start=None, end=None, group_by=()):
+    """Те же метрики, что query_metrics, по обработанным записям в памяти (process_data), без БД
+        - records — records.AttemptBatch (читается по столбцам, без объектов на запись),
+          records.Attempt или словари
+        - start, end, group_by — как в query_metrics
+        - дубли по естественному ключу считаются один раз, как после загрузки в attempts
+    """
+    import pandas as pd
+
+    dimensions = _dimensions(group_by)
+    start, end = _as_datetime(start), _as_datetime(end)
+    if hasattr(records, 'iter_rows'):
+        rows = records.iter_rows(_RECORD_FIELDS)
+    else:
+        records = list(records)
+        getter = (itemgetter if records and isinstance(records[0], dict) else attrgetter)(*_RECORD_FIELDS)
+        rows = map(getter, records)
+    key_functions = [_RECORD_DIMENSIONS[name] for name in dimensions]
+
+    seen = set()
+    groups = {}
+    for user_id, sourcedid, attempt_type, created_at, is_correct, consumer_key in rows:
+        created_at = _as_datetime(created_at)
+        if start is not None and created_at < start or end is not None and created_at >= end:
+            continue
+        natural_key = (user_id, sourcedid, attempt_type, created_at)
+        if natural_key in seen:
+            continue
+        seen.add(natural_key)
+        row = (created_at, consumer_key, attempt_type, user_id)
+        key = tuple(function(row) for function in key_functions)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0, 0, 0, 0, set(), created_at, created_at]
+        group[0] += 1
+        group[1] += is_correct is True
+        group[2] += attempt_type == 'submit'
+        group[3] += attempt_type == 'run'
+        group[4].add(user_id)
+        group[5] = min(group[5], created_at)
+        group[6] = max(group[6], created_at)
+    if not dimensions and not groups:
+        # Как и в SQL: без разбивки и без строк — одна строка с нулями
+        groups[()] = [0, 0, 0, 0, set(), None, None]
+
+    # Порядок как ORDER BY в SQL: NULL после остальных значений
+    ordered = sorted(groups.items(), key=lambda item: [(value is None, value) for value in item[0]])
+    rows = [(*key, total, correct, submits, runs, len(users), first, last)
+            for key, (total, correct, submits, runs, users, first, last) in ordered]
+    columns = dimensions + list(METRIC_COLUMNS)
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pd.DataFrame({column: list(column_values) for column, column_values in zip(columns, values)},
+                        columns=columns)
+
+
+def query_metrics(start=None, end=None, group_by=(), source='auto'):
+    """Метрики попыток за период с разбивкой по измерениям — один SQL-запрос на срез отчёта
+        - start, end — границы created_at (date, datetime или строка), end не включается; None — без границы
+        - group_by — измерения из DIMENSIONS: day, week, oauth_consumer_key, attempt_type, user_id
+        - source='auto' — по дневным агрегатам, если разбивка только по day/week и границы
+          периода приходятся на начало суток, иначе по attempts (фильтр по индексу created_at);
+          'rollup' и 'attempts' задают источник явно; 'parquet' — по выгрузке export.py, без БД
+        - возвращает DataFrame: столбцы измерений, затем METRIC_COLUMNS; без group_by — одна строка
+        - большие разбивки (по user_id) лучше читать частями: iter_metrics
+    """
+    return _concat(iter_metrics(start, end, group_by, source), _dimensions(group_by) + list(METRIC_COLUMNS))
+
+
+def _concat(frames, columns):
+    """Части результата одним DataFrame; без частей — пустой DataFrame со столбцами columns"""
+    import pandas as pd
+
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame({column: [] for column in columns}, columns=columns)
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def iter_metrics(start=None, end=None, group_by=(), source='auto', itersize=READ_ITERSIZE):
+    """query_metrics частями: DataFrame на каждые itersize строк результата (генератор)
+        - строки читаются серверным курсором (см. db_reader.py), поэтому отчёт по миллионам
+          групп (например, group_by=('user_id', 'day')) не загружается в память целиком
+        - части идут в порядке ORDER BY по измерениям; пустой результат с разбивкой — ни одной части
+        - source='parquet' отдаёт результат одной частью
+    """
+    dimensions = _dimensions(group_by)
+    source = _metrics_source(dimensions, start, end, source)
+    if source == 'parquet':
+        yield _parquet_metrics(dimensions, start, end)
+        return
+    yield from iter_frames(*metrics_query(start, end, dimensions, source), itersize)
+
+
+def _metrics_source(dimensions, start, end, source):
+    if source != 'auto':
+        return source
+    rollup_ok = all(DIMENSIONS[name][1] for name in dimensions)
+    return 'rollup' if rollup_ok and _is_day_boundary(start) and _is_day_boundary(end) else 'attempts'
+
+
+def metrics_query(start=None, end=None, group_by=(), source='auto'):
+    """SQL-запрос query_metrics и его параметры — для чтения своим способом (например, db_reader.iter_arrow_batches)
+        - source — 'auto', 'rollup' или 'attempts', как в query_metrics
+    """
+    dimensions = _dimensions(group_by)
+    if _metrics_source(dimensions, start, end, source) == 'rollup':
+        return _rollup_query(dimensions, start, end)
+    return _attempts_query(dimensions, start, end)
+
+PROGRESS_REPORT_COLUMNS = ('user_id', 'lis_result_sourcedid') + PROGRESS_COLUMNS + ('run_submit_ratio', 'success_rate')
+ASSIGNMENT_COLUMNS = (
+    'lis_result_sourcedid', 'users', 'solved_users', 'total_attempts', 'submits', 'correct_submits',
+    'success_rate', 'avg_attempts_to_first_correct',
+)
+
+
+def _progress_filter(user_ids, sourcedids, solved):
+    conditions, params = [], []
+    if user_ids is not None:
+        conditions.append("user_id = ANY(%s)")
+        params.append(list(user_ids))
+    if sourcedids is not None:
+        conditions.append("lis_result_sourcedid = ANY(%s)")
+        params.append(list(sourcedids))
+    if solved is not None:
+        conditions.append(f"first_correct_at IS {'NOT ' if solved else ''}NULL")
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def query_progress(user_ids=None, sourcedids=None, solved=None):
+    """Прогресс пользователей по заданиям из user_progress (см. progress.py), без скана attempts
+        - user_ids, sourcedids — только эти пользователи и задания (lis_result_sourcedid); None — все
+        - solved=True — только пары с верным submit, False — без него
+        - возвращает DataFrame со столбцами PROGRESS_REPORT_COLUMNS, по ключу (user_id, lis_result_sourcedid):
+          attempts_to_first_correct — попыток до первого верного submit включительно,
+          success_rate — доля верных submit (None, если submit не было)
+    """
+    where, params = _progress_filter(user_ids, sourcedids, solved)
+    query = f'''
+        SELECT user_id, lis_result_sourcedid, {', '.join(PROGRESS_COLUMNS)}, run_submit_ratio,
+               correct_submits::double precision / NULLIF(submits, 0) AS success_rate
+        FROM user_progress
+        {where}
+        ORDER BY user_id, lis_result_sourcedid
+    '''
+    return _concat(iter_frames(query, params), PROGRESS_REPORT_COLUMNS)
+
+
+def assignment_progress(sourcedids=None):
+    """Сводка по заданиям из user_progress: пользователей, решивших, попыток, доля верных submit
+        - sourcedids — только эти задания; None — все
+        - avg_attempts_to_first_correct — среднее число попыток до первого верного submit у решивших
+        - возвращает DataFrame со столбцами ASSIGNMENT_COLUMNS, по lis_result_sourcedid
+    """
+    where, params = _progress_filter(None, sourcedids, None)
+    query = f'''
+        SELECT
+            lis_result_sourcedid,
+            COUNT(*) AS users,
+            COUNT(first_correct_at) AS solved_users,
+            SUM(total_attempts)::bigint AS total_attempts,
+            SUM(submits)::bigint AS submits,
+            SUM(correct_submits)::bigint AS correct_submits,
+            SUM(correct_submits)::double precision / NULLIF(SUM(submits), 0) AS success_rate,
+            AVG(attempts_to_first_correct)::double precision AS avg_attempts_to_first_correct
+        FROM user_progress
+        {where}
+        GROUP BY lis_result_sourcedid
+        ORDER BY lis_result_sourcedid
+    '''
+    return _concat(iter_frames(query, params), ASSIGNMENT_COLUMNS)
+
+
+@metrics.timed('aggregate')
+def aggregate_data(start=None, end=None, source='auto'):
+    """Общие метрики за период (по умолчанию за всю историю) в виде DataFrame «Метрика — Значение»
+        - source — как в query_metrics: 'parquet' считает по выгрузке export.py, не нагружая БД
+    """
+    import pandas as pd
+
+    try:
+        totals = query_metrics(start, end, source=source).to_dict('records')[0]
+        df = pd.DataFrame({
+            'Метрика': list(METRIC_LABELS.values()),
+            'Значение': [totals[column] for column in METRIC_LABELS],
+        })
         logging.info("=== Агрегированные метрики ===")
-        for _, row in df.iterrows():
-            logging.info(f"{row['Метрика']}: {row['Значение']}")
+        for name, value in zip(df['Метрика'], df['Значение']):
+            logging.info(f"{name}: {value}")
 
         return df
 
@@ -65,62 +398,61 @@ def aggregate_data():
         return None
 
 
-def upload_to_google_sheets(metrics_df, credentials_path='credentials.json', spreadsheet_id=None):
+@metrics.timed('sheets_upload')
+def upload_to_google_sheets(metrics_df, credentials_path='credentials.json', spreadsheet_id=None, sheet=None,
+                           force=False):
     """
-    Выгружает DataFrame в Google Sheets
+    Выгружает DataFrame в Google Sheets (только изменившиеся ячейки, см. sheets_sync.py)
     :param metrics_df: DataFrame с метриками
     :param credentials_path: путь к credentials.json
     :param spreadsheet_id: ID Google Таблицы
+    :param sheet: название листа (по умолчанию первый лист)
+    :param force: очистить лист и записать целиком, не сравнивая со снимком прошлой выгрузки
+    :return: True, если выгрузка прошла успешно
     """
+    return upload_tables({sheet: metrics_df}, credentials_path, spreadsheet_id, force)
+
+
+def upload_tables(tables, credentials_path='credentials.json', spreadsheet_id=None, force=False):
+    """
+    Выгружает несколько DataFrame на листы одной Google Таблицы одним пакетом изменений
+    :param tables: {название листа: DataFrame}; None вместо названия — первый лист
+    :return: True, если выгрузка прошла успешно; при ошибке таблицы сохраняются локально в CSV
+    """
+    import requests
+    from sheets_sync import SheetsSync, dataframe_rows, get_sheets_session
+
+    # Проверка входных данных
+    if not spreadsheet_id:
+        logging.critical("❌ Не указан ID таблицы")
+        return False
+    if not tables or any(df is None or df.empty for df in tables.values()):
+        logging.critical("❌ Нет данных для выгрузки")
+        return False
+
     try:
-        # gc = gspread.service_account(filename=credentials_path)
-        # import gspread
-        from google.oauth2 import service_account
-        import requests
-        from urllib3.util import create_urllib3_context
-
-        # Проверка входных данных
-        if not spreadsheet_id:
-            logging.critical("❌ Не указан ID таблицы")
-            return
-        if metrics_df is None or metrics_df.empty:
-            logging.critical("❌ Нет данных для выгрузки")
-            return
-
-        # Создаём учётные данные
-        creds = service_account.Credentials.from_service_account_file(credentials_path)
-
-        # Отключаем SSL-проверку
-        http = create_urllib3_context()
-        http.disable_ssl_certificate_verification = True
-
-        # Создаём сессию requests с отключённой SSL-проверкой
-        session = requests.Session()
-        session.verify = False  # Критически важно
-
-        # Создаём клиент gspread с кастомной сессией
-        gc = gspread.Client(auth=creds)
-        gc.session = session  # ← Передаём сессию с verify=False
-
-        # Открываем таблицу
-        sh = gc.open_by_key(spreadsheet_id)
-        worksheet = sh.get_worksheet(0)
-
-        # Очищаем и обновляем
-        worksheet.clear()
-        worksheet.update([metrics_df.columns.values.tolist()] + metrics_df.values.tolist())
-
-        logging.info(f"✅ Данные успешно загружены в Google Sheets: {sh.url}")
-
-    except gspread.exceptions.SpreadsheetNotFound:
-        logging.error("❌ Таблица не найдена. Проверьте ID и доступ (поделили ли с client_email?).")
+        sync = SheetsSync(spreadsheet_id, get_sheets_session(credentials_path))
+        if None in tables:
+            tables = {(sync.sheet_titles()[0] if title is None else title): df for title, df in tables.items()}
+        sync.sync({title: dataframe_rows(df) for title, df in tables.items()}, force=force)
+        logging.info(f"✅ Данные успешно загружены в Google Sheets: "
+                     f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}")
+        return True
+
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            logging.error("❌ Таблица не найдена. Проверьте ID и доступ (поделили ли с client_email?).")
+        else:
+            logging.error(f"❌ Ошибка при выгрузке в Google Sheets: {e}")
     except Exception as e:
         logging.error(f"❌ Ошибка при выгрузке в Google Sheets: {e}")
 
-        # Сохраняем локально
-        local_path = "metrics_backup.csv"
+    # Сохраняем локально
+    for title, df in tables.items():
+        local_path = "metrics_backup.csv" if len(tables) == 1 else f"metrics_backup_{title}.csv"
         try:
-            metrics_df.to_csv(local_path, index=False)
+            df.to_csv(local_path, index=False)
             logging.info(f"ℹ️ Данные сохранены локально в файл {os.path.abspath(local_path)}")
         except Exception as save_err:
             logging.error(f"❌ Ошибка при сохранении данных локально: {save_err}")
+    return False
@@ -0,0 +1,195 @@
+"""
+Локальный кэш сырых ответов API статистики.
+
+Ответ за окно (client, start, end) сохраняется в API_CACHE_DIR как JSON Lines, сжатый gzip
+(по записи на строку). Список окон с размерами и временем создания и последнего
+обращения хранится в manifest.json.
+
+- Окна, закончившиеся раньше, чем API_CACHE_RECENT_HOURS назад, не меняются и хранятся без срока.
+- Более свежие окна живут API_CACHE_TTL секунд: за это время в API могли дописаться записи.
+- Окна, которые ещё не закончились, не кэшируются.
+- Если кэш больше API_CACHE_MAX_MB, удаляются окна, к которым дольше всего не обращались.
+
+Режим python main.py --replay заново загружает БД из кэша, не обращаясь к API.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import API_CACHE, API_CACHE_DIR, API_CACHE_TTL, API_CACHE_RECENT_HOURS, API_CACHE_MAX_MB
+
+
+class ApiCache:
+    """Кэш ответов API по окнам; потокобезопасен (окна пишутся из пула потоков)"""
+
+    def __init__(self, directory=API_CACHE_DIR, ttl=API_CACHE_TTL, recent_hours=API_CACHE_RECENT_HOURS,
+                 max_bytes=API_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.recent = timedelta(hours=recent_hours)
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        self._lock = threading.Lock()
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self._entries = self._load_manifest()
+
+    @staticmethod
+    def key(client, start, end):
+        return f"{client}|{start}|{end}"
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning(f"Манифест кэша {self._manifest_path} повреждён, кэш начинается заново")
+            return {}
+        # Файлы, удалённые вручную, из манифеста выбрасываются
+        return {key: entry for key, entry in entries.items()
+                if os.path.exists(os.path.join(self.directory, entry['file']))}
+
+    def save(self):
+        """Записывает манифест (атомарно, через временный файл)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self._manifest_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self._manifest_path)
+            self._dirty = False
+
+    def _expired(self, entry, now):
+        return entry['ttl'] is not None and now - entry['created'] > entry['ttl']
+
+    def _ttl_for(self, end):
+        """Срок хранения окна: None — бессрочно, 0 — не кэшировать"""
+        window_end = datetime.fromisoformat(end)
+        now = datetime.now()
+        if window_end >= now:
+            return 0
+        if now - window_end < self.recent:
+            return self.ttl
+        return None
+
+    def _read(self, entry):
+        with gzip.open(os.path.join(self.directory, entry['file']), 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def get(self, client, start, end):
+        """Записи окна из кэша или None, если окна нет, оно устарело или его файл уже не читается"""
+        key = self.key(client, start, end)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                self.stats['misses'] += 1
+                return None
+            entry['used'] = now
+            self._dirty = True
+        # Файл читается вне блокировки: параллельный put() мог успеть вытеснить окно — это промах
+        try:
+            data = list(self._read(entry))
+        except (OSError, EOFError, ValueError) as e:
+            logging.warning(f"Окно кэша {start} — {end} не прочитано ({e}), запрашиваем заново")
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self._dirty = True
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return data
+
+    def put(self, client, start, end, records):
+        """Сохраняет ответ API за окно; незакончившиеся окна не сохраняются"""
+        ttl = self._ttl_for(end)
+        if ttl == 0:
+            return
+        key = self.key(client, start, end)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        file = os.path.join(name[:2], f"{name}.jsonl.gz")
+        path = os.path.join(self.directory, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                'file': file, 'client': client, 'start': start, 'end': end, 'records': len(records),
+                'bytes': os.path.getsize(path), 'created': now, 'used': now, 'ttl': ttl,
+            }
+            self._dirty = True
+            self.stats['stored'] += 1
+            self._evict()
+        # Манифест пишется сразу: окна, скачанные до сбоя, не пропадут
+        self.save()
+
+    def _evict(self):
+        """Удаляет устаревшие окна, затем самые давно не использованные, пока кэш больше max_bytes
+        (вызывается под блокировкой)"""
+        now = time.time()
+        victims = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        total = sum(entry['bytes'] for key, entry in self._entries.items() if key not in victims)
+        if total > self.max_bytes:
+            for key in sorted(self._entries, key=lambda key: self._entries[key]['used']):
+                if total <= self.max_bytes:
+                    break
+                if key not in victims:
+                    victims.append(key)
+                    total -= self._entries[key]['bytes']
+        for key in victims:
+            entry = self._entries.pop(key)
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+            self.stats['evicted'] += 1
+            self._dirty = True
+
+    def entries(self, client, start=None, end=None):
+        """Окна клиента, пересекающиеся с [start, end], по возрастанию начала (устаревшие тоже)"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values() if entry['client'] == client
+                       and (start is None or entry['end'] >= start) and (end is None or entry['start'] <= end)]
+        return sorted(entries, key=lambda entry: (entry['start'], entry['end']))
+
+    def iter_records(self, client, start=None, end=None):
+        """Записи всех окон клиента за [start, end] (генератор, по окну в памяти за раз)
+            - если окна с разными границами пересекаются, записи могут повторяться;
+              при загрузке в БД повторы отсекает ключ дедупликации
+            - записи без строки created_at (и не словари) не отфильтровываются, а отдаются как есть:
+              их отклонит validate_record, как при загрузке из API, и они попадут в карантин
+        """
+        for entry in self.entries(client, start, end):
+            for record in self._read(entry):
+                created_at = record.get('created_at') if isinstance(record, dict) else None
+                if not created_at or not isinstance(created_at, str):
+                    yield record
+                elif (start is None or created_at >= start) and (end is None or created_at <= end):
+                    yield record
+
+    def close(self):
+        self.save()
+        total = sum(entry['bytes'] for entry in self._entries.values())
+        logging.info(f"Кэш API: {self.stats}, окон {len(self._entries)}, {total / 1024 / 1024:.1f} МБ")
+
+
+def open_cache():
+    """Кэш ответов API, если он включён (API_CACHE), иначе None"""
+    return ApiCache() if API_CACHE else None
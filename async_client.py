@@ -0,0 +1,213 @@
+"""
+Асинхронный клиент API статистики на aiohttp (FETCH_MODE=async).
+
+Одна сессия aiohttp с пулом keep-alive соединений на весь запуск; окна периода
+запрашиваются одновременно (не больше ASYNC_CONCURRENCY запросов сразу), а частоту
+запросов ограничивает token bucket (ASYNC_RATE_LIMIT запросов в секунду, всплеск до ASYNC_RATE_BURST).
+
+Политика повторов та же, что у get_session_with_retries: до 3 повторов на 429/5xx и ошибки
+соединения с экспоненциальной задержкой (1, 2, 4 с), но со случайным разбросом (jitter),
+чтобы одновременные запросы не повторялись синхронно. Тяжёлые окна дробятся так же,
+как в fetch_window_adaptive.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+
+import aiohttp
+
+from config import (API_URL, CLIENT, CLIENT_KEY, SSL_VERIFY, FETCH_WINDOW, FETCH_TIMEOUT, FETCH_MAX_ROWS,
+                    FETCH_MIN_WINDOW, ASYNC_CONCURRENCY, ASYNC_RATE_LIMIT, ASYNC_RATE_BURST)
+from main import split_time_range, halve_window
+import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    """API ответило ошибкой, которую не исправили повторы"""
+
+    def __init__(self, status, text):
+        super().__init__(f"Ошибка API: {status}, {text[:200]}")
+        self.status = status
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: rate токенов в секунду, в запасе не больше capacity
+        - rate <= 0 — без ограничения
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def backoff_delay(attempt, backoff_factor, retry_after=None):
+    """Задержка перед повтором attempt (с нуля): backoff_factor * 2^attempt с разбросом ±50%,
+    но не меньше Retry-After, если сервер его прислал"""
+    delay = backoff_factor * 2 ** attempt * random.uniform(0.5, 1.5)
+    if retry_after is not None:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class AsyncStatisticsClient:
+    """Клиент API статистики: пул соединений, ограничение частоты и повторы
+        - используется как async-контекстный менеджер: сессия закрывается при выходе
+    """
+
+    def __init__(self, url=API_URL, concurrency=ASYNC_CONCURRENCY, rate=ASYNC_RATE_LIMIT, burst=ASYNC_RATE_BURST,
+                 timeout=FETCH_TIMEOUT, retries=3, backoff_factor=1.0):
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.bucket = TokenBucket(rate, burst)
+        self.stats = {'requests': 0, 'retries': 0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=None if SSL_VERIFY else False)
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def request_window(self, start, end):
+        """Один запрос за период [start, end] с повторами на 429/5xx и ошибки соединения
+            - таймаут не повторяется, а пробрасывается (asyncio.TimeoutError), чтобы окно можно было уменьшить
+        """
+        params = {'client': CLIENT, 'client_key': CLIENT_KEY, 'start': start, 'end': end}
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            retry_after = None
+            async with self._semaphore:
+                self.stats['requests'] += 1
+                try:
+                    started = time.perf_counter()
+                    async with self._session.get(self.url, params=params, timeout=timeout) as response:
+                        body = await response.read()
+                    metrics.observe('fetch_window_seconds', time.perf_counter() - started)
+                    metrics.inc('fetch_requests', status=response.status)
+                    metrics.inc('fetch_bytes', len(body))
+                    if response.status == 200:
+                        with metrics.timer('fetch_parse_seconds'):
+                            data = json.loads(body)
+                        metrics.inc('fetch_records', len(data))
+                        return data
+                    text = body.decode('utf-8', 'replace')
+                    if response.status not in RETRY_STATUSES or attempt == self.retries:
+                        raise APIError(response.status, text)
+                    retry_after = response.headers.get('Retry-After')
+                    reason = f"статус {response.status}"
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+                    if attempt == self.retries:
+                        raise
+                    reason = f"ошибка соединения: {e}"
+            self.stats['retries'] += 1
+            delay = backoff_delay(attempt, self.backoff_factor, retry_after)
+            logging.debug(f"Окно {start} — {end}: {reason}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    async def fetch_window(self, start, end, max_rows=FETCH_MAX_ROWS, min_window=FETCH_MIN_WINDOW):
+        """Окно с дроблением пополам при таймауте или слишком большом ответе (как fetch_window_adaptive)
+            - половины запрашиваются одновременно
+        """
+        try:
+            data = await self.request_window(start, end)
+            if len(data) < max_rows:
+                return data
+            reason = f"получено {len(data)} записей"
+        except asyncio.TimeoutError:
+            data = None
+            reason = f"таймаут {self.timeout} с"
+
+        halves = halve_window(start, end, min_window)
+        if halves is None:
+            if data is None:
+                raise asyncio.TimeoutError(f"Таймаут на минимальном окне {start} — {end}")
+            logging.warning(f"Окно {start} — {end} вернуло {len(data)} записей, но дробить его дальше нельзя")
+            return data
+
+        logging.info(f"Окно {start} — {end} уменьшено вдвое: {reason}")
+        parts = await asyncio.gather(*(self.fetch_window(s, e, max_rows, min_window) for s, e in halves))
+        return [record for part in parts for record in part]
+
+    async def fetch_window_cached(self, start, end, cache=None):
+        """fetch_window через кэш ответов API (см. api_cache.py)"""
+        if cache is not None:
+            data = cache.get(CLIENT, start, end)
+            if data is not None:
+                return data
+        data = await self.fetch_window(start, end)
+        if cache is not None:
+            cache.put(CLIENT, start, end, data)
+        return data
+
+    async def fetch(self, start, end, window=FETCH_WINDOW, cache=None):
+        """Все окна периода одновременно; упавшие окна повторяются по одному после основного прохода
+            - cache — ApiCache: окна из кэша не запрашиваются
+            - возвращает записи в порядке окон; если окно так и не загрузилось — исключение
+        """
+        windows = split_time_range(start, end, window)
+        results = await asyncio.gather(*(self.fetch_window_cached(s, e, cache) for s, e in windows),
+                                       return_exceptions=True)
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logging.warning(f"Окно {windows[i][0]} — {windows[i][1]} не загружено: {result!r}. Повторим")
+                results[i] = await self.fetch_window_cached(*windows[i], cache)
+        return [record for chunk in results for record in chunk]
+
+
+@metrics.timed('fetch')
+def fetch_data_async(start, end, window=FETCH_WINDOW, url=API_URL, cache=None, **client_options):
+    """Получает данные из API асинхронным клиентом (синхронная обёртка для main)
+        - cache — ApiCache: окна из кэша не запрашиваются
+        - client_options — параметры AsyncStatisticsClient (concurrency, rate, burst, timeout, ...)
+        - возвращает список записей (пустой — новых записей нет); если окно так и не загрузилось,
+          логирует ошибку и выбрасывает исключение
+    """
+    async def run():
+        async with AsyncStatisticsClient(url, **client_options) as client:
+            try:
+                return await client.fetch(start, end, window, cache)
+            finally:
+                logging.info(f"Асинхронный клиент: запросов {client.stats['requests']}, "
+                             f"повторов {client.stats['retries']}")
+
+    logging.info(f"Асинхронный запрос данных с {start} по {end} ({window})")
+    if not SSL_VERIFY:
+        logging.warning("SSL-проверка отключена. Убедитесь, что соединение безопасно.")
+    started = time.perf_counter()
+    try:
+        data = asyncio.run(run())
+    except Exception as e:
+        logging.error(f"Исключение при асинхронном запросе к API: {e!r}")
+        raise
+    logging.info(f"Успешно получено {len(data)} записей из API за {time.perf_counter() - started:.2f} с")
+    return data
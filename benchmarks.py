@@ -0,0 +1,545 @@
+"""
+Бенчмарки пайплайна на синтетических данных (см. synthetic.py).
+
+Запуск:
+    python benchmarks.py stream --sizes 10000 1000000 5000000
+    python benchmarks.py fetch --records 200000 --modes windowed async stream   (локальный mock API)
+    python benchmarks.py process --records 500000 --engines python dicts vectorized --invalid-ratio 0.05
+    python benchmarks.py insert --records 100000   (нужен локальный PostgreSQL из .env)
+    python benchmarks.py aggregate --records 200000   (PostgreSQL, отдельная схема flowtrack_bench)
+    python benchmarks.py passback --records 200000 --duplicate-ratios 0 0.5 0.9 0.99
+    python benchmarks.py workers --records 500000 --max-workers 8
+    python benchmarks.py imports --commands cli ingest aggregate export email --repeat 5
+
+Результаты сохраняются в JSON (--output, по умолчанию benchmarks/<сценарий>-<дата>.json)
+вместе с версией кода. --baseline сравнивает прогон с прошлым файлом: если строк/с стало
+меньше, пиковая память или время импорта больше, чем на --tolerance, это регрессия (код выхода 1).
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Поля результата, которые задают прогон (а не измеряются); по ним прогоны сопоставляются с baseline
+KEY_FIELDS = ('scenario', 'mode', 'engine', 'method', 'source', 'records', 'batch_size',
+              'duplicate_ratio', 'invalid_ratio', 'workers', 'latency', 'command')
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ (ru_maxrss на Linux — в КБ)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    """Текущий RSS процесса в МБ (/proc/self/statm на Linux; на других системах — пиковый)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def run_child(scenario, *args):
+    """Запускает сценарий в отдельном процессе, чтобы пиковый RSS не смешивался между прогонами"""
+    output = subprocess.run(
+        [sys.executable, __file__, '_child', scenario, *map(str, args)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def child_stream(count, mode):
+    """Синтетический ответ API → разбор → валидация → пачки для БД (без самой БД)
+        - mode=stream: iter_json_array + iter_processed + batched
+        - mode=list: весь ответ в память, json.loads и process_data, как раньше
+    """
+    import logging
+    from main import iter_json_array, iter_processed, process_data
+    from database import batched
+    from config import STREAM_BATCH_SIZE
+    from synthetic import generate_records, iter_json_bytes
+
+    logging.disable(logging.INFO)
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    chunks = iter_json_bytes(generate_records(count))
+    rows = 0
+    if mode == 'stream':
+        for batch in batched(iter_processed(iter_json_array(chunks)), STREAM_BATCH_SIZE):
+            rows += len(batch)
+    else:
+        processed = process_data(json.loads(b''.join(chunks)), compact=True)
+        rows = len(processed)
+    elapsed = time.perf_counter() - started
+    return {
+        'scenario': 'stream', 'mode': mode, 'records': count, 'rows': rows,
+        'seconds': round(elapsed, 3), 'rows_per_s': round(rows / elapsed) if elapsed else None,
+        'baseline_rss_mb': round(baseline, 1), 'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def child_fetch(count, mode, latency):
+    """Получение ответа API с локального mock API (synthetic.generate_records за сутки, окна по часу)
+        - mode — windowed (пул потоков), async (aiohttp) или stream (потоковый разбор)
+        - mock API работает в том же процессе: его записи входят в baseline_rss_mb
+    """
+    import logging
+    import main
+    from mock_api import MockStatisticsAPI
+    from synthetic import generate_records
+
+    logging.disable(logging.CRITICAL)
+    start, end = '2023-05-31 00:00:00.000000', '2023-05-31 23:59:59.999999'
+    with MockStatisticsAPI(generate_records(count), latency=latency) as api:
+        main.API_URL = api.url
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        if mode == 'windowed':
+            rows = len(main.fetch_data_windowed(start, end, window='hour'))
+        elif mode == 'async':
+            from async_client import fetch_data_async
+            rows = len(fetch_data_async(start, end, window='hour', url=api.url, rate=0))
+        else:
+            rows = sum(1 for _ in main.fetch_data_stream(start, end, window='hour'))
+        elapsed = time.perf_counter() - started
+        requests_made = api.stats['requests']
+    return {
+        'scenario': 'fetch', 'mode': mode, 'records': count, 'latency': latency, 'rows': rows,
+        'requests': requests_made, 'seconds': round(elapsed, 3), 'rows_per_s': round(rows / elapsed),
+        'baseline_rss_mb': round(baseline, 1), 'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def child_process(count, engine, invalid_ratio):
+    """Валидация записей API движком engine
+        - python — process_data(compact=True) (компактные records.Attempt), dicts — process_data (словари),
+          vectorized — iter_processed_columns
+        - записи генерируются заранее, в замер входит только валидация
+        - result_mb — сколько памяти занимает результат (RSS после валидации минус RSS до неё)
+    """
+    import logging
+    from main import iter_processed_columns, process_data
+    from synthetic import generate_records
+
+    logging.disable(logging.CRITICAL)
+    raw = list(generate_records(count, invalid_ratio=invalid_ratio))
+    baseline = peak_rss_mb()
+    current = current_rss_mb()
+    started = time.perf_counter()
+    if engine == 'vectorized':
+        processed = list(iter_processed_columns(raw))
+        rows = sum(len(batch['user_id']) for batch in processed)
+    else:
+        processed = process_data(raw, compact=engine != 'dicts')
+        rows = len(processed)
+    elapsed = time.perf_counter() - started
+    return {
+        'scenario': 'process', 'engine': engine, 'records': count, 'invalid_ratio': invalid_ratio, 'rows': rows,
+        'seconds': round(elapsed, 3), 'rows_per_s': round(count / elapsed),
+        'baseline_rss_mb': round(baseline, 1), 'peak_rss_mb': round(peak_rss_mb(), 1),
+        'result_mb': round(current_rss_mb() - current, 1),
+    }
+
+
+def bench_fetch(count, modes, latency):
+    results = []
+    for mode in modes:
+        result = run_child('fetch', count, mode, latency)
+        print(f"{mode:>8} | {result['rows']:>9} записей | {result['requests']:>4} запросов | {result['seconds']:>8} с | "
+              f"{result['rows_per_s']:>8} записей/с | пиковый RSS {result['peak_rss_mb']} МБ")
+        results.append(result)
+    return results
+
+
+def bench_process(count, engines, invalid_ratio):
+    results = []
+    for engine in engines:
+        result = run_child('process', count, engine, invalid_ratio)
+        print(f"{engine:>10} | {count:>9} записей (принято {result['rows']}) | {result['seconds']:>8} с | "
+              f"{result['rows_per_s']:>8} записей/с | пиковый RSS {result['peak_rss_mb']} МБ | "
+              f"результат {result['result_mb']} МБ")
+        results.append(result)
+    return results
+
+
+def bench_stream(sizes, modes):
+    results = []
+    for count in sizes:
+        for mode in modes:
+            result = run_child('stream', count, mode)
+            print(f"{mode:>6} | {count:>9} записей | {result['seconds']:>8} с | "
+                  f"пиковый RSS {result['peak_rss_mb']} МБ (на старте {result['baseline_rss_mb']} МБ)")
+            results.append(result)
+    return results
+
+
+def bench_insert(count, methods, batch_size):
+    """Сравнивает скорость загрузки в PostgreSQL (строк/с) для copy, values и executemany
+        - пишет в таблицу attempts_bench в схеме flowtrack_bench (см. bench_schema): таблицы из .env
+          и их счётчик id не затрагиваются, после прогона схема удаляется
+    """
+    import logging
+    from database import load_records, ATTEMPT_COLUMNS
+    from db_pool import get_connection
+    from main import process_data
+    from synthetic import generate_records
+
+    logging.disable(logging.INFO)
+    records = process_data(generate_records(count), compact=True)
+
+    def execute(sql):
+        with get_connection() as conn:
+            conn.cursor().execute(sql)
+            conn.commit()
+
+    results = []
+    with bench_schema():
+        # Столбцы как у attempts, но без секций и со своим счётчиком id
+        execute('''
+            CREATE TABLE attempts_bench (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                user_id VARCHAR(100),
+                oauth_consumer_key TEXT,
+                lis_result_sourcedid TEXT,
+                lis_outcome_service_url TEXT,
+                is_correct BOOLEAN,
+                attempt_type VARCHAR(10),
+                created_at TIMESTAMP NOT NULL,
+                client TEXT
+            )
+        ''')
+        for method in methods:
+            execute("TRUNCATE attempts_bench")
+            started = time.perf_counter()
+            loaded = load_records(records, 'attempts_bench', ATTEMPT_COLUMNS, method, batch_size)
+            elapsed = time.perf_counter() - started
+            result = {
+                'scenario': 'insert', 'method': method, 'records': loaded, 'batch_size': batch_size,
+                'seconds': round(elapsed, 3), 'rows_per_s': round(loaded / elapsed),
+            }
+            print(f"{method:>11} | {loaded:>8} строк | {result['seconds']:>8} с | {result['rows_per_s']:>8} строк/с")
+            results.append(result)
+    return results
+
+
+@contextmanager
+def bench_schema():
+    """Отдельная схема flowtrack_bench: общий пул соединений на время блока переключается на неё,
+    после прогона схема удаляется (таблицы из .env не затрагиваются)"""
+    import db_pool
+    from config import DB_CONFIG
+
+    def execute(sql):
+        with db_pool.get_connection() as conn:
+            conn.cursor().execute(sql)
+            conn.commit()
+
+    execute("DROP SCHEMA IF EXISTS flowtrack_bench CASCADE")
+    execute("CREATE SCHEMA flowtrack_bench")
+    shared = db_pool._pool
+    db_pool._pool = db_pool.ConnectionPool(1, 2, options='-c search_path=flowtrack_bench', **DB_CONFIG)
+    try:
+        yield
+    finally:
+        db_pool._pool.closeall()
+        db_pool._pool = shared
+        execute("DROP SCHEMA flowtrack_bench CASCADE")
+
+
+def bench_aggregate(count, sources, repeat, invalid_ratio):
+    """Время aggregate_data за всю историю по attempts (полный скан) и по дневным агрегатам
+        - в схему flowtrack_bench загружается count синтетических записей за неделю
+        - каждый источник считается repeat раз, в результат идут лучшее и среднее время
+    """
+    import logging
+    from analytics import aggregate_data
+    from database import create_table, insert_attempts
+    from main import process_data
+    from synthetic import generate_records
+
+    logging.disable(logging.CRITICAL)
+    results = []
+    with bench_schema():
+        create_table()
+        rows = insert_attempts(process_data(generate_records(count, spread_hours=24 * 7,
+                                                             invalid_ratio=invalid_ratio), compact=True))
+        for source in sources:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if aggregate_data(source=source) is None:
+                    raise RuntimeError(f"aggregate_data(source={source!r}) завершилась ошибкой")
+                timings.append(time.perf_counter() - started)
+            result = {
+                'scenario': 'aggregate', 'source': source, 'records': count, 'invalid_ratio': invalid_ratio,
+                'rows': rows, 'seconds': round(min(timings), 4), 'mean_s': round(sum(timings) / repeat, 4),
+                'rows_per_s': round(rows / min(timings)),
+            }
+            print(f"{source:>9} | {rows:>9} строк | лучшее {result['seconds']:>8} с | среднее {result['mean_s']:>8} с")
+            results.append(result)
+    return results
+
+
+def bench_passback(count, duplicate_ratios):
+    """Разбор passback_params: ast.literal_eval на каждую запись против passback.parse_passback_params
+    (json-путь + LRU-кэш) при разной доле повторяющихся строк"""
+    import ast
+    import logging
+    from passback import parse_passback_params, parse_stats, reset_parse_stats
+    from synthetic import generate_records
+
+    logging.disable(logging.WARNING)
+    results = []
+    for ratio in duplicate_ratios:
+        raw = [record['passback_params'] for record in generate_records(count, duplicate_ratio=ratio)]
+
+        started = time.perf_counter()
+        for value in raw:
+            ast.literal_eval(value)
+        baseline = time.perf_counter() - started
+
+        reset_parse_stats()
+        started = time.perf_counter()
+        for value in raw:
+            parse_passback_params(value)
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'scenario': 'passback', 'records': count, 'duplicate_ratio': ratio,
+            'literal_eval_s': round(baseline, 3), 'parser_s': round(elapsed, 3),
+            'speedup': round(baseline / elapsed, 1), 'rows_per_s': round(count / elapsed), 'stats': parse_stats(),
+        }
+        print(f"дубли {ratio:>5} | literal_eval {result['literal_eval_s']:>7} с | "
+              f"парсер {result['parser_s']:>7} с | x{result['speedup']} | {result['stats']}")
+        results.append(result)
+    return results
+
+
+def bench_workers(count, max_workers):
+    """Масштабирование process_data по числу процессов: 1, 2, 4, ... до max_workers"""
+    import logging
+    from main import process_data
+    from passback import reset_parse_stats
+    from synthetic import generate_records
+
+    logging.disable(logging.INFO)
+    raw = list(generate_records(count, duplicate_ratio=0.0))
+    counts = sorted({1, max_workers, *(2 ** k for k in range(1, max_workers.bit_length()) if 2 ** k < max_workers)})
+    results = []
+    single = None
+    for workers in counts:
+        reset_parse_stats()
+        started = time.perf_counter()
+        rows = len(process_data(raw, workers=workers, compact=True))
+        elapsed = time.perf_counter() - started
+        single = single or elapsed
+        result = {
+            'scenario': 'workers', 'records': count, 'workers': workers, 'rows': rows,
+            'seconds': round(elapsed, 3), 'rows_per_s': round(rows / elapsed), 'speedup': round(single / elapsed, 2),
+        }
+        print(f"процессов {workers:>3} | {result['seconds']:>8} с | {result['rows_per_s']:>8} строк/с | x{result['speedup']}")
+        results.append(result)
+    return results
+
+
+def parse_importtime(stderr):
+    """Вывод python -X importtime → [(модуль, глубина вложенности, собственное время мкс, с вложенными мкс)]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), depth, int(own), int(cumulative)))
+    return entries
+
+
+def bench_imports(commands, repeat):
+    """Время импорта модуля команды flowtrack.py (python -X importtime в новом процессе)
+        - cli — сам flowtrack.py (разбор аргументов, --help), без модуля команды
+        - берётся лучший из repeat запусков; в результате — самые тяжёлые прямые импорты модуля
+    """
+    from flowtrack import COMMANDS
+
+    results = []
+    for command in commands:
+        module = 'flowtrack' if command == 'cli' else COMMANDS[command][0]
+        runs = []
+        for _ in range(repeat):
+            stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    check=True, capture_output=True, text=True).stderr
+            entries = parse_importtime(stderr)
+            # Модуль команды — последний импорт верхнего уровня; его время включает все зависимости
+            total = next(cumulative for name, depth, _, cumulative in reversed(entries)
+                         if depth == 0 and name == module)
+            runs.append((total, entries))
+        total, entries = min(runs, key=lambda run: run[0])
+        position = max(i for i, entry in enumerate(entries) if entry[0] == module and entry[1] == 0)
+        children = []
+        for name, depth, _, cumulative in reversed(entries[:position]):
+            if depth == 0:
+                break
+            if depth == 1:
+                children.append((name, cumulative))
+        heaviest = sorted(children, key=lambda child: -child[1])[:5]
+        result = {
+            'scenario': 'imports', 'command': command, 'module': module, 'import_ms': round(total / 1000, 1),
+            'heaviest_ms': {name: round(cumulative / 1000, 1) for name, cumulative in heaviest},
+        }
+        print(f"{command:>10} | {module:>20} | {result['import_ms']:>8} мс | "
+              + ", ".join(f"{name} {ms}" for name, ms in result['heaviest_ms'].items()))
+        results.append(result)
+    return results
+
+
+CHILDREN = {
+    'stream': lambda count, mode: child_stream(int(count), mode),
+    'fetch': lambda count, mode, latency: child_fetch(int(count), mode, float(latency)),
+    'process': lambda count, engine, invalid_ratio: child_process(int(count), engine, float(invalid_ratio)),
+}
+
+
+def environment():
+    """Версия кода и окружения, на которых снят прогон"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit, 'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(path, scenario, results):
+    """Пишет прогон в JSON: {'environment': ..., 'scenario': ..., 'results': [...]}"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'scenario': scenario, 'results': results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"Результаты: {path}")
+
+
+def result_key(result):
+    return tuple((field, result[field]) for field in KEY_FIELDS if field in result)
+
+
+def compare_results(results, baseline, tolerance):
+    """Сравнивает прогон с baseline (содержимое прошлого JSON) по одинаковым параметрам прогона
+        - регрессия — rows_per_s меньше или peak_rss_mb больше baseline более чем на tolerance (доля)
+        - возвращает список описаний регрессий
+    """
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        name = ', '.join(f"{field}={value}" for field, value in result_key(result))
+        for metric, worse in (('rows_per_s', -1), ('peak_rss_mb', 1), ('import_ms', 1)):
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            line = f"{name}: {metric} {old[metric]} → {result[metric]} ({change:+.1%})"
+            if change * worse > tolerance:
+                regressions.append(line)
+                print(f"РЕГРЕССИЯ {line}")
+            else:
+                print(f"  {line}")
+    return regressions
+
+
+def main(argv=None):
+    """Бенчмарк по аргументам командной строки; возвращает код выхода (1 — есть регрессии относительно baseline)"""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) > 1 and argv[0] == '_child':
+        print(json.dumps(CHILDREN[argv[1]](*argv[2:])))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Бенчмарки FlowTrack")
+    parser.add_argument('--output', help="файл JSON с результатами (по умолчанию benchmarks/<сценарий>-<дата>.json)")
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="допустимое ухудшение относительно baseline, доля (по умолчанию 0.1)")
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    stream = subparsers.add_parser('stream', help="пиковая память потокового разбора ответа API")
+    stream.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000, 5_000_000])
+    stream.add_argument('--modes', nargs='+', choices=['stream', 'list'], default=['stream'])
+
+    fetch = subparsers.add_parser('fetch', help="получение ответа API с локального mock API по способам")
+    fetch.add_argument('--records', type=int, default=200_000)
+    fetch.add_argument('--modes', nargs='+', choices=['windowed', 'async', 'stream'],
+                       default=['windowed', 'async', 'stream'])
+    fetch.add_argument('--latency', type=float, default=0.05, help="задержка ответа mock API, секунды")
+
+    process = subparsers.add_parser('process', help="валидация записей движками python и vectorized")
+    process.add_argument('--records', type=int, default=500_000)
+    process.add_argument('--engines', nargs='+', choices=['python', 'dicts', 'vectorized'],
+                         default=['python', 'dicts', 'vectorized'])
+    process.add_argument('--invalid-ratio', type=float, default=0.05)
+
+    insert = subparsers.add_parser('insert', help="скорость загрузки в PostgreSQL по способам")
+    insert.add_argument('--records', type=int, default=100_000)
+    insert.add_argument('--methods', nargs='+', choices=['executemany', 'values', 'copy'],
+                        default=['executemany', 'values', 'copy'])
+    insert.add_argument('--batch-size', type=int, default=10_000)
+
+    aggregate = subparsers.add_parser('aggregate', help="время aggregate_data по attempts и по дневным агрегатам")
+    aggregate.add_argument('--records', type=int, default=200_000)
+    aggregate.add_argument('--sources', nargs='+', choices=['attempts', 'rollup'], default=['attempts', 'rollup'])
+    aggregate.add_argument('--repeat', type=int, default=5)
+    aggregate.add_argument('--invalid-ratio', type=float, default=0.0)
+
+    passback = subparsers.add_parser('passback', help="разбор passback_params при разной доле дублей")
+    passback.add_argument('--records', type=int, default=200_000)
+    passback.add_argument('--duplicate-ratios', type=float, nargs='+', default=[0.0, 0.5, 0.9, 0.99])
+
+    workers = subparsers.add_parser('workers', help="масштабирование валидации по числу процессов")
+    workers.add_argument('--records', type=int, default=500_000)
+    workers.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+
+    imports = subparsers.add_parser('imports', help="время импорта команд flowtrack.py (-X importtime)")
+    imports.add_argument('--commands', nargs='+', choices=['cli', 'ingest', 'aggregate', 'export', 'email',
+                                                           'pipeline', 'schedule'],
+                         default=['cli', 'ingest', 'aggregate', 'export', 'email'])
+    imports.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.scenario == 'stream':
+        results = bench_stream(args.sizes, args.modes)
+    elif args.scenario == 'fetch':
+        results = bench_fetch(args.records, args.modes, args.latency)
+    elif args.scenario == 'process':
+        results = bench_process(args.records, args.engines, args.invalid_ratio)
+    elif args.scenario == 'insert':
+        results = bench_insert(args.records, args.methods, args.batch_size)
+    elif args.scenario == 'aggregate':
+        results = bench_aggregate(args.records, args.sources, args.repeat, args.invalid_ratio)
+    elif args.scenario == 'passback':
+        results = bench_passback(args.records, args.duplicate_ratios)
+    elif args.scenario == 'workers':
+        results = bench_workers(args.records, args.max_workers)
+    elif args.scenario == 'imports':
+        results = bench_imports(args.commands, args.repeat)
+
+    output = args.output or os.path.join('benchmarks', f"{args.scenario}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    save_results(output, args.scenario, results)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
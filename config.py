@@ -8,7 +8,7 @@ SSL_VERIFY = os.getenv('SSL_VERIFY', 'False').lower() == 'true'  # По умол
 load_dotenv()
 
 # Настройки API
-API_URL = "https://b2b.itresume.ru/api/statistics"
+API_URL = os.getenv("API_URL", "https://b2b.itresume.ru/api/statistics")  # для тестов — mock_api.py
 CLIENT = "Skillfactory"
 CLIENT_KEY = "M2MGWS"
 
@@ -23,4 +23,88 @@ DB_CONFIG = {
 
 # Читаем даты из .env
 START_PARSE = os.getenv("START_PARSE")
-END_PARSE = os.getenv("END_PARSE")
\ No newline at end of file
+END_PARSE = os.getenv("END_PARSE")
+
+# Настройки загрузки из API по окнам
+FETCH_MODE = os.getenv("FETCH_MODE", "windowed")  # single, windowed (по окнам), stream (потоково), async (aiohttp)
+FETCH_WINDOW = os.getenv("FETCH_WINDOW", "day")  # hour или day
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 4))  # число параллельных запросов
+FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", 60))  # таймаут одного запроса, секунды
+FETCH_MAX_ROWS = int(os.getenv("FETCH_MAX_ROWS", 50000))  # если окно вернуло столько записей — дробим его
+FETCH_MIN_WINDOW = int(os.getenv("FETCH_MIN_WINDOW", 60))  # минимальная длина окна, секунды
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 5000))  # размер пачки записи в БД в режиме stream
+
+# Кэш сырых ответов API (см. api_cache.py)
+API_CACHE = os.getenv("API_CACHE", "True").lower() == 'true'  # False — всегда запрашивать API
+API_CACHE_DIR = os.getenv("API_CACHE_DIR", ".api_cache")
+API_CACHE_TTL = int(os.getenv("API_CACHE_TTL", 900))  # срок хранения недавних окон, секунды
+API_CACHE_RECENT_HOURS = int(os.getenv("API_CACHE_RECENT_HOURS", 48))  # окна старше хранятся бессрочно
+API_CACHE_MAX_MB = int(os.getenv("API_CACHE_MAX_MB", 2048))  # предел размера кэша, МБ
+
+# Асинхронный клиент API (FETCH_MODE=async, см. async_client.py)
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", 16))  # одновременных запросов (и соединений)
+ASYNC_RATE_LIMIT = float(os.getenv("ASYNC_RATE_LIMIT", 10))  # запросов в секунду, 0 — без ограничения
+ASYNC_RATE_BURST = int(os.getenv("ASYNC_RATE_BURST", 10))  # запросов подряд без ожидания
+
+# Настройки загрузки в PostgreSQL
+INSERT_METHOD = os.getenv("INSERT_METHOD", "copy")  # copy, values или executemany
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 10000))  # записей в пачке (коммит на пачку)
+
+# Инкрементальная синхронизация
+SYNC_MODE = os.getenv("SYNC_MODE", "full")  # full — период START_PARSE..END_PARSE, incremental — от watermark
+SYNC_OVERLAP_MINUTES = int(os.getenv("SYNC_OVERLAP_MINUTES", 60))  # перекрытие с прошлой загрузкой
+
+# Размер LRU-кэша разобранных passback_params (уникальных строк)
+PASSBACK_CACHE_SIZE = int(os.getenv("PASSBACK_CACHE_SIZE", 65536))
+
+# Параллельная валидация записей
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", 1))  # число процессов (или флаг --workers)
+PROCESS_CHUNK_SIZE = int(os.getenv("PROCESS_CHUNK_SIZE", 20000))  # записей в куске на процесс
+PROCESS_ENGINE = os.getenv("PROCESS_ENGINE", "python")  # python (по записи) или vectorized (по столбцам пачки)
+
+# Отклонённые записи (см. rejects.py): в лог — первые REJECT_LOG_FIRST по каждой причине и каждая REJECT_LOG_EVERY-я
+REJECT_LOG_FIRST = int(os.getenv("REJECT_LOG_FIRST", 10))
+REJECT_LOG_EVERY = int(os.getenv("REJECT_LOG_EVERY", 1000))  # 0 — после первых не логировать
+REJECT_QUARANTINE_DIR = os.getenv("REJECT_QUARANTINE_DIR", "")  # карантин в JSON Lines (пусто — не писать)
+REJECT_FLUSH_SIZE = int(os.getenv("REJECT_FLUSH_SIZE", 1000))  # записей в буфере карантина до записи на диск
+REJECT_QUARANTINE_DB = os.getenv("REJECT_QUARANTINE_DB", "True").lower() == 'true'  # карантин в attempts_quarantine
+QUARANTINE_BATCH_SIZE = int(os.getenv("QUARANTINE_BATCH_SIZE", 5000))  # записей за транзакцию в quarantine.py reprocess
+
+# Пул соединений с PostgreSQL
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))  # соединений держится открытыми всегда
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 5))  # максимум одновременно открытых соединений
+DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", 300))  # закрывать простаивающие дольше, секунды
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # ожидание свободного соединения, секунды
+
+# Секционирование attempts
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))  # секций создаётся заранее, месяцев
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 50000))  # строк за транзакцию при миграции
+
+# Выгрузка в Google Sheets (см. sheets_sync.py)
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "https://sheets.googleapis.com/v4")  # для тестов — fake_sheets.py
+SHEETS_SNAPSHOT_DIR = os.getenv("SHEETS_SNAPSHOT_DIR", ".sheets_cache")  # снимки последней выгрузки
+SHEETS_MAX_CELLS_PER_REQUEST = int(os.getenv("SHEETS_MAX_CELLS_PER_REQUEST", 50000))  # ячеек в одном запросе
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", 6))  # повторов при 429/5xx
+SHEETS_BACKOFF = float(os.getenv("SHEETS_BACKOFF", 1.0))  # множитель экспоненциальной задержки, секунды
+SPREADSHEET_ID = os.getenv("SPREADSHEET_ID", "1KRFPLEfDkP-BbMv6fEj6nrEKogKGQR80QnZPPdHg85U")  # ID Google Таблицы
+
+# Конвейер pipeline.py: стадии связаны очередями, в каждой не больше стольких пачек (STREAM_BATCH_SIZE записей)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+
+# Планировщик нескольких клиентов API (см. scheduler.py)
+CLIENTS_FILE = os.getenv("CLIENTS_FILE", "clients.json")  # список клиентов; нет файла — один CLIENT
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 8))  # окон, загружаемых одновременно по всем клиентам
+SCHEDULER_CLIENT_CONCURRENCY = int(os.getenv("SCHEDULER_CLIENT_CONCURRENCY", 2))  # окон одного клиента одновременно
+SCHEDULER_DB_WRITERS = int(os.getenv("SCHEDULER_DB_WRITERS", 2))  # пачек, записываемых в БД одновременно
+SCHEDULER_RETRIES = int(os.getenv("SCHEDULER_RETRIES", 1))  # повторов упавшего окна до остановки клиента
+
+# Чтение больших результатов серверными курсорами (см. db_reader.py)
+READ_ITERSIZE = int(os.getenv("READ_ITERSIZE", 10000))  # строк за одно чтение курсора в отчётах
+
+# Выгрузка attempts в Parquet (см. export.py)
+EXPORT_DIR = os.getenv("EXPORT_DIR", "export")  # каталог выгрузки
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 50000))  # строк за одно чтение серверного курсора
+
+# Метрики запуска (см. metrics.py)
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")  # сводки запусков в JSON (пусто — не писать)
+METRICS_TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR", "")  # каталог textfile collector node_exporter (пусто — выкл.)
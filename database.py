@@ -1,55 +1,325 @@
-import psycopg2
-from config import DB_CONFIG
+import io
+from datetime import date
+from operator import attrgetter, itemgetter
+from psycopg2.extras import execute_values
+from config import INSERT_METHOD, INSERT_BATCH_SIZE, PARTITION_MONTHS_AHEAD
+from db_pool import get_connection
+import metrics
+from progress import create_progress_table, refresh_progress
+from records import AttemptBatch
+from rollup import create_rollup_tables, refresh_days
+from schema import (add_months, attempts_kind, create_partitioned_attempts, create_quarantine_table,
+                    ensure_partitions, month_start, migrate_to_partitioned)
 import logging
 
 def create_table():
-    """Создаёт таблицу attempts, если её нет"""
-    conn = None
+    """Создаёт таблицы attempts и sync_state, если их нет
+        - attempts секционирована по месяцам created_at, с индексами по created_at, user_id,
+          (attempt_type, is_correct) и уникальным ключом дедупликации
+          (user_id, lis_result_sourcedid, attempt_type, created_at), см. schema.py
+        - обычная (несекционированная) attempts из прошлых версий мигрируется на месте пачками
+        - секции создаются заранее на PARTITION_MONTHS_AHEAD месяцев вперёд
+        - sync_state хранит watermark инкрементальной синхронизации по источнику
+        - создаёт таблицы дневных агрегатов (см. rollup.py), прогресса пользователей (см. progress.py)
+          и карантина (см. quarantine.py)
+    """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass('attempts_legacy')")
+            has_legacy = cur.fetchone()[0] is not None
+            if has_legacy or attempts_kind(cur) == 'plain':
+                migrate_to_partitioned(conn)
+            create_partitioned_attempts(cur)
+            today = date.today()
+            ensure_partitions(cur, today, add_months(month_start(today), PARTITION_MONTHS_AHEAD))
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    source TEXT PRIMARY KEY,
+                    watermark TIMESTAMP NOT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+            ''')
+            create_rollup_tables(cur)
+            create_progress_table(cur)
+            create_quarantine_table(cur)
+            conn.commit()
+            logging.info("Таблица attempts проверена/создана")
+            cur.close()
+    except Exception as e:
+        logging.error(f"Ошибка при создании таблицы: {e}")
+
+def prepare_partitions(start, end):
+    """Создаёт месячные секции attempts под период загрузки [start, end]"""
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS attempts (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(100),
-                oauth_consumer_key TEXT,
-                lis_result_sourcedid TEXT,
-                lis_outcome_service_url TEXT,
-                is_correct BOOLEAN,
-                attempt_type VARCHAR(10),
-                created_at TIMESTAMP
-            )
-        ''')
+        ensure_partitions(cur, start, end)
         conn.commit()
-        logging.info("Таблица attempts проверена/создана")
         cur.close()
+
+ATTEMPT_COLUMNS = (
+    'user_id', 'oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url',
+    'is_correct', 'attempt_type', 'created_at',
+)
+
+def batched(iterable, size):
+    """Разбивает итератор на списки длиной не более size"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def _copy_value(value):
+    """Значение в текстовом формате COPY: NULL — \\N, bool — t/f, спецсимволы экранируются"""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    return str(value).translate(_COPY_ESCAPES)
+
+def _copy_buffer(cur, table, columns, buffer, count, skip_duplicates):
+    """COPY готового буфера в текстовом формате, возвращает число вставленных строк
+        - COPY не умеет ON CONFLICT, поэтому при skip_duplicates пачка сначала копируется
+          во временную таблицу, а оттуда переносится INSERT ... ON CONFLICT DO NOTHING
+    """
+    buffer.seek(0)
+    column_list = ', '.join(columns)
+    if not skip_duplicates:
+        cur.copy_expert(f"COPY {table} ({column_list}) FROM STDIN", buffer)
+        return count
+
+    staging = f"{table}_staging"
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+    cur.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN", buffer)
+    cur.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING")
+    return cur.rowcount
+
+def _rows(records, columns):
+    """Значения столбцов пачки построчно (кортежами)
+        - словари читаются по ключу, записи records.Attempt — по атрибутам, без словарей
+    """
+    if not records:
+        return []
+    getter = (itemgetter if isinstance(records[0], dict) else attrgetter)(*columns)
+    if len(columns) == 1:
+        return [(getter(record),) for record in records]
+    return map(getter, records)
+
+def copy_records(cur, table, columns, records, skip_duplicates=False, constants=None):
+    """Загружает пачку через COPY ... FROM STDIN из буфера в памяти (один round trip на пачку)
+        - records — словари или записи records.Attempt
+        - при skip_duplicates дубли по уникальному ключу пропускаются
+        - constants — {столбец: значение}, одинаковое для всех строк пачки (например, client)
+        - возвращает число вставленных строк
+    """
+    constants = constants or {}
+    # Постоянные столбцы дописываются в конец каждой строки готовым суффиксом
+    suffix = ''.join(f"\t{_copy_value(value)}" for value in constants.values()) + '\n'
+    buffer = io.StringIO()
+    for row in _rows(records, columns):
+        buffer.write('\t'.join([_copy_value(value) for value in row]))
+        buffer.write(suffix)
+    return _copy_buffer(cur, table, (*columns, *constants), buffer, len(records), skip_duplicates)
+
+def copy_columns(cur, table, columns, data, skip_duplicates=False, constants=None):
+    """То же, что copy_records, но пачка задана по столбцам: {столбец: список значений}
+        - значения преобразуются столбец за столбцом, словари на строку не создаются
+    """
+    count = len(data[columns[0]])
+    if constants:
+        data = {**data, **{column: [value] * count for column, value in constants.items()}}
+        columns = (*columns, *constants)
+    converted = [map(_copy_value, data[column]) for column in columns]
+    buffer = io.StringIO()
+    buffer.writelines(f"{line}\n" for line in map('\t'.join, zip(*converted)))
+    return _copy_buffer(cur, table, columns, buffer, count, skip_duplicates)
+
+def values_records(cur, table, columns, records, skip_duplicates=False, constants=None):
+    """Загружает пачку одним INSERT ... VALUES (...), (...) через execute_values, возвращает число вставленных"""
+    constants = constants or {}
+    extra = tuple(constants.values())
+    rows = [row + extra for row in _rows(records, columns)] if extra else list(_rows(records, columns))
+    on_conflict = " ON CONFLICT DO NOTHING" if skip_duplicates else ""
+    execute_values(cur, f"INSERT INTO {table} ({', '.join((*columns, *constants))}) VALUES %s{on_conflict}", rows,
+                   page_size=len(rows))
+    return cur.rowcount
+
+def executemany_records(cur, table, columns, records, skip_duplicates=False, constants=None):
+    """Загружает пачку через executemany — по запросу на строку (прежний способ, для сравнения)"""
+    constants = constants or {}
+    extra = tuple(constants.values())
+    all_columns = (*columns, *constants)
+    placeholders = ', '.join(['%s'] * len(all_columns))
+    on_conflict = " ON CONFLICT DO NOTHING" if skip_duplicates else ""
+    cur.executemany(f"INSERT INTO {table} ({', '.join(all_columns)}) VALUES ({placeholders}){on_conflict}",
+                    (row + extra for row in _rows(records, columns)))
+    return cur.rowcount
+
+LOADERS = {
+    'copy': copy_records,
+    'values': values_records,
+    'executemany': executemany_records,
+}
+
+def load_records(records, table, columns, method=INSERT_METHOD, batch_size=INSERT_BATCH_SIZE,
+                 skip_duplicates=False, constants=None):
+    """Загружает записи (словари или records.Attempt) в таблицу пачками
+        - records — список или генератор, в память берётся не больше одной пачки
+        - method — copy, values или executemany (см. LOADERS)
+        - skip_duplicates — строки, нарушающие уникальный ключ, пропускаются (ON CONFLICT DO NOTHING)
+        - constants — {столбец: значение} для всех строк (см. copy_records)
+        - каждая пачка коммитится отдельно: при ошибке уже загруженные пачки остаются в БД
+        - возвращает число вставленных строк; ошибку пробрасывает, добавив атрибут loaded
+    """
+    return load_batches(batched(records, batch_size), table, columns, LOADERS[method], skip_duplicates, constants)
+
+def load_batches(batches, table, columns, loader=copy_records, skip_duplicates=False, constants=None):
+    """Загружает готовые пачки функцией loader (см. LOADERS или copy_columns), коммит на пачку
+        - возвращает число вставленных строк; ошибку пробрасывает, добавив атрибут loaded
+    """
+    loaded = 0
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            for batch in batches:
+                try:
+                    with metrics.timer('db_load_seconds', table=table):
+                        inserted = loader(cur, table, columns, batch, skip_duplicates, constants)
+                        conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                metrics.inc('db_load_rows', inserted, table=table)
+                loaded += inserted
+            cur.close()
     except Exception as e:
-        logging.error(f"Ошибка при создании таблицы: {e}")
+        e.loaded = loaded
+        raise
+    return loaded
+
+def insert_attempts(records, method=INSERT_METHOD, batch_size=INSERT_BATCH_SIZE, client=None, days=None, keys=None):
+    """Загружает записи в attempts пачками, пропуская уже загруженные по естественному ключу
+        - records — словари, records.Attempt или records.AttemptBatch (при method=copy
+          пачка идёт по столбцам через insert_attempt_columns, без объектов на запись)
+        - client — клиент API, от которого пришли записи (столбец attempts.client)
+        - ошибки пробрасываются (см. load_records)
+        - после загрузки (и после ошибки — для уже закоммиченных пачек) пересчитывает
+          дневные агрегаты за затронутые дни и user_progress для затронутых пар
+          (пользователь, задание); если передано множество days (keys), дни (пары) добавляются
+          в него, а пересчёт делает вызывающий код (refresh_touched)
+        - возвращает число новых строк
+    """
+    if isinstance(records, AttemptBatch) and method == 'copy':
+        return insert_attempt_columns(records.column_batches(batch_size), client, days, keys)
+    touched_days = set() if days is None else days
+    touched_keys = set() if keys is None else keys
+
+    def track(records):
+        for record in records:
+            touched_days.add(str(record['created_at'])[:10])
+            touched_keys.add((record['user_id'], record['lis_result_sourcedid']))
+            yield record
+
+    try:
+        return load_records(track(records), 'attempts', ATTEMPT_COLUMNS, method, batch_size,
+                            skip_duplicates=True, constants=_client_column(client))
+    finally:
+        refresh_touched(touched_days if days is None else None, touched_keys if keys is None else None)
+
+def insert_attempt_columns(batches, client=None, days=None, keys=None):
+    """Загружает в attempts пачки, заданные по столбцам (векторный движок, см. vectorized.py)
+        - каждая пачка — {столбец: список значений} с ключами ATTEMPT_COLUMNS, идёт одним COPY
+        - дубли по естественному ключу пропускаются, агрегаты и user_progress пересчитываются
+          за затронутые дни и пары
+        - client, days и keys — как в insert_attempts
+        - возвращает число новых строк; ошибки пробрасываются (см. load_batches)
+    """
+    touched_days = set() if days is None else days
+    touched_keys = set() if keys is None else keys
+
+    def track(batches):
+        for data in batches:
+            touched_days.update(str(created_at)[:10] for created_at in data['created_at'])
+            touched_keys.update(zip(data['user_id'], data['lis_result_sourcedid']))
+            yield data
+
+    try:
+        return load_batches(track(batches), 'attempts', ATTEMPT_COLUMNS, copy_columns, skip_duplicates=True,
+                            constants=_client_column(client))
     finally:
-        if conn:
-            conn.close()
+        refresh_touched(touched_days if days is None else None, touched_keys if keys is None else None)
+
+def _client_column(client):
+    return {'client': client} if client else None
 
-def insert_data(data):
-    """Вставляет список записей в таблицу attempts"""
+def refresh_touched(days=None, keys=None):
+    """Пересчёт дневных агрегатов (за дни days) и user_progress (для пар keys) после загрузки
+        - ошибка логируется, но не прерывает загрузку
+    """
+    if days:
+        try:
+            refresh_days(days)
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении дневных агрегатов: {e}. Запустите python rollup.py --rebuild")
+    if keys:
+        try:
+            refresh_progress(keys)
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении user_progress: {e}. Запустите python progress.py --rebuild")
+
+@metrics.timed('insert')
+def insert_data(data, method=INSERT_METHOD, batch_size=INSERT_BATCH_SIZE):
+    """Вставляет записи в таблицу attempts пачками (см. insert_attempts), возвращает число вставленных"""
     if not data:
         logging.info("Нет данных для вставки")
-        return
+        return 0
 
-    conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        loaded = insert_attempts(data, method, batch_size)
+        metrics.inc('stage_rows', loaded, stage='insert')
+        logging.info(f"Успешно вставлено {loaded} записей ({method})")
+        return loaded
+    except Exception as e:
+        loaded = getattr(e, 'loaded', 0)
+        logging.error(f"Ошибка при вставке данных: {e}. Вставлено до ошибки: {loaded}")
+        return loaded
+
+def get_watermark(source):
+    """Возвращает watermark (datetime) последней успешной синхронизации источника или None"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT watermark FROM sync_state WHERE source = %s", (source,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else None
+
+def advance_watermark(source, start, end):
+    """Сдвигает watermark источника на последний created_at, загруженный в [start, end]
+        - учитываются строки этого клиента (attempts.client = source) и строки без клиента,
+          загруженные до появления столбца client
+        - watermark только растёт; если в периоде нет строк, он не меняется
+        - возвращает новый watermark или None
+    """
+    with get_connection() as conn:
         cur = conn.cursor()
-        query = '''
-            INSERT INTO attempts 
-            (user_id, oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url, is_correct, attempt_type, created_at)
-            VALUES (%(user_id)s, %(oauth_consumer_key)s, %(lis_result_sourcedid)s, %(lis_outcome_service_url)s, %(is_correct)s, %(attempt_type)s, %(created_at)s)
-        '''
-        cur.executemany(query, data)
+        cur.execute('''
+            INSERT INTO sync_state (source, watermark)
+            SELECT %s, MAX(created_at) FROM attempts
+            WHERE created_at BETWEEN %s AND %s AND (client = %s OR client IS NULL)
+            HAVING MAX(created_at) IS NOT NULL
+            ON CONFLICT (source) DO UPDATE
+            SET watermark = GREATEST(sync_state.watermark, EXCLUDED.watermark), updated_at = now()
+            RETURNING watermark
+        ''', (source, start, end, source))
+        row = cur.fetchone()
         conn.commit()
-        logging.info(f"Успешно вставлено {len(data)} записей")
-    except Exception as e:
-        logging.error(f"Ошибка при вставке данных: {e}")
-        conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        cur.close()
+        return row[0] if row else None
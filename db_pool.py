@@ -0,0 +1,210 @@
+"""
+Общий пул соединений с PostgreSQL.
+Все функции работы с БД берут соединение через get_connection(), поэтому за запуск скрипта
+устанавливается одно-два соединения вместо отдельного подключения на каждый шаг.
+"""
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from config import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_IDLE_TIMEOUT, DB_POOL_TIMEOUT
+import metrics
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений psycopg2
+        - держит от minconn до maxconn соединений, новые открываются по требованию
+        - при выдаче проверяет соединение: закрытое отбрасывается, простоявшее дольше
+          check_after секунд проверяется запросом SELECT 1
+        - соединения, простоявшие дольше idle_timeout секунд, закрываются (кроме minconn последних)
+        - если все maxconn соединений заняты, ждёт до timeout секунд, затем PoolTimeout
+        - считает время ожидания соединения и время работы с ним (см. stats)
+    """
+
+    def __init__(self, minconn, maxconn, idle_timeout=300, timeout=30, check_after=5, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.check_after = check_after
+        self.connect_kwargs = connect_kwargs
+        self._idle = []  # [(соединение, время возврата в пул)], последнее возвращённое — в конце
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'connections_opened': 0, 'checkouts': 0, 'health_check_failures': 0,
+            'acquire_seconds': 0.0, 'acquire_max_seconds': 0.0, 'hold_seconds': 0.0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        self._stats['connections_opened'] += 1
+        return conn
+
+    def _prune_idle(self):
+        """Закрывает соединения, простоявшие дольше idle_timeout (вызывается под блокировкой)"""
+        now = time.monotonic()
+        while self._size > self.minconn and self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            conn.close()
+            self._size -= 1
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Выдаёт соединение из пула (или открывает новое, если пул не заполнен)"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                self._prune_idle()
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"Нет свободных соединений за {self.timeout} с (занято {self._size})")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn, idle_since = None, None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._stats['health_check_failures'] += 1
+            logging.warning("Соединение из пула не прошло проверку, открываем новое")
+            conn.close()
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def putconn(self, conn):
+        """Возвращает соединение в пул; незавершённая транзакция откатывается, сломанное соединение закрывается"""
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._cond:
+            if conn.closed or self._closed:
+                conn.close()
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: соединение на время блока, с замером ожидания и работы"""
+        started = time.perf_counter()
+        conn = self.getconn()
+        acquired = time.perf_counter()
+        wait = acquired - started
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['acquire_seconds'] += wait
+            self._stats['acquire_max_seconds'] = max(self._stats['acquire_max_seconds'], wait)
+        metrics.observe('db_pool_wait_seconds', wait)
+        try:
+            yield conn
+        finally:
+            with self._cond:
+                self._stats['hold_seconds'] += time.perf_counter() - acquired
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+                self._size -= 1
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        """Статистика пула: открыто соединений, выдач, время ожидания и работы (секунды)"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle))
+        for key in ('acquire_seconds', 'acquire_max_seconds', 'hold_seconds'):
+            stats[key] = round(stats[key], 4)
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Общий пул процесса, создаётся при первом обращении и закрывается при выходе"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                                   timeout=DB_POOL_TIMEOUT, **DB_CONFIG)
+            atexit.register(close_pool)
+        return _pool
+
+
+@contextmanager
+def get_connection():
+    """Соединение из общего пула на время блока with"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def check_connection():
+    """Проверка подключения к БД: берёт соединение из пула и выполняет SELECT 1"""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+
+
+def close_pool():
+    """Закрывает общий пул и логирует статистику соединений
+        - сначала сбрасывает буфер карантина отказов (rejects.py): он пишет в БД, и без этого
+          сброс при выходе открыл бы новый пул, который уже никто не закроет
+    """
+    global _pool
+    # Импорт здесь: rejects пишет в БД через quarantine.py, который импортирует этот модуль
+    from rejects import REJECTS
+    REJECTS.flush()
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        logging.info(f"Пул соединений PostgreSQL: {pool.stats()}")
+        pool.closeall()
@@ -0,0 +1,134 @@
+"""
+Чтение больших результатов запросов серверными (именованными) курсорами psycopg2.
+
+Обычный курсор при execute забирает в память клиента весь результат. Серверный курсор
+оставляет результат в PostgreSQL, а клиент получает его пачками по itersize строк
+(READ_ITERSIZE), поэтому отчёт или выгрузка по десяткам миллионов строк держит в памяти
+одну пачку. Пачки отдаются генераторами:
+    - iter_batches — списки кортежей;
+    - iter_rows — строки по одной;
+    - iter_frames — pandas.DataFrame на пачку;
+    - iter_arrow_batches — pyarrow.RecordBatch на пачку (для CSV и Parquet).
+Соединение берётся из общего пула на время обхода (или передаётся вызывающим кодом)
+и возвращается, когда генератор исчерпан или закрыт.
+"""
+import itertools
+from contextlib import contextmanager
+
+from config import READ_ITERSIZE
+from db_pool import get_connection
+import metrics
+
+_cursor_names = itertools.count(1)
+
+# Типы PostgreSQL (oid) → типы Arrow; для остальных тип выводится по значениям пачки
+_ARROW_TYPES = {
+    16: 'bool_', 20: 'int64', 21: 'int64', 23: 'int64', 700: 'float64', 701: 'float64',
+    25: 'string', 1043: 'string', 1082: 'date32', 1114: 'timestamp',
+}
+
+
+@contextmanager
+def server_cursor(conn, query, params=None, itersize=READ_ITERSIZE, name=None):
+    """Серверный курсор на соединении conn с выполненным query
+        - курсор живёт до конца транзакции: внутри блока нельзя делать commit
+        - name — имя курсора в PostgreSQL (по умолчанию уникальное в процессе)
+    """
+    cur = conn.cursor(name=name or f"flowtrack_read_{next(_cursor_names)}")
+    cur.itersize = itersize
+    try:
+        cur.execute(query, params)
+        yield cur
+    finally:
+        cur.close()
+
+
+@contextmanager
+def _reading(query, params, itersize, conn, name):
+    if conn is not None:
+        with server_cursor(conn, query, params, itersize, name) as cur:
+            yield cur
+        return
+    with get_connection() as conn:
+        with server_cursor(conn, query, params, itersize, name) as cur:
+            yield cur
+
+
+def _fetch_batches(cur, itersize):
+    while True:
+        rows = cur.fetchmany(itersize)
+        if not rows:
+            return
+        metrics.inc('db_read_rows', len(rows))
+        yield rows
+
+
+def iter_batches(query, params=None, itersize=READ_ITERSIZE, conn=None, name=None):
+    """Результат query пачками — списками до itersize кортежей (генератор)
+        - conn — соединение вызывающего кода (например, внутри его транзакции), иначе — из пула
+    """
+    with _reading(query, params, itersize, conn, name) as cur:
+        yield from _fetch_batches(cur, itersize)
+
+
+def iter_rows(query, params=None, itersize=READ_ITERSIZE, conn=None, name=None):
+    """Результат query по строкам (генератор); с сервера строки приходят пачками по itersize"""
+    for rows in iter_batches(query, params, itersize, conn, name):
+        yield from rows
+
+
+def iter_frames(query, params=None, itersize=READ_ITERSIZE, conn=None, name=None):
+    """Результат query пачками в виде pandas.DataFrame (столбцы — как в SELECT)
+        - пустой результат не даёт ни одной пачки
+    """
+    import pandas as pd
+
+    with _reading(query, params, itersize, conn, name) as cur:
+        for rows in _fetch_batches(cur, itersize):
+            # Описание столбцов у серверного курсора появляется после первого чтения
+            columns = [column.name for column in cur.description]
+            yield pd.DataFrame(dict(zip(columns, map(list, zip(*rows)))), columns=columns)
+
+
+def arrow_schema(description):
+    """Схема Arrow по описанию столбцов курсора; для неизвестных типов PostgreSQL — None"""
+    import pyarrow as pa
+
+    fields = []
+    for column in description:
+        type_name = _ARROW_TYPES.get(column.type_code)
+        if type_name is None:
+            return None
+        fields.append(pa.field(column.name, pa.timestamp('us') if type_name == 'timestamp'
+                               else getattr(pa, type_name)()))
+    return pa.schema(fields)
+
+
+def rows_to_arrow(rows, schema):
+    """RecordBatch из пачки кортежей по схеме schema (словарные столбцы кодируются словарём)"""
+    import pyarrow as pa
+
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_arrow_batches(query, params=None, itersize=READ_ITERSIZE, conn=None, name=None, schema=None):
+    """Результат query пачками pyarrow.RecordBatch с одной схемой на все пачки
+        - schema — схема Arrow (например, export.EXPORT_SCHEMA); по умолчанию — по типам столбцов
+          PostgreSQL, а если среди них есть неизвестные — по значениям первой пачки
+    """
+    import pyarrow as pa
+
+    with _reading(query, params, itersize, conn, name) as cur:
+        for rows in _fetch_batches(cur, itersize):
+            if schema is None:
+                schema = arrow_schema(cur.description)
+            if schema is None:
+                names = [column.name for column in cur.description]
+                schema = pa.RecordBatch.from_arrays([pa.array(values) for values in zip(*rows)], names=names).schema
+            yield rows_to_arrow(rows, schema)
@@ -1,8 +1,9 @@
+import argparse
 import smtplib
 import ssl
 from email.message import EmailMessage
 import os
-from config import DB_CONFIG, START_PARSE, END_PARSE
+from config import DB_CONFIG, START_PARSE, END_PARSE, SPREADSHEET_ID
 
 def send_email_report(success, local_file_path=None, spreadsheet_url=None):
     """
@@ -81,3 +82,24 @@ def send_email_report(success, local_file_path=None, spreadsheet_url=None):
     except Exception as e:
         print(f"❌ Ошибка при отправке email: {e}")
         return False
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Отправка email-отчёта о выгрузке в Google Sheets")
+    parser.add_argument('--failed', action='store_true',
+                        help="отчёт о неудачной выгрузке: данные сохранены локально (--file)")
+    parser.add_argument('--file', default="metrics_backup.csv", help="локальный файл для вложения при --failed")
+    parser.add_argument('--url', help="ссылка на таблицу (по умолчанию — по SPREADSHEET_ID)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Отправляет отчёт по аргументам командной строки; возвращает код выхода (0 — письмо отправлено)"""
+    args = parse_args(argv)
+    if args.failed:
+        sent = send_email_report(success=False, local_file_path=args.file)
+    else:
+        url = args.url or f"https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}"
+        sent = send_email_report(success=True, spreadsheet_url=url)
+    return 0 if sent else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,287 @@
+"""
+Выгрузка attempts в Parquet для офлайн-аналитики.
+
+Файлы раскладываются по дням: EXPORT_DIR/attempts/day=YYYY-MM-DD/part-0.parquet
+(hive-разметка, читается pandas.read_parquet, pyarrow.dataset, DuckDB, Spark).
+attempt_type и oauth_consumer_key хранятся со словарным кодированием.
+
+Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE (см. db_reader.py), поэтому
+ни таблица, ни день целиком в память не загружаются. Выгрузка инкрементальная: по дневным агрегатам
+(attempts_daily) определяется, какие дни появились или изменились после прошлой выгрузки,
+и перезаписываются только они. Состояние хранится в EXPORT_DIR/attempts/_export_state.json.
+
+Так же, пачками, в CSV выгружаются попытки за период или отчёт query_metrics с разбивкой,
+например по пользователям (export_csv).
+
+Запуск:
+    python export.py [--start 2023-05-01] [--end 2023-06-01] [--full]
+    python export.py --csv users.csv [--group-by user_id,day] [--start ...] [--end ...]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+from datetime import date, timedelta
+from itertools import groupby
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import EXPORT_DIR, EXPORT_BATCH_SIZE
+from db_pool import get_connection
+from db_reader import iter_arrow_batches, iter_batches, rows_to_arrow
+import metrics
+
+EXPORT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('user_id', pa.string()),
+    ('oauth_consumer_key', pa.dictionary(pa.int32(), pa.string())),
+    ('lis_result_sourcedid', pa.string()),
+    ('lis_outcome_service_url', pa.string()),
+    ('is_correct', pa.bool_()),
+    ('attempt_type', pa.dictionary(pa.int32(), pa.string())),
+    ('created_at', pa.timestamp('us')),
+])
+
+DICTIONARY_COLUMNS = ['oauth_consumer_key', 'attempt_type']
+
+
+def dataset_path(directory=EXPORT_DIR):
+    return os.path.join(directory, 'attempts')
+
+
+def _partition_dir(root, day):
+    return os.path.join(root, f"day={day.isoformat()}")
+
+
+def _load_state(root):
+    try:
+        with open(os.path.join(root, '_export_state.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(root, state):
+    path = os.path.join(root, '_export_state.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _days_to_export(cur, state, start, end, full):
+    """Дни из attempts_daily за [start, end), которые новые или изменились после прошлой выгрузки
+        - возвращает {день: updated_at агрегата} для выгрузки и множество всех дней периода в БД
+    """
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("day >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("day < %s")
+        params.append(end)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    cur.execute(f"SELECT day, total_attempts, updated_at FROM attempts_daily {where} ORDER BY day", params)
+    days, present = {}, set()
+    for day, rows, updated_at in cur.fetchall():
+        present.add(day.isoformat())
+        exported = state.get(day.isoformat())
+        if full or exported != {'rows': rows, 'updated_at': updated_at.isoformat()}:
+            days[day] = updated_at.isoformat()
+    return days, present
+
+
+def _batch_table(rows):
+    """Arrow-таблица из пачки кортежей курсора (по столбцам, без словарей на строку)"""
+    return pa.Table.from_batches([rows_to_arrow(rows, EXPORT_SCHEMA)])
+
+
+class _DayWriter:
+    """Пишет строки одного дня во временный файл; commit() атомарно заменяет секцию дня"""
+
+    def __init__(self, root, day):
+        self.day = day
+        self.final_dir = _partition_dir(root, day)
+        self.tmp_dir = self.final_dir + '.tmp'
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.rows = 0
+        self._writer = pq.ParquetWriter(os.path.join(self.tmp_dir, 'part-0.parquet'), EXPORT_SCHEMA,
+                                        use_dictionary=DICTIONARY_COLUMNS, compression='zstd')
+
+    def write(self, table):
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def commit(self):
+        self._writer.close()
+        shutil.rmtree(self.final_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.final_dir)
+
+    def abort(self):
+        self._writer.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+@metrics.timed('export')
+def export_attempts(start=None, end=None, directory=EXPORT_DIR, batch_size=EXPORT_BATCH_SIZE, full=False):
+    """Выгружает attempts за [start, end) (даты; None — без границы) в Parquet по дням
+        - full=False — только новые и изменившиеся дни (по attempts_daily), full=True — все дни периода
+        - дни, которых больше нет в БД, удаляются из выгрузки
+        - строки идут серверным курсором пачками по batch_size; файл дня заменяется атомарно
+        - возвращает {'days': число выгруженных дней, 'rows': число строк}
+    """
+    root = dataset_path(directory)
+    os.makedirs(root, exist_ok=True)
+    state = _load_state(root)
+    start = date.fromisoformat(str(start)[:10]) if start is not None else None
+    end = date.fromisoformat(str(end)[:10]) if end is not None else None
+
+    result = {'days': 0, 'rows': 0}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        days, present = _days_to_export(cur, state, start, end, full)
+        cur.close()
+
+        # Дни, удалённые из БД, удаляются и из выгрузки
+        for day in list(state):
+            in_range = (start is None or day >= start.isoformat()) and (end is None or day < end.isoformat())
+            if in_range and day not in present:
+                shutil.rmtree(_partition_dir(root, date.fromisoformat(day)), ignore_errors=True)
+                del state[day]
+                logging.info(f"Выгрузка: день {day} удалён (нет в БД)")
+
+        if not days:
+            _save_state(root, state)
+            logging.info("Выгрузка в Parquet: новых или изменившихся дней нет")
+            return result
+
+        first, last = min(days), max(days)
+        logging.info(f"Выгрузка в Parquet: {len(days)} дн. ({first} — {last}) в {root}")
+        # Серверный курсор: строки приходят пачками по batch_size, а не всем результатом сразу
+        batches = iter_batches('''
+            SELECT id, user_id, oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url,
+                   is_correct, attempt_type, created_at, created_at::date AS day
+            FROM attempts
+            WHERE created_at >= %s AND created_at < %s AND created_at::date = ANY(%s)
+            ORDER BY created_at
+        ''', (first, last + timedelta(days=1), list(days)), batch_size, conn=conn, name='attempts_export')
+        writer = None
+        try:
+            for rows in batches:
+                # Пачка может захватить конец одного дня и начало следующего
+                for day, group in groupby(rows, key=lambda row: row[8]):
+                    if writer is None or writer.day != day:
+                        if writer is not None:
+                            _finish_day(writer, days, state, result)
+                        writer = _DayWriter(root, day)
+                    writer.write(_batch_table([row[:8] for row in group]))
+            if writer is not None:
+                _finish_day(writer, days, state, result)
+                writer = None
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            batches.close()
+            _save_state(root, state)
+
+    metrics.inc('stage_rows', result['rows'], stage='export')
+    logging.info(f"Выгрузка в Parquet завершена: {result['days']} дн., {result['rows']} строк")
+    return result
+
+
+def _finish_day(writer, days, state, result):
+    writer.commit()
+    state[writer.day.isoformat()] = {'rows': writer.rows, 'updated_at': days[writer.day]}
+    result['days'] += 1
+    result['rows'] += writer.rows
+
+
+@metrics.timed('export_csv')
+def export_csv(path, start=None, end=None, group_by=(), batch_size=EXPORT_BATCH_SIZE):
+    """Выгружает в CSV попытки за [start, end) или, если задан group_by, отчёт query_metrics с этой разбивкой
+        - group_by — измерения analytics.DIMENSIONS, например ('user_id', 'day')
+        - строки идут серверным курсором пачками по batch_size и сразу дописываются в файл,
+          поэтому память не зависит от размера отчёта; под именем path файл появляется только целиком
+        - возвращает число строк
+    """
+    import pyarrow.csv as pa_csv
+    from analytics import METRIC_COLUMNS, metrics_query
+
+    if group_by:
+        query, params = metrics_query(start, end, group_by)
+        columns, schema = [*group_by, *METRIC_COLUMNS], None
+    else:
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("created_at >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("created_at < %s")
+            params.append(end)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        columns = EXPORT_SCHEMA.names
+        query = f"SELECT {', '.join(columns)} FROM attempts {where} ORDER BY created_at"
+        # В CSV словарное кодирование не нужно
+        schema = pa.schema([pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type)
+                                     else field.type) for field in EXPORT_SCHEMA])
+
+    rows = 0
+    writer = None
+    batches = iter_arrow_batches(query, params, batch_size, schema=schema)
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pa_csv.CSVWriter(path + '.tmp', batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+        if writer is None:
+            # Пустой результат — только заголовок
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(','.join(f'"{column}"' for column in columns) + '\n')
+        else:
+            writer.close()
+        os.replace(path + '.tmp', path)
+    finally:
+        batches.close()
+        if os.path.exists(path + '.tmp'):
+            if writer is not None:
+                writer.close()
+            os.remove(path + '.tmp')
+    metrics.inc('stage_rows', rows, stage='export_csv')
+    logging.info(f"Выгрузка в CSV {path}: {rows} строк")
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка attempts в Parquet по дням")
+    parser.add_argument('--start', help="первый день (YYYY-MM-DD), по умолчанию — с начала истории")
+    parser.add_argument('--end', help="день после последнего (YYYY-MM-DD), по умолчанию — до конца истории")
+    parser.add_argument('--dir', default=EXPORT_DIR, help="каталог выгрузки (по умолчанию EXPORT_DIR)")
+    parser.add_argument('--full', action='store_true', help="перевыгрузить все дни периода, а не только изменённые")
+    parser.add_argument('--csv', help="вместо Parquet выгрузить в этот CSV-файл попытки или отчёт (--group-by)")
+    parser.add_argument('--group-by', default='', help="измерения отчёта для --csv через запятую, например user_id,day")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Выгрузка по аргументам командной строки; возвращает код выхода (0 — успех)"""
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    status = 'error'
+    try:
+        if args.csv:
+            export_csv(args.csv, args.start, args.end, tuple(filter(None, args.group_by.split(','))))
+        else:
+            export_attempts(args.start, args.end, args.dir, full=args.full)
+        status = 'ok'
+    finally:
+        metrics.write_run_summary('export', status)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
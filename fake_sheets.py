@@ -0,0 +1,145 @@
+"""
+Локальный фейковый сервер Google Sheets API v4 для тестов и отладки выгрузки без Google.
+
+Поддерживает то, что использует sheets_sync.py: метаданные листов, addSheet,
+values:batchUpdate и values:batchClear. Значения хранятся в памяти; можно заставить
+сервер ответить 429 на несколько первых запросов записи (throttle).
+
+Запуск отдельно (затем SHEETS_API_URL=http://127.0.0.1:8765/v4):
+    python fake_sheets.py --port 8765
+"""
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RANGE_RE = re.compile(r"^'?(?P<title>.*?)'?(?:!(?P<c1>[A-Z]+)(?P<r1>\d+):(?P<c2>[A-Z]+)(?P<r2>\d+))?$")
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _parse_range(a1):
+    match = _RANGE_RE.match(a1)
+    title = match['title'].replace("''", "'")
+    if match['c1'] is None:
+        return title, None
+    return title, (int(match['r1']) - 1, _column_index(match['c1']),
+                   int(match['r2']) - 1, _column_index(match['c2']))
+
+
+class FakeSheetsServer:
+    """Фейковый сервер в фоновом потоке; используется как контекстный менеджер
+        - sheets — {название листа: {(строка, столбец): значение}}
+        - calls — журнал запросов [(метод, путь, тело)]
+        - throttle — сколько ближайших запросов записи получат 429
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, sheets=('Лист1',)):
+        self.sheets = {title: {} for title in sheets}
+        self.calls = []
+        self.throttle = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v4"
+
+    def grid(self, title):
+        """Значения листа как список строк (пустые ячейки — '')"""
+        cells = self.sheets[title]
+        if not cells:
+            return []
+        height = max(row for row, _ in cells) + 1
+        width = max(col for _, col in cells) + 1
+        rows = [[cells.get((r, c), '') for c in range(width)] for r in range(height)]
+        while rows and not any(value != '' for value in rows[-1]):
+            rows.pop()
+        return rows
+
+    def _handle(self, method, path, body):
+        with self._lock:
+            self.calls.append((method, path, body))
+            if method == 'POST' and self.throttle > 0:
+                self.throttle -= 1
+                return 429, {'error': {'code': 429, 'message': 'Quota exceeded'}}
+            if method == 'GET':
+                return 200, {'sheets': [{'properties': {'title': title}} for title in self.sheets]}
+            if path.endswith(':batchUpdate') and '/values' not in path:
+                for request in body['requests']:
+                    self.sheets.setdefault(request['addSheet']['properties']['title'], {})
+                return 200, {'replies': [{} for _ in body['requests']]}
+            if path.endswith('/values:batchClear'):
+                for a1 in body['ranges']:
+                    self.sheets[_parse_range(a1)[0]].clear()
+                return 200, {'clearedRanges': body['ranges']}
+            if path.endswith('/values:batchUpdate'):
+                updated = 0
+                for item in body['data']:
+                    title, (row, col, _, _) = _parse_range(item['range'])
+                    for r, values in enumerate(item['values']):
+                        for c, value in enumerate(values):
+                            self.sheets[title][(row + r, col + c)] = value
+                            updated += 1
+                return 200, {'totalUpdatedCells': updated}
+            return 404, {'error': {'code': 404, 'message': f'Unknown path {path}'}}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, payload = server._handle(method, self.path.split('?')[0], body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фейковый сервер Google Sheets API")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    fake = FakeSheetsServer(port=args.port)
+    print(f"SHEETS_API_URL={fake.url}")
+    fake._httpd.serve_forever()
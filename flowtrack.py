@@ -0,0 +1,56 @@
+"""
+Единая точка входа для скриптов FlowTrack.
+
+    python flowtrack.py ingest [--incremental] [--workers 4] [--replay]   (main.py)
+    python flowtrack.py aggregate [--yes]                                  (aggregate_to_sheets.py)
+    python flowtrack.py export [--csv users.csv --group-by user_id,day]    (export.py)
+    python flowtrack.py email [--failed --file metrics_backup.csv]         (email_sender.py)
+    python flowtrack.py pipeline [--incremental] [--no-export]             (pipeline.py)
+    python flowtrack.py schedule [--clients clients.json]                  (scheduler.py)
+
+Аргументы после команды передаются скрипту как есть (`python flowtrack.py ingest -h` — его справка).
+Сам модуль импортирует только стандартную библиотеку: скрипт команды (а с ним pandas, pyarrow,
+psycopg2, requests и загрузка .env в config.py) импортируется, только когда команда выбрана,
+поэтому `--help` и короткие запуски по расписанию не платят за чужие зависимости.
+Код выхода — код команды (0 — успех). Время импорта команд: python benchmarks.py imports.
+"""
+import argparse
+import importlib
+import sys
+
+# Команда → (модуль со своей main(argv), описание)
+COMMANDS = {
+    'ingest': ('main', "сбор данных: API → PostgreSQL"),
+    'aggregate': ('aggregate_to_sheets', "агрегация и выгрузка в Google Sheets, email-отчёт"),
+    'export': ('export', "выгрузка attempts в Parquet по дням или отчёта в CSV"),
+    'email': ('email_sender', "отправка email-отчёта о выгрузке"),
+    'pipeline': ('pipeline', "конвейер: API → PostgreSQL → Google Sheets"),
+    'schedule': ('scheduler', "загрузка нескольких клиентов API одним процессом"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='flowtrack', description="FlowTrack: сбор, агрегация и выгрузка попыток",
+        epilog="аргументы после команды передаются её скрипту; справка команды: flowtrack <команда> -h",
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='command',
+                        help="; ".join(f"{name} — {description}" for name, (_, description) in COMMANDS.items()))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def load_command(command):
+    """Модуль команды (импортируется при первом вызове вместе со своими зависимостями)"""
+    return importlib.import_module(COMMANDS[command][0])
+
+
+def main(argv=None):
+    """Запускает команду; возвращает её код выхода (None у скриптов без кода считается успехом)"""
+    args = parse_args(argv)
+    code = load_command(args.command).main(args.args)
+    return 0 if code is None else int(code)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
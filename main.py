@@ -3,7 +3,12 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
-import ast
+import argparse
+import codecs
+import json
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import os
 
@@ -11,9 +16,18 @@ import os
 # Но лучше удалить эту строку, если используете своё логирование
 # urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-from config import API_URL, CLIENT, CLIENT_KEY, DB_CONFIG, START_PARSE, END_PARSE, SSL_VERIFY
-from database import create_table, insert_data
-from analytics import aggregate_data, upload_to_google_sheets
+from config import (API_URL, CLIENT, CLIENT_KEY, START_PARSE, END_PARSE, SSL_VERIFY,
+                    FETCH_MODE, FETCH_WINDOW, FETCH_WORKERS, FETCH_TIMEOUT, FETCH_MAX_ROWS, FETCH_MIN_WINDOW,
+                    STREAM_BATCH_SIZE, SYNC_MODE, SYNC_OVERLAP_MINUTES, PROCESS_WORKERS, PROCESS_CHUNK_SIZE,
+                    PROCESS_ENGINE)
+from db_pool import check_connection
+from passback import parse_passback_params, parse_stats
+from database import (create_table, prepare_partitions, insert_attempts, insert_attempt_columns, get_watermark,
+                      advance_watermark, batched)
+from api_cache import ApiCache, open_cache
+import metrics
+from rejects import REJECTS
+from records import AttemptBatch
 
 def setup_logger():
     """Настройка системы логирования
@@ -48,32 +62,66 @@ def setup_logger():
         ]
     )
 
-def get_session_with_retries():
+def get_session_with_retries(pool_maxsize=10, retry_read_timeouts=True):
     """ Создаёт объект requests.Session с автоматическими повторными попытками
         при ошибках (например, 500, 502, таймаут).
         - полезно при нестабильном соединении.
         - повторяет запрос до 3 раз с экспоненциальной задержкой.
+        - pool_maxsize — сколько соединений держать открытыми (для параллельных запросов).
+        - retry_read_timeouts=False — таймаут чтения сразу пробрасывается как requests.Timeout,
+          чтобы вызывающий код мог уменьшить окно, а не ждать ещё три таймаута.
     """
     session = requests.Session()
     retry_strategy = Retry(
         total=3,
+        read=None if retry_read_timeouts else False,
         backoff_factor=1,
         status_forcelist=[429, 500, 502, 503, 504],
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
-def fetch_data_from_api(start, end):
+def request_window(session, start, end, timeout=60):
+    """Один GET-запрос к API за период [start, end]
+        - возвращает список записей
+        - при ответе не 200 выбрасывает requests.HTTPError, при таймауте — requests.Timeout
+    """
+    params = {
+        'client': CLIENT,
+        'client_key': CLIENT_KEY,
+        'start': start,
+        'end': end
+    }
+    with metrics.timer('fetch_window_seconds'):
+        response = session.get(API_URL, params=params, timeout=timeout, verify=SSL_VERIFY)
+    metrics.inc('fetch_requests', status=response.status_code)
+    metrics.inc('fetch_bytes', len(response.content))
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Ошибка API: {response.status_code}, {response.text}", response=response)
+    with metrics.timer('fetch_parse_seconds'):
+        data = response.json()
+    metrics.inc('fetch_records', len(data))
+    return data
+
+@metrics.timed('fetch')
+def fetch_data_from_api(start, end, cache=None):
     """Получает данные из API
         - отправляет GET-запрос к API с указанным периодом
         - использует сессию с повторными попытками
         - отключает SSL-проверку, если SSL_VERIFY = False (для корпоративных сетей)
         - логирует предупреждение об отключённой SSL-проверке
-        - Возвращает данные в формате JSON или пустой список при ошибке
+        - cache — ApiCache: ответ за этот же период берётся из кэша без запроса
+        - Возвращает данные в формате JSON (пустой список — новых записей нет);
+          при ошибке API логирует её и выбрасывает исключение
     """
     logging.info(f"Запрос данных с {start} по {end}")
+    if cache is not None:
+        data = cache.get(CLIENT, start, end)
+        if data is not None:
+            logging.info(f"Получено {len(data)} записей из кэша API")
+            return data
 
     if not SSL_VERIFY:
         logging.warning("SSL-проверка отключена. Убедитесь, что соединение безопасно.")
@@ -81,45 +129,429 @@ def fetch_data_from_api(start, end):
     try:
         # Создаём сессию с повторными попытками
         session = get_session_with_retries()
+        data = request_window(session, start, end, timeout=60)
+        logging.info(f"Успешно получено {len(data)} записей из API")
+        if cache is not None:
+            cache.put(CLIENT, start, end, data)
+        return data
+    except requests.HTTPError as e:
+        logging.error(str(e))
+        raise
+    except Exception as e:
+        logging.error(f"Исключение при запросе к API: {e}")
+        raise
+
+WINDOW_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
 
-        params = {
-            'client': CLIENT,
-            'client_key': CLIENT_KEY,
-            'start': start,
-            'end': end
-        }
+API_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
 
-        response = session.get(API_URL, params=params, timeout=60, verify=SSL_VERIFY)
+def split_time_range(start, end, window='day'):
+    """Разбивает период [start, end] на последовательные окна
+        - start и end — строки в формате API (YYYY-MM-DD HH:MM:SS.ffffff)
+        - window — 'hour', 'day' или timedelta
+        - окна не пересекаются: каждое заканчивается за микросекунду до начала следующего
+        - возвращает список пар (start, end) в том же строковом формате
+    """
+    step = WINDOW_SIZES[window] if isinstance(window, str) else window
+    current = datetime.fromisoformat(start)
+    last = datetime.fromisoformat(end)
+    windows = []
+    while current <= last:
+        window_end = min(current + step - timedelta(microseconds=1), last)
+        windows.append((current.strftime(API_DATETIME_FORMAT), window_end.strftime(API_DATETIME_FORMAT)))
+        current = window_end + timedelta(microseconds=1)
+    return windows
 
-        if response.status_code == 200:
-            data = response.json()
-            logging.info(f"Успешно получено {len(data)} записей из API")
+def halve_window(start, end, min_seconds=60):
+    """Делит окно пополам
+        - возвращает две пары (start, end) или None, если окно уже короче 2 * min_seconds
+    """
+    window_start = datetime.fromisoformat(start)
+    window_end = datetime.fromisoformat(end)
+    if window_end - window_start < timedelta(seconds=2 * min_seconds):
+        return None
+    middle = window_start + (window_end - window_start) / 2
+    return split_time_range(start, end, middle - window_start + timedelta(microseconds=1))
+
+def fetch_window_adaptive(session, start, end, timeout=FETCH_TIMEOUT, max_rows=FETCH_MAX_ROWS,
+                          min_window=FETCH_MIN_WINDOW):
+    """Загружает одно окно, при необходимости уменьшая его
+        - если запрос упал по таймауту или вернул max_rows записей и больше
+          (ответ мог быть обрезан или слишком тяжёл), окно делится пополам
+          и половины загружаются по очереди
+        - окно короче 2 * min_window секунд не делится: таймаут пробрасывается,
+          большой ответ принимается как есть
+        - возвращает список записей в порядке окон
+    """
+    try:
+        data = request_window(session, start, end, timeout)
+        if len(data) < max_rows:
             return data
-        else:
-            logging.error(f"Ошибка API: {response.status_code}, {response.text}")
-            return []
+        reason = f"получено {len(data)} записей"
+    except requests.Timeout:
+        data = None
+        reason = f"таймаут {timeout} с"
+
+    halves = halve_window(start, end, min_window)
+    if halves is None:
+        if data is None:
+            raise requests.Timeout(f"Таймаут на минимальном окне {start} — {end}")
+        logging.warning(f"Окно {start} — {end} вернуло {len(data)} записей, но дробить его дальше нельзя")
+        return data
+
+    logging.info(f"Окно {start} — {end} уменьшено вдвое: {reason}")
+    result = []
+    for half_start, half_end in halves:
+        result.extend(fetch_window_adaptive(session, half_start, half_end, timeout, max_rows, min_window))
+    return result
+
+def fetch_window_cached(session, start, end, cache=None):
+    """fetch_window_adaptive через кэш ответов API: окно из кэша не запрашивается, новое — сохраняется"""
+    if cache is not None:
+        data = cache.get(CLIENT, start, end)
+        if data is not None:
+            return data
+    data = fetch_window_adaptive(session, start, end)
+    if cache is not None:
+        cache.put(CLIENT, start, end, data)
+    return data
+
+@metrics.timed('fetch')
+def fetch_data_windowed(start, end, window=FETCH_WINDOW, workers=FETCH_WORKERS, cache=None):
+    """Получает данные из API по окнам
+        - делит период на окна (час/день) и загружает их параллельно в пуле из workers потоков
+        - все потоки используют одну сессию с пулом соединений
+        - слишком тяжёлые окна дробятся автоматически (см. fetch_window_adaptive)
+        - окна, упавшие с ошибкой, повторяются по одному после основного прохода
+        - cache — ApiCache: окна, уже лежащие в кэше, не запрашиваются (см. api_cache.py)
+        - результаты склеиваются в порядке окон
+        - Возвращает список записей (пустой — новых записей нет); если окно так и не загрузилось,
+          выбрасывает исключение этого окна
+    """
+    windows = split_time_range(start, end, window)
+    logging.info(f"Запрос данных с {start} по {end}: {len(windows)} окон ({window}), потоков: {workers}")
+
+    if not SSL_VERIFY:
+        logging.warning("SSL-проверка отключена. Убедитесь, что соединение безопасно.")
+
+    session = get_session_with_retries(pool_maxsize=workers, retry_read_timeouts=False)
+    results = [None] * len(windows)
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(fetch_window_cached, session, window_start, window_end, cache): i
+                for i, (window_start, window_end) in enumerate(windows)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logging.warning(f"Окно {windows[i][0]} — {windows[i][1]} не загружено: {e}. Повторим позже")
+                    failed.append(i)
+
+        # Повторяем упавшие окна по одному, чтобы не нагружать API
+        for i in sorted(failed):
+            try:
+                results[i] = fetch_window_cached(session, *windows[i], cache)
+            except Exception as e:
+                logging.error(f"Окно {windows[i][0]} — {windows[i][1]} не загружено повторно: {e}")
+                raise
+    finally:
+        session.close()
+
+    data = [record for chunk in results for record in chunk]
+    logging.info(f"Успешно получено {len(data)} записей из API")
+    return data
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(chunks):
+    """Потоково разбирает JSON-массив верхнего уровня
+        - chunks — итератор байтовых (или строковых) кусков ответа
+        - элементы массива декодируются по одному через json.JSONDecoder.raw_decode,
+          в памяти держится только ещё не разобранный хвост
+        - выбрасывает ValueError, если ответ не JSON-массив или оборван
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    state = 'start'  # start → first → (value → sep)* → end
+
+    def consume(final):
+        nonlocal buffer, state
+        pos = 0
+        items = []
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError(f"Ожидался JSON-массив, получено: {buffer[pos:pos + 50]!r}")
+                state = 'first'
+                pos += 1
+            elif state == 'sep':
+                if char not in ',]':
+                    raise ValueError(f"Ожидалась ',' или ']', получено: {buffer[pos:pos + 50]!r}")
+                state = 'value' if char == ',' else 'end'
+                pos += 1
+            elif state == 'first' and char == ']':
+                state = 'end'
+                pos += 1
+            elif state == 'end':
+                raise ValueError(f"Лишние данные после JSON-массива: {buffer[pos:pos + 50]!r}")
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break  # элемент пришёл не целиком — ждём следующий кусок
+                if end == len(buffer) and not final:
+                    break  # число на границе куска могло оборваться
+                items.append(item)
+                state = 'sep'
+                pos = end
+        buffer = buffer[pos:]
+        return items
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        yield from consume(final=False)
+    buffer += utf8.decode(b'', final=True)
+    yield from consume(final=True)
+    if state != 'end':
+        raise ValueError("JSON-массив оборван")
+
+def _counted(chunks):
+    """Пропускает куски ответа, считая скачанные байты в метрику fetch_bytes"""
+    for chunk in chunks:
+        metrics.inc('fetch_bytes', len(chunk))
+        yield chunk
+
+def fetch_data_stream(start, end, window=FETCH_WINDOW, chunk_size=64 * 1024, client=None, client_key=None,
+                      url=None):
+    """Потоково получает данные из API
+        - период делится на окна (час/день), окна запрашиваются по очереди
+        - ответ читается с stream=True и разбирается поэлементно (iter_json_array),
+          поэтому целиком в памяти не хранится ни тело ответа, ни список записей
+        - генератор: отдаёт записи по одной в порядке окон
+        - client, client_key, url — клиент и адрес API (по умолчанию CLIENT, CLIENT_KEY, API_URL)
+        - при ошибке API логирует её и выбрасывает исключение: часть записей уже отдана
+    """
+    windows = split_time_range(start, end, window)
+    logging.info(f"Потоковый запрос данных с {start} по {end}: {len(windows)} окон ({window})")
+
+    if not SSL_VERIFY:
+        logging.warning("SSL-проверка отключена. Убедитесь, что соединение безопасно.")
+
+    session = get_session_with_retries()
+    total = 0
+    window_total = 0
+    try:
+        for window_start, window_end in windows:
+            params = {
+                'client': client or CLIENT,
+                'client_key': client_key or CLIENT_KEY,
+                'start': window_start,
+                'end': window_end
+            }
+            with session.get(url or API_URL, params=params, timeout=FETCH_TIMEOUT, verify=SSL_VERIFY,
+                             stream=True) as response:
+                metrics.inc('fetch_requests', status=response.status_code)
+                if response.status_code != 200:
+                    logging.error(f"Ошибка API: {response.status_code}, {response.text}")
+                    raise requests.HTTPError(f"Ошибка API: {response.status_code}", response=response)
+                for record in iter_json_array(_counted(response.iter_content(chunk_size=chunk_size))):
+                    total += 1
+                    yield record
+                metrics.inc('fetch_records', total - window_total)
+                window_total = total
     except Exception as e:
-        logging.error(f"Исключение при запросе к API: {e}")
-        return []
+        logging.error(f"Исключение при потоковом запросе к API: {e}")
+        raise
+    finally:
+        session.close()
+    logging.info(f"Успешно получено {total} записей из API")
 
-def parse_passback_params(raw_params):
-    """Парсинг passback_params
-        - безопасно парсит строку passback_params в настоящий словарь с помощью ast.literal_eval
-        - Извлекает oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url
-        - При ошибке логирует проблему и возвращает None
+def validate_record(record):
+    """Проверяет и преобразует одну запись API
+        - проверяет наличие обязательных полей.
+        - убеждается, что attempt_type — это run или submit.
+        - парсит passback_params.
+        - преобразует is_correct в bool или None.
+        - возвращает (запись для БД, None) или (None, (причина, описание)),
+          где причина — missing_fields, bad_attempt_type, bad_passback или error;
+          описание короткое, без самой записи (её при необходимости выводит rejects.py).
+        - ничего не логирует: так её можно вызывать в дочерних процессах.
     """
     try:
-        parsed = ast.literal_eval(raw_params)
+        # Проверка обязательных полей
+        missing_fields = [key for key in ['lti_user_id', 'passback_params', 'attempt_type', 'created_at'] 
+                        if not (key in record and record[key])]
+        if missing_fields:
+            return None, ('missing_fields', f"отсутствуют поля {missing_fields}")
+
+        if record['attempt_type'] not in ['run', 'submit']:
+            return None, ('bad_attempt_type', "некорректный attempt_type")
+
+        # Парсим passback_params
+        passback = parse_passback_params(record['passback_params'])
+        if not passback:
+            return None, ('bad_passback', "не удалось распарсить passback_params")
+
+        # Приводим is_correct к bool или None
+        is_correct = record['is_correct']
+        if is_correct is not None:
+            is_correct = bool(is_correct)
+
+        # Передаём created_at как есть (PostgreSQL сам обработает микросекунды)
+        created_at = record['created_at']
+
         return {
-            'oauth_consumer_key': parsed.get('oauth_consumer_key'),
-            'lis_result_sourcedid': parsed.get('lis_result_sourcedid'),
-            'lis_outcome_service_url': parsed.get('lis_outcome_service_url')
-        }
+            'user_id': record['lti_user_id'],
+            'oauth_consumer_key': passback['oauth_consumer_key'],
+            'lis_result_sourcedid': passback['lis_result_sourcedid'],
+            'lis_outcome_service_url': passback['lis_outcome_service_url'],
+            'is_correct': is_correct,
+            'attempt_type': record['attempt_type'],
+            'created_at': created_at
+        }, None
+
     except Exception as e:
-        logging.warning(f"Не удалось распарсить passback_params: {raw_params} | Ошибка: {e}")
-        return None
+        return None, ('error', f"{type(e).__name__}: {e}")
+
+def _init_stats(stats):
+    if stats is None:
+        stats = {}
+    stats.setdefault('total', 0)
+    stats.setdefault('valid', 0)
+    stats.setdefault('rejected', Counter())
+    return stats
+
+def _reject(stats, i, reason, detail, record):
+    """Учитывает отклонённую запись: счётчики, выборочный лог и карантин (см. rejects.py)"""
+    stats['rejected'][reason] += 1
+    metrics.inc('rejected_records', reason=reason)
+    REJECTS.reject(i, reason, detail, record)
+
+def iter_processed(raw_data, stats=None):
+    """Обрабатывает и валидирует данные по одной записи (генератор)
+        - каждая запись проходит validate_record.
+        - отдаёт корректные записи по одной, не накапливая их в памяти.
+        - отклонённые записи считаются по причинам, в лог идёт выборка (см. rejects.py).
+        - stats (словарь), если передан, получает счётчики total, valid и rejected (по причинам).
+    """
+    stats = _init_stats(stats)
+    for i, record in enumerate(raw_data):
+        stats['total'] += 1
+        processed_record, rejection = validate_record(record)
+        if rejection:
+            _reject(stats, i, *rejection, record)
+            continue
+        stats['valid'] += 1
+        yield processed_record
+
+def _validate_chunk(offset, records):
+    """Валидирует кусок записей в дочернем процессе
+        - возвращает принятые записи и отказы [(номер записи, причина, описание)]
+    """
+    accepted = []
+    rejections = []
+    for i, record in enumerate(records, offset):
+        processed_record, rejection = validate_record(record)
+        if rejection:
+            rejections.append((i, *rejection))
+        else:
+            accepted.append(processed_record)
+    return len(records), accepted, rejections
+
+def iter_processed_parallel(raw_data, stats=None, workers=PROCESS_WORKERS, chunk_size=PROCESS_CHUNK_SIZE):
+    """То же, что iter_processed, но валидация идёт в ProcessPoolExecutor из workers процессов
+        - записи режутся на куски по chunk_size и раздаются процессам
+        - в работе держится не больше 2 * workers кусков, поэтому генератор на входе
+          не вычитывается целиком
+        - результаты кусков собираются в исходном порядке; отказы учитываются
+          в основном процессе с исходными номерами записей
+    """
+    stats = _init_stats(stats)
 
-def process_data(raw_data):
+    def drain(item):
+        offset, chunk, future = item
+        total, accepted, rejections = future.result()
+        stats['total'] += total
+        stats['valid'] += len(accepted)
+        for i, reason, detail in rejections:
+            _reject(stats, i, reason, detail, chunk[i - offset])
+        return accepted
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        offset = 0
+        for chunk in batched(raw_data, chunk_size):
+            pending.append((offset, chunk, executor.submit(_validate_chunk, offset, chunk)))
+            offset += len(chunk)
+            if len(pending) >= 2 * workers:
+                yield from drain(pending.popleft())
+        while pending:
+            yield from drain(pending.popleft())
+
+def iter_processed_columns(raw_data, stats=None, batch_size=STREAM_BATCH_SIZE):
+    """Векторная валидация (PROCESS_ENGINE=vectorized): отдаёт принятые записи пачками по столбцам
+        - каждая пачка — {столбец: список значений}, её загружает insert_attempt_columns
+        - принятые записи и отказы те же, что у iter_processed (см. vectorized.py)
+        - stats — как в iter_processed
+    """
+    # numpy нужен только векторному движку
+    from vectorized import validate_batch
+
+    stats = _init_stats(stats)
+    offset = 0
+    for batch in batched(raw_data, batch_size):
+        columns, rejections = validate_batch(batch, offset)
+        stats['total'] += len(batch)
+        stats['valid'] += len(batch) - len(rejections)
+        for i, reason, detail in rejections:
+            _reject(stats, i, reason, detail, batch[i - offset])
+        offset += len(batch)
+        if columns['user_id']:
+            yield columns
+
+def _load_processed(raw_data, stats, workers=1, batch_size=STREAM_BATCH_SIZE):
+    """Валидирует записи выбранным движком (PROCESS_ENGINE) и загружает их в БД пачками
+        - векторный движок работает в одном процессе, workers для него не используется
+        - возвращает число новых записей
+    """
+    if PROCESS_ENGINE == 'vectorized':
+        return insert_attempt_columns(iter_processed_columns(raw_data, stats, batch_size), CLIENT)
+    return insert_attempts(_processed(raw_data, stats, workers), batch_size=batch_size, client=CLIENT)
+
+def _processed(raw_data, stats, workers):
+    """Выбирает последовательную или многопроцессную валидацию"""
+    if workers > 1:
+        return iter_processed_parallel(raw_data, stats, workers)
+    return iter_processed(raw_data, stats)
+
+def _log_processing_stats(stats, workers):
+    metrics.inc('processed_records', stats['total'])
+    metrics.inc('valid_records', stats['valid'])
+    rejected = dict(stats['rejected'])
+    logging.info(f"Обработано {stats['valid']} валидных записей из {stats['total']}"
+                 + (f", отклонено: {rejected}" if rejected else ""))
+    if rejected:
+        logging.info(REJECTS.summary())
+    # В многопроцессном режиме кэш и счётчики разбора у каждого процесса свои
+    if workers <= 1:
+        logging.info(f"Разбор passback_params: {parse_stats()}")
+
+@metrics.timed('process')
+def process_data(raw_data, workers=1, compact=False):
     """Обрабатывает и валидирует данные
         - проверяет наличие обязательных полей.
         - убеждается, что attempt_type — это run или submit.
@@ -127,82 +559,182 @@ def process_data(raw_data):
         - преобразует is_correct в bool или None.
         - формирует список корректных записей для загрузки в БД.
         - все отклонённые записи логируются с указанием причины.
+        - workers > 1 — валидация в нескольких процессах (порядок записей сохраняется).
+        - возвращает список словарей, как validate_record.
+        - compact=True — вместо списка records.AttemptBatch: записи по столбцам, строки закодированы
+          словарём (в разы меньше памяти); так её вызывает загрузка в main.py, словари из пачки
+          даёт адаптер records.as_dicts.
     """
-    processed = []
-    for i, record in enumerate(raw_data):
-        try:
-            # Проверка обязательных полей
-            missing_fields = [key for key in ['lti_user_id', 'passback_params', 'attempt_type', 'created_at'] 
-                            if not (key in record and record[key])]
-            if missing_fields:
-                logging.warning(f"Пропущена запись {i}: отсутствуют поля {missing_fields}. Запись: {record}")
-                continue
-
-            if record['attempt_type'] not in ['run', 'submit']:
-                logging.warning(f"Пропущена запись {i}: некорректный attempt_type: {record['attempt_type']}. Запись: {record}")
-                continue
-
-            # Парсим passback_params
-            passback = parse_passback_params(record['passback_params'])
-            if not passback:
-                logging.warning(f"Пропущена запись {i}: не удалось распарсить passback_params. Значение: {record['passback_params']}")
-                continue
-
-            # Приводим is_correct к bool или None
-            is_correct = record['is_correct']
-            if is_correct is not None:
-                is_correct = bool(is_correct)
-
-            # Передаём created_at как есть (PostgreSQL сам обработает микросекунды)
-            created_at = record['created_at']
-
-            processed_record = {
-                'user_id': record['lti_user_id'],
-                'oauth_consumer_key': passback['oauth_consumer_key'],
-                'lis_result_sourcedid': passback['lis_result_sourcedid'],
-                'lis_outcome_service_url': passback['lis_outcome_service_url'],
-                'is_correct': is_correct,
-                'attempt_type': record['attempt_type'],
-                'created_at': created_at
-            }
-            processed.append(processed_record)
-
-        except Exception as e:
-            logging.error(f"Ошибка при обработке записи {i}: {e}. Запись: {record}")
-    logging.info(f"Обработано {len(processed)} валидных записей из {len(raw_data)}")
+    stats = {}
+    processed = _processed(raw_data, stats, workers)
+    processed = AttemptBatch.from_records(processed) if compact else list(processed)
+    _log_processing_stats(stats, workers)
+    metrics.inc('stage_rows', stats['total'], stage='process')
     return processed
 
-def main():
-    setup_logger()
+def ingest_stream(start, end, batch_size=STREAM_BATCH_SIZE, workers=1):
+    """Потоковая загрузка: API → валидация → БД пачками по batch_size записей
+        - пиковая память не зависит от объёма ответа API
+        - каждая пачка коммитится отдельно; ошибки API и БД пробрасываются
+        - workers > 1 — валидация в нескольких процессах
+        - возвращает число загруженных записей
+    """
+    stats = {}
+    loaded = _load_processed(fetch_data_stream(start, end), stats, workers, batch_size)
+    _log_processing_stats(stats, workers)
+    logging.info(f"Успешно вставлено {loaded} новых записей, дублей пропущено: {stats['valid'] - loaded}")
+    return loaded
+
+def replay_from_cache(start, end, batch_size=STREAM_BATCH_SIZE, workers=1):
+    """Загружает в БД записи из кэша ответов API за [start, end], не обращаясь к API
+        - окна читаются по одному и идут в БД пачками, как в потоковом режиме
+        - уже загруженные записи пропускаются по ключу дедупликации
+        - возвращает число загруженных записей
+    """
+    cache = ApiCache()
+    entries = cache.entries(CLIENT, start, end)
+    if not entries:
+        logging.warning(f"В кэше API нет окон за период с {start} по {end}")
+        return 0
+    logging.info(f"Загрузка из кэша API: {len(entries)} окон, {sum(e['records'] for e in entries)} записей")
+    stats = {}
+    loaded = _load_processed(cache.iter_records(CLIENT, start, end), stats, workers, batch_size)
+    _log_processing_stats(stats, workers)
+    logging.info(f"Успешно вставлено {loaded} новых записей, дублей пропущено: {stats['valid'] - loaded}")
+    return loaded
+
+def incremental_range(source, overlap_minutes=SYNC_OVERLAP_MINUTES, first_start=None):
+    """Период инкрементальной синхронизации источника
+        - начало — watermark минус перекрытие overlap_minutes (на случай запоздавших записей),
+          при первом запуске — first_start (по умолчанию START_PARSE)
+        - конец — текущий момент
+        - перекрытие безопасно: повторные строки отсекаются ключом дедупликации
+    """
+    end = datetime.now().strftime(API_DATETIME_FORMAT)
+    watermark = get_watermark(source)
+    if watermark is None:
+        first_start = first_start or START_PARSE
+        logging.info(f"Watermark для {source} не найден, первая синхронизация с {first_start}")
+        return first_start, end
+    start = (watermark - timedelta(minutes=overlap_minutes)).strftime(API_DATETIME_FORMAT)
+    return start, end
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сбор данных: API → PostgreSQL")
+    parser.add_argument('--incremental', action='store_true', default=SYNC_MODE == 'incremental',
+                        help="загрузить только новые данные после watermark (по умолчанию из SYNC_MODE)")
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS,
+                        help="число процессов для валидации записей (по умолчанию из PROCESS_WORKERS)")
+    parser.add_argument('--replay', action='store_true',
+                        help="загрузить период START_PARSE..END_PARSE из кэша ответов API, без запросов к API")
+    return parser.parse_args(argv)
+
+def run(args):
+    """Сбор данных по аргументам командной строки; возвращает True, если запуск прошёл успешно"""
     logging.info("=== Запуск скрипта сбора данных ===")
 
     # Проверка подключения к БД
     try:
-        import psycopg2
-        conn = psycopg2.connect(**DB_CONFIG)
-        conn.close()
+        check_connection()
         logging.info("✅ Подключение к PostgreSQL успешно")
     except Exception as e:
         logging.critical(f"❌ Ошибка подключения к PostgreSQL: {e}")
-        return
+        return False
 
     # Создаём таблицу
     create_table()
 
-    # Запрос данных
-    raw_data = fetch_data_from_api(START_PARSE, END_PARSE)
+    # Период загрузки: из .env или от последнего watermark
+    start, end = START_PARSE, END_PARSE
+    if args.incremental and not args.replay:
+        start, end = incremental_range(CLIENT)
+        logging.info(f"Инкрементальная синхронизация с {start} по {end}")
 
-    if not raw_data:
-        logging.warning("Нет данных от API, завершаем работу")
-        return
+    # Секции attempts под период загрузки
+    try:
+        prepare_partitions(start, end)
+    except Exception as e:
+        logging.critical(f"❌ Ошибка при создании секций attempts: {e}")
+        return False
 
-    # Обработка данных
-    processed_data = process_data(raw_data)
+    # Отклонённые записи этого окна идут в attempts_quarantine
+    REJECTS.attach_window(CLIENT, start, end)
 
-    # Загрузка в БД
-    insert_data(processed_data)
+    if args.replay:
+        # Повторная загрузка из кэша: API не запрашивается, watermark не меняется
+        try:
+            replay_from_cache(start, end, workers=args.workers)
+        except Exception as e:
+            logging.critical(f"❌ Загрузка из кэша API прервана: {e}")
+            return False
+        logging.info("=== Скрипт завершён успешно ===")
+        return True
+
+    if FETCH_MODE == 'stream':
+        # Потоковый режим: запрос, обработка и загрузка идут пачками
+        try:
+            ingest_stream(start, end, workers=args.workers)
+        except Exception as e:
+            logging.critical(f"❌ Потоковая загрузка прервана: {e}")
+            return False
+    else:
+        # Запрос данных (окна, уже лежащие в кэше ответов API, не запрашиваются)
+        cache = open_cache()
+        try:
+            if FETCH_MODE == 'windowed':
+                raw_data = fetch_data_windowed(start, end, cache=cache)
+            elif FETCH_MODE == 'async':
+                # aiohttp нужен только этому режиму
+                from async_client import fetch_data_async
+                raw_data = fetch_data_async(start, end, cache=cache)
+            else:
+                raw_data = fetch_data_from_api(start, end, cache=cache)
+        except Exception as e:
+            logging.critical(f"❌ Запрос данных к API не удался: {e}")
+            return False
+        finally:
+            if cache is not None:
+                cache.close()
+
+        # Обработка данных и загрузка в БД
+        if not raw_data:
+            # Пустой ответ — не ошибка: новых записей нет, watermark остаётся прежним
+            logging.info("Новых данных от API нет")
+        else:
+            try:
+                if PROCESS_ENGINE == 'vectorized':
+                    stats = {}
+                    loaded = insert_attempt_columns(iter_processed_columns(raw_data, stats), CLIENT)
+                    _log_processing_stats(stats, 1)
+                    valid = stats['valid']
+                else:
+                    processed_data = process_data(raw_data, workers=args.workers, compact=True)
+                    loaded = insert_attempts(processed_data, client=CLIENT)
+                    valid = len(processed_data)
+            except Exception as e:
+                logging.error(f"Ошибка при вставке данных: {e}. Вставлено до ошибки: {getattr(e, 'loaded', 0)}")
+                return False
+            logging.info(f"Успешно вставлено {loaded} новых записей, дублей пропущено: {valid - loaded}")
+
+    # Watermark двигаем только после полностью успешной загрузки
+    if args.incremental:
+        watermark = advance_watermark(CLIENT, start, end)
+        logging.info(f"Watermark {CLIENT}: {watermark}")
 
     logging.info("=== Скрипт завершён успешно ===")
+    return True
+
+def main(argv=None):
+    """Сбор данных; возвращает код выхода (0 — успех)"""
+    args = parse_args(argv)
+    setup_logger()
+    ok = False
+    try:
+        ok = run(args)
+    finally:
+        REJECTS.flush()
+        metrics.write_run_summary('main', 'ok' if ok else 'error')
+    return 0 if ok else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
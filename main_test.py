@@ -1,6 +1,7 @@
 import logging
 from datetime import datetime, timedelta
 import os
+import pytest
 
 # Настройка логирования
 def setup_logger():
@@ -47,6 +48,849 @@ def test_connection():
         logging.error(f"❌ Ошибка подключения к PostgreSQL: {e}")
         return False
 
+@pytest.fixture
+def test_db(monkeypatch):
+    """Чистая схема flowtrack_test в базе из .env; общий пул соединений подменяется пулом с этой схемой"""
+    import psycopg2
+    import db_pool
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except Exception as e:
+        pytest.skip(f"PostgreSQL недоступен: {e}")
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP SCHEMA IF EXISTS flowtrack_test CASCADE")
+    cur.execute("CREATE SCHEMA flowtrack_test")
+    pool = db_pool.ConnectionPool(1, 2, options='-c search_path=flowtrack_test', **DB_CONFIG)
+    monkeypatch.setattr(db_pool, '_pool', pool)
+    yield pool
+    pool.closeall()
+    cur.execute("DROP SCHEMA flowtrack_test CASCADE")
+    conn.close()
+
+def test_rollup_matches_full_scan(test_db):
+    """Дневные агрегаты после нескольких загрузок (с перекрытием) совпадают с полным сканом attempts"""
+    import pandas as pd
+    from analytics import query_metrics
+    from database import create_table, insert_attempts
+    from main import process_data
+    from synthetic import generate_records
+
+    create_table()
+    records = process_data(generate_records(3000, spread_hours=72))
+    insert_attempts(records[:2000], batch_size=500)
+    insert_attempts(records[1500:], batch_size=500)  # перекрытие: дубли не должны попасть в агрегаты
+    for group_by in ((), ('day',), ('week',)):
+        pd.testing.assert_frame_equal(query_metrics(group_by=group_by, source='rollup'),
+                                      query_metrics(group_by=group_by, source='attempts'))
+    by_type = query_metrics('2023-05-31 06:00', '2023-06-02', group_by=('day', 'attempt_type'))
+    window = [record for record in records if '2023-05-31 06:00' <= record['created_at'] < '2023-06-02']
+    assert by_type['total_attempts'].sum() == len({(r['user_id'], r['lis_result_sourcedid'], r['attempt_type'],
+                                                    r['created_at']) for r in window})
+
+    # Два загрузчика пересчитывают один день одновременно: второй ждёт первого и видит его строки
+    import threading
+    from db_pool import get_connection
+    from rollup import refresh_days
+
+    day = '2023-06-10'
+    insert = "INSERT INTO attempts (user_id, attempt_type, created_at) VALUES (%s, 'run', %s)"
+    errors = []
+
+    def second_loader():
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(insert, ('second', f'{day} 13:00'))
+                refresh_days([day], cur)
+                conn.commit()
+                cur.close()
+        except Exception as e:
+            errors.append(e)
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(insert, ('first', f'{day} 12:00'))
+        refresh_days([day], cur)
+        thread = threading.Thread(target=second_loader)
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        conn.commit()
+        thread.join(10)
+        cur.execute("SELECT total_attempts FROM attempts_daily WHERE day = %s", (day,))
+        assert errors == [] and cur.fetchone() == (2,)
+        cur.execute("SELECT user_id FROM attempts_daily_users WHERE day = %s ORDER BY user_id", (day,))
+        assert cur.fetchall() == [('first',), ('second',)]
+        cur.close()
+
+def test_pipeline_loads_and_stops_on_error(test_db):
+    """Конвейер загружает все валидные записи; ошибка источника останавливает все стадии"""
+    import threading
+    from database import create_table
+    from pipeline import PipelineError, run_pipeline
+    from synthetic import generate_records
+
+    create_table()
+    report = run_pipeline('2023-05-31', '2023-06-01', batch_size=300, queue_size=2,
+                          fetch=lambda start, end: generate_records(2000))
+    assert report['loaded'] == 2000 and report['stages']['fetch']['records'] == 2000
+    assert report['queues']['raw']['max_depth'] <= 2
+
+    def broken(start, end):
+        yield from generate_records(1000, start='2023-06-02 00:00:00')
+        raise ConnectionError("API недоступен")
+
+    with pytest.raises(PipelineError, match="fetch"):
+        run_pipeline('2023-06-02', '2023-06-03', batch_size=300, queue_size=2, fetch=broken)
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+def test_async_client_against_mock_api():
+    """Асинхронный клиент: окна идут параллельно, сбои 503 повторяются, записи совпадают с API"""
+    from async_client import fetch_data_async
+    from mock_api import MockStatisticsAPI
+    from synthetic import generate_records
+
+    start, end = '2023-05-31 00:00:00.000000', '2023-05-31 23:59:59.999999'
+    with MockStatisticsAPI(generate_records(3000), latency=0.02, fail_every=5) as api:
+        data = fetch_data_async(start, end, window='hour', url=api.url, concurrency=8, rate=0, backoff_factor=0.01)
+        assert data == api.window(start, end) and len(data) == 3000
+        assert api.stats['failures'] > 0 and api.stats['max_concurrent'] > 1
+
+def test_api_cache_skips_cached_windows(tmp_path, monkeypatch):
+    """Повторный запуск берёт прошедшие окна из кэша без запросов к API; большой кэш вытесняет старые окна"""
+    import main
+    from api_cache import ApiCache
+    from mock_api import MockStatisticsAPI
+    from synthetic import generate_records
+
+    start, end = '2023-05-31 00:00:00.000000', '2023-05-31 23:59:59.999999'
+    with MockStatisticsAPI(generate_records(2000)) as api:
+        monkeypatch.setattr(main, 'API_URL', api.url)
+        first = main.fetch_data_windowed(start, end, window='hour', workers=4, cache=ApiCache(str(tmp_path)))
+        requests_made = api.stats['requests']
+        cache = ApiCache(str(tmp_path))
+        assert main.fetch_data_windowed(start, end, window='hour', workers=4, cache=cache) == first
+        assert api.stats['requests'] == requests_made == 24
+    assert cache.stats['hits'] == 24 and list(cache.iter_records('Skillfactory', start, end)) == first
+
+    # Записи без created_at и не словари при --replay не теряются, а уходят на проверку validate_record
+    broken = [{'lti_user_id': 'u'}, {'created_at': None}, [1, 2], {'created_at': '2023-06-01 00:10:00'},
+              {'created_at': '2023-06-02 00:10:00'}]
+    cache.put('broken', '2023-06-01 00:00:00.000000', '2023-06-01 23:59:59.999999', broken)
+    replayed = list(cache.iter_records('broken', '2023-06-01 00:00:00.000000', '2023-06-01 23:59:59.999999'))
+    assert replayed == broken[:4]
+    assert [main.validate_record(record)[1][0] for record in replayed] == ['missing_fields'] * 4
+
+    # Окно вытеснено другим потоком между поиском в манифесте и чтением файла — это промах, а не ошибка
+    read = cache._read
+
+    def evicted_read(entry):
+        os.remove(os.path.join(cache.directory, entry['file']))
+        return read(entry)
+
+    monkeypatch.setattr(cache, '_read', evicted_read)
+    misses = cache.stats['misses']
+    assert cache.get('Skillfactory', *main.split_time_range(start, end, 'hour')[0]) is None
+    assert cache.stats['misses'] == misses + 1 and len(cache.entries('Skillfactory')) == 23
+    monkeypatch.setattr(cache, '_read', read)
+
+    small = ApiCache(str(tmp_path), max_bytes=cache.entries('Skillfactory')[0]['bytes'] * 3)
+    small.put('Skillfactory', '2023-06-01 00:00:00.000000', '2023-06-01 00:59:59.999999', [{'a': 1}])
+    assert len(small.entries('Skillfactory')) <= 3
+
+def test_parquet_export_matches_postgres(test_db, tmp_path, monkeypatch):
+    """Метрики по выгрузке Parquet совпадают с SQL; повторная выгрузка перезаписывает только новые дни"""
+    import analytics
+    import pandas as pd
+    from database import create_table, insert_attempts
+    from export import export_attempts
+    from main import process_data
+    from synthetic import generate_records
+
+    monkeypatch.setattr(analytics, 'EXPORT_DIR', str(tmp_path))
+    create_table()
+    insert_attempts(process_data(generate_records(3000, spread_hours=60)))
+    assert export_attempts(directory=str(tmp_path), batch_size=700) == {'days': 3, 'rows': 3000}
+    assert export_attempts(directory=str(tmp_path))['days'] == 0
+
+    for group_by in ((), ('day', 'attempt_type'), ('week', 'oauth_consumer_key')):
+        expected = analytics.query_metrics('2023-05-31 06:00', '2023-06-02 12:00', group_by, source='attempts')
+        actual = analytics.query_metrics('2023-05-31 06:00', '2023-06-02 12:00', group_by, source='parquet')
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    insert_attempts(process_data(generate_records(100, start='2023-06-05 00:00:00', seed=7)))
+    assert export_attempts(directory=str(tmp_path)) == {'days': 1, 'rows': 100}
+
+def test_vectorized_matches_python_engine(test_db):
+    """Векторная валидация принимает и отклоняет те же записи, что validate_record; COPY по столбцам грузит то же"""
+    from database import create_table, insert_attempt_columns
+    from db_pool import get_connection
+    from main import iter_processed, iter_processed_columns, validate_record
+    from synthetic import generate_records
+    from vectorized import validate_batch
+
+    records = list(generate_records(500))
+    passback = records[0]['passback_params']
+    records += [
+        {'lti_user_id': 'u1', 'passback_params': passback, 'attempt_type': 'run', 'created_at': ''},
+        {'lti_user_id': None, 'passback_params': passback, 'attempt_type': 'submit', 'created_at': '2023-05-31'},
+        {'passback_params': passback, 'attempt_type': 'run', 'created_at': '2023-05-31 01:00:00', 'is_correct': 1},
+        {'lti_user_id': 'u2', 'passback_params': passback, 'attempt_type': 'check', 'created_at': '2023-05-31',
+         'is_correct': None},
+        {'lti_user_id': 'u3', 'passback_params': "{'broken': ", 'attempt_type': 'run', 'created_at': '2023-05-31'},
+        {'lti_user_id': 'u4', 'passback_params': passback, 'attempt_type': 'run', 'created_at': '2023-05-31 02:00:00'},
+        {'lti_user_id': 'u5', 'passback_params': passback, 'attempt_type': 'submit',
+         'created_at': '2023-05-31 03:00:00', 'is_correct': 0},
+        {'lti_user_id': 'u6', 'passback_params': passback, 'attempt_type': 'submit',
+         'created_at': '2023-05-31 04:00:00', 'is_correct': 'yes'},
+    ]
+
+    def run(engine, data):
+        stats = {}
+        if engine == 'python':
+            rows = list(iter_processed(data, stats))
+        else:
+            rows = [dict(zip(batch, row)) for batch in iter_processed_columns(data, stats, batch_size=128)
+                    for row in zip(*batch.values())]
+        return rows, stats
+
+    expected, expected_stats = run('python', records)
+    actual, actual_stats = run('vectorized', records)
+    assert actual == expected and actual_stats == expected_stats
+    assert set(expected_stats['rejected']) == {'missing_fields', 'bad_attempt_type', 'bad_passback', 'error'}
+    assert validate_batch(records, 10)[1] == [(i, *validate_record(record)[1]) for i, record in enumerate(records, 10)
+                                              if validate_record(record)[1]]
+    # Запись не словарь — пачка уходит на запасной путь validate_record
+    assert run('vectorized', records[:3] + ['мусор']) == run('python', records[:3] + ['мусор'])
+
+    create_table()
+    assert insert_attempt_columns(iter_processed_columns(records + records[:100])) == len(expected)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*), count(*) FILTER (WHERE is_correct) FROM attempts")
+        assert cur.fetchone() == (len(expected), sum(1 for row in expected if row['is_correct']))
+        cur.execute("SELECT sum(total_attempts) FROM attempts_daily")
+        assert cur.fetchone()[0] == len(expected)
+
+def test_benchmark_dataset_and_regression_check():
+    """Брак из генератора отклоняется validate_record; сравнение с baseline ловит падение скорости и рост памяти"""
+    from benchmarks import compare_results
+    from main import iter_processed
+    from synthetic import generate_records
+
+    assert list(generate_records(200, invalid_ratio=0.0)) == list(generate_records(200))
+    stats = {}
+    valid = list(iter_processed(generate_records(2000, invalid_ratio=0.2), stats))
+    assert len(valid) == stats['valid'] and 300 < stats['total'] - stats['valid'] < 500
+    assert set(stats['rejected']) == {'missing_fields', 'bad_attempt_type', 'bad_passback', 'error'}
+
+    run = {'scenario': 'process', 'engine': 'python', 'records': 1000, 'rows_per_s': 1000, 'peak_rss_mb': 100}
+    baseline = {'results': [run]}
+    assert compare_results([dict(run, rows_per_s=950, peak_rss_mb=105)], baseline, 0.1) == []
+    assert len(compare_results([dict(run, rows_per_s=800, peak_rss_mb=150)], baseline, 0.1)) == 2
+    assert compare_results([dict(run, records=2000, rows_per_s=1)], baseline, 0.1) == []
+
+def test_run_metrics_summary_and_prometheus(tmp_path):
+    """Стадии и отказы попадают в сводку запуска и в textfile Prometheus"""
+    import json
+    import metrics
+    from main import process_data
+    from synthetic import generate_records
+
+    metrics.REGISTRY.reset()
+    process_data(generate_records(1000, invalid_ratio=0.1))
+    summary = metrics.write_run_summary('test', directory=str(tmp_path / 'runs'), textfile_dir=str(tmp_path))
+    counters = summary['counters']
+    assert counters['processed_records'] == 1000 and counters['stage_rows{stage=process}'] == 1000
+    assert sum(value for name, value in counters.items() if name.startswith('rejected_records{')) \
+        == 1000 - counters['valid_records']
+    assert summary['histograms']['stage_seconds{stage=process}']['count'] == 1
+    assert summary['throughput']['stage_rows_per_second{stage=process}'] > 0
+    (saved,) = (tmp_path / 'runs').iterdir()
+    assert json.loads(saved.read_text(encoding='utf-8'))['counters'] == counters
+
+    text = (tmp_path / 'flowtrack_test.prom').read_text(encoding='utf-8')
+    assert 'flowtrack_rejected_records_total{script="test",reason="bad_passback"}' in text
+    assert 'flowtrack_stage_seconds_bucket{script="test",stage="process",le="+Inf"} 1' in text
+    assert 'flowtrack_last_run_success{script="test"} 1' in text
+
+def test_rejects_sampled_logging_and_quarantine(tmp_path, caplog):
+    """Отказы считаются все, в лог идёт выборка (запись форматируется только для неё), карантин получает всё"""
+    import json
+    from rejects import RejectLog
+
+    class Record(dict):
+        formatted = 0
+
+        def __repr__(self):
+            Record.formatted += 1
+            return super().__repr__()
+
+    log = RejectLog(log_first=3, log_every=100, quarantine_dir=str(tmp_path), flush_size=64)
+    with caplog.at_level('WARNING'):
+        for i in range(1000):
+            log.reject(i, 'bad_passback' if i % 2 else 'error', "описание", Record(n=i))
+    # по 500 на причину: первые 3 и каждая 100-я
+    assert log.counts == {'bad_passback': 500, 'error': 500}
+    assert log.logged == len(caplog.records) == 2 * (3 + 5)
+    # Запись форматируется лениво: при выключенном логировании repr не вызывается вовсе
+    Record.formatted = 0
+    logging.disable(logging.CRITICAL)
+    try:
+        for i in range(1000, 1200):
+            log.reject(i, 'error', "описание", Record(n=i))
+    finally:
+        logging.disable(logging.NOTSET)
+    assert Record.formatted == 0
+    assert 'в карантине 1200' in log.summary()
+    (path,) = tmp_path.iterdir()
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [line['record']['n'] for line in lines] == list(range(1200))
+    assert lines[1]['reason'] == 'bad_passback' and lines[0]['detail'] == "описание"
+
+    # Сбой записи карантина при автоматическом сбросе логируется и не прерывает валидацию
+    broken = RejectLog(quarantine_dir=str(path), flush_size=2)
+    with caplog.at_level('ERROR'):
+        for i in range(5):
+            broken.reject(i, 'bad_passback', "описание", {'n': i})
+    assert broken.counts == {'bad_passback': 5} and broken.quarantined == 0
+    assert "Не удалось записать карантин" in caplog.text
+
+def test_quarantine_table_and_reprocess(test_db, monkeypatch):
+    """Отказы окна загрузки сохраняются в attempts_quarantine; исправленные записи reprocess переносит в attempts"""
+    import main
+    from database import create_table, insert_attempts
+    from db_pool import get_connection
+    from quarantine import quarantine_stats, reprocess
+    from rejects import RejectLog
+
+    create_table()
+    passback = "{'oauth_consumer_key': 'k', 'lis_result_sourcedid': 's', 'lis_outcome_service_url': 'u'}"
+    records = [
+        {'lti_user_id': f'u{i}', 'passback_params': passback, 'attempt_type': 'check' if i % 3 else 'run',
+         'created_at': f'2023-05-{10 + i % 2} 12:00:{i:02d}', 'is_correct': 1}
+        for i in range(30)
+    ] + [{'passback_params': passback, 'attempt_type': 'run', 'created_at': '2023-05-10', 'is_correct': 0}]
+    log = RejectLog(quarantine_dir='', flush_size=7, quarantine_db=True)
+    log.attach_window('client', '2023-05-10', '2023-05-12')
+    monkeypatch.setattr(main, 'REJECTS', log)
+    assert insert_attempts(main.process_data(records)) == 10
+    log.flush()
+    assert log.quarantined_db == 21
+    assert {reason: count for reason, (count, _, _) in quarantine_stats().items()} == \
+        {'bad_attempt_type': 20, 'missing_fields': 1}
+
+    # Пока правила не исправлены, записи остаются в карантине
+    assert reprocess(batch_size=4) == {'checked': 21, 'moved': 0, 'inserted': 0, 'rejected': 21}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE attempts_quarantine SET payload = jsonb_set(payload, '{attempt_type}', to_jsonb('submit'::text)) "
+                    "WHERE reason = 'bad_attempt_type'")
+        conn.commit()
+        cur.close()
+    assert reprocess(batch_size=4, reasons=['bad_attempt_type']) == \
+        {'checked': 20, 'moved': 20, 'inserted': 20, 'rejected': 0}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FILTER (WHERE attempt_type = 'submit'), count(*) FROM attempts")
+        assert cur.fetchone() == (20, 30)
+        cur.execute("SELECT DISTINCT client FROM attempts WHERE attempt_type = 'submit'")
+        assert cur.fetchall() == [('client',)]
+        cur.execute("SELECT sum(total_attempts) FROM attempts_daily")
+        assert cur.fetchone()[0] == 30
+        cur.execute("SELECT client, reason, record_index, payload->>'attempt_type' FROM attempts_quarantine")
+        assert cur.fetchall() == [('client', 'missing_fields', 30, 'run')]
+        cur.close()
+
+def test_reject_log_flushes_outside_lock_and_before_pool_close(test_db, tmp_path, monkeypatch):
+    """Пока пачка карантина пишется, другие потоки учитывают отказы без ожидания; close_pool сначала сбрасывает карантин"""
+    import threading
+    import psycopg2
+    import db_pool
+    import rejects
+    from config import DB_CONFIG
+    from database import create_table
+
+    log = rejects.RejectLog(quarantine_dir=str(tmp_path), flush_size=2)
+    writing, release = threading.Event(), threading.Event()
+    write_file = log._flush_file
+
+    def slow_write(buffer):
+        writing.set()
+        release.wait(10)
+        write_file(buffer)
+
+    monkeypatch.setattr(log, '_flush_file', slow_write)
+    flusher = threading.Thread(target=lambda: [log.reject(i, 'bad_passback', "описание", {'n': i}) for i in range(2)])
+    flusher.start()
+    assert writing.wait(10)
+    other = threading.Thread(target=log.reject, args=(2, 'error', "описание", {'n': 2}))
+    other.start()
+    other.join(2)
+    assert not other.is_alive() and log.counts == {'bad_passback': 2, 'error': 1}
+    release.set()
+    flusher.join(10)
+    log.flush()
+    assert log.quarantined == 3
+
+    create_table()
+    log = rejects.RejectLog(quarantine_dir='', flush_size=100, quarantine_db=True)
+    log.attach_window('client', '2023-05-10', '2023-05-11')
+    log.reject(0, 'missing_fields', "описание", {'n': 0})
+    monkeypatch.setattr(rejects, 'REJECTS', log)
+    db_pool.close_pool()
+    assert db_pool._pool is None and log.quarantined_db == 1
+    conn = psycopg2.connect(options='-c search_path=flowtrack_test', **DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("SELECT client, reason FROM attempts_quarantine")
+    assert cur.fetchall() == [('client', 'missing_fields')]
+    conn.close()
+
+def test_compact_records_load_and_metrics(test_db):
+    """process_data(compact=True) отдаёт пачку по столбцам: в разы меньше памяти, те же записи, загрузка и метрики;
+    по умолчанию — список словарей, как раньше"""
+    import tracemalloc
+    import pandas as pd
+    from analytics import query_metrics, records_metrics
+    from database import ATTEMPT_COLUMNS, create_table, insert_attempts
+    from main import process_data
+    from records import ATTEMPT_FIELDS, Attempt, as_dicts
+    from synthetic import generate_records
+
+    assert ATTEMPT_FIELDS == ATTEMPT_COLUMNS
+    raw = list(generate_records(3000, spread_hours=60, invalid_ratio=0.05))
+    tracemalloc.start()
+    try:
+        dicts = process_data(raw)
+        dicts_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        batch = process_data(raw, compact=True)
+        batch_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert batch_bytes * 3 < dicts_bytes
+    assert type(dicts) is list and type(dicts[0]) is dict
+    assert len(batch) == len(dicts) and as_dicts(batch) == dicts and as_dicts(batch[10:20]) == dicts[10:20]
+    assert batch[5] == Attempt(**dicts[5]) and batch[5]['created_at'] == batch[5].created_at == dicts[5]['created_at']
+    assert dict(batch[-1]) == dicts[-1] and len(batch.table) < 5 * len(batch)
+
+    create_table()
+    assert insert_attempts(batch[:2000], batch_size=500) + insert_attempts(batch[1500:], method='values') \
+        == len({(r['user_id'], r['lis_result_sourcedid'], r['attempt_type'], r['created_at']) for r in dicts})
+    for group_by in ((), ('day', 'attempt_type'), ('week', 'oauth_consumer_key')):
+        expected = query_metrics('2023-05-31 06:00', '2023-06-02 12:00', group_by, source='attempts')
+        pd.testing.assert_frame_equal(records_metrics(batch, '2023-05-31 06:00', '2023-06-02 12:00', group_by),
+                                      expected, check_dtype=False)
+        pd.testing.assert_frame_equal(records_metrics(dicts, '2023-05-31 06:00', '2023-06-02 12:00', group_by),
+                                      expected, check_dtype=False)
+
+def test_scheduler_isolates_clients(test_db, tmp_path):
+    """Планировщик грузит клиентов общим пулом: строки помечены клиентом, падение одного не мешает остальным"""
+    import json
+    import threading
+    import time
+    from database import create_table, get_watermark
+    from db_pool import get_connection
+    from scheduler import FairWriteGate, Scheduler, load_clients
+    from synthetic import generate_records
+
+    # Запись в БД: одно место, очередь обслуживается по кругу между клиентами
+    gate = FairWriteGate(1)
+    gate.acquire('x')
+    granted = []
+
+    def writer(client):
+        with gate.slot(client):
+            granted.append(client)
+
+    threads = []
+    for client in ('x', 'x', 'x', 'y'):
+        threads.append(threading.Thread(target=writer, args=(client,)))
+        threads[-1].start()
+        time.sleep(0.05)
+    gate.release()
+    for thread in threads:
+        thread.join()
+    assert granted == ['x', 'y', 'x', 'x']
+
+    recent = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d 00:00:00.000000')
+    path = tmp_path / 'clients.json'
+    path.write_text(json.dumps([
+        {'name': 'a', 'key': 'ka', 'start': recent, 'incremental': True},
+        {'name': 'b', 'key': 'kb', 'start': '2023-05-01 00:00:00.000000', 'end': '2023-05-03 23:59:59.999999',
+         'incremental': False, 'concurrency': 1},
+        {'name': 'c', 'key': 'kc', 'start': recent, 'incremental': True},
+    ]))
+    clients = load_clients(str(path))
+    assert [client['concurrency'] for client in clients] == [2, 1, 2] and clients[0]['url'] is None
+    with pytest.raises(ValueError):
+        path.write_text(json.dumps([{'name': 'a', 'key': 'k'}, {'name': 'a', 'key': 'k'}]))
+        load_clients(str(path))
+
+    def fetch(start, end, client, client_key, url):
+        if client == 'c':
+            raise ConnectionError("API недоступен")
+        if client == 'b':
+            time.sleep(0.05)
+        yield from generate_records(200, start=start, spread_hours=1, seed=hash((client, start)))
+
+    create_table()
+    report = Scheduler(clients, workers=4, db_writers=1, retries=1, batch_size=64, fetch=fetch).run()
+    assert {name: summary['status'] for name, summary in report.items()} == {'a': 'ok', 'b': 'ok', 'c': 'failed'}
+    assert report['b']['done'] == report['b']['windows'] == 3 and report['c']['done'] == 0
+    assert report['a']['loaded'] == 200 * report['a']['windows'] and report['b']['loaded'] == 600
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT client, count(*) FROM attempts GROUP BY client ORDER BY client")
+        assert cur.fetchall() == [('a', report['a']['loaded']), ('b', 600)]
+        cur.execute("SELECT sum(total_attempts) FROM attempts_daily")
+        assert cur.fetchone()[0] == report['a']['loaded'] + 600
+        cur.close()
+    assert get_watermark('a') is not None and get_watermark('c') is None
+
+def test_server_cursor_reads_and_csv_report(test_db, tmp_path):
+    """Отчёты и выгрузка читаются серверным курсором пачками: те же строки, что и одним запросом"""
+    import pandas as pd
+    from analytics import iter_metrics, query_metrics, records_metrics
+    from database import create_table, insert_attempts
+    from db_pool import get_connection
+    from db_reader import iter_arrow_batches, iter_batches, iter_rows
+    from export import export_csv
+    from main import process_data
+    from synthetic import generate_records
+
+    create_table()
+    batch = process_data(generate_records(2000, spread_hours=50, users=300), compact=True)
+    insert_attempts(batch)
+
+    query = "SELECT user_id, created_at FROM attempts ORDER BY created_at"
+    assert [len(rows) for rows in iter_batches(query, itersize=600)] == [600, 600, 600, 200]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query)
+        assert list(iter_rows(query, itersize=333)) == cur.fetchall()
+        cur.close()
+    arrow = list(iter_arrow_batches("SELECT user_id, is_correct, created_at, created_at::date AS day FROM attempts",
+                                    itersize=700))
+    assert [b.num_rows for b in arrow] == [700, 700, 600] and len({b.schema for b in arrow}) == 1
+    assert str(arrow[0].schema.field('day').type) == 'date32[day]'
+
+    # Отчёт по пользователям частями совпадает с отчётом целиком и с расчётом в памяти
+    parts = list(iter_metrics('2023-05-31', '2023-06-02', ('user_id', 'day'), itersize=100))
+    report = query_metrics('2023-05-31', '2023-06-02', ('user_id', 'day'))
+    assert len(parts) > 1 and all(len(part) <= 100 for part in parts)
+    pd.testing.assert_frame_equal(pd.concat(parts, ignore_index=True), report)
+    pd.testing.assert_frame_equal(records_metrics(batch, '2023-05-31', '2023-06-02', ('user_id', 'day')), report,
+                                  check_dtype=False)
+
+    path = str(tmp_path / 'users.csv')
+    assert export_csv(path, '2023-05-31', '2023-06-02', ('user_id', 'day'), batch_size=100) == len(report)
+    csv = pd.read_csv(path)
+    assert list(csv.columns) == list(report.columns) and csv['total_attempts'].sum() == report['total_attempts'].sum()
+    assert export_csv(path, batch_size=500) == 2000 and len(pd.read_csv(path)) == 2000
+    assert export_csv(path, '2030-01-01') == 0 and len(pd.read_csv(path)) == 0 and not (tmp_path / 'users.csv.tmp').exists()
+
+def test_user_progress_incremental_refresh(test_db):
+    """user_progress обновляется по затронутым парам при каждой загрузке и совпадает с расчётом по attempts"""
+    import pandas as pd
+    from analytics import assignment_progress, query_progress
+    from database import create_table, insert_attempts, insert_data
+    from main import process_data
+    from progress import rebuild_progress
+    from records import as_dicts
+    from synthetic import generate_records
+
+    def expected_progress(rows):
+        df = pd.DataFrame(rows).drop_duplicates(['user_id', 'lis_result_sourcedid', 'attempt_type', 'created_at'])
+        df['created_at'] = pd.to_datetime(df['created_at'])
+        result = {}
+        for (user_id, sourcedid), group in df.sort_values('created_at').groupby(['user_id', 'lis_result_sourcedid']):
+            correct = group[(group['attempt_type'] == 'submit') & (group['is_correct'] == True)]  # noqa: E712
+            first_correct = correct['created_at'].min() if len(correct) else None
+            result[(user_id, sourcedid)] = (
+                len(group), int((group['attempt_type'] == 'run').sum()), int((group['attempt_type'] == 'submit').sum()),
+                len(correct), first_correct,
+                int((group['created_at'] <= first_correct).sum()) if first_correct is not None else None,
+            )
+        return result
+
+    def actual_progress():
+        df = query_progress()
+        return {(row.user_id, row.lis_result_sourcedid): (
+            row.total_attempts, row.runs, row.submits, row.correct_submits,
+            None if pd.isna(row.first_correct_at) else row.first_correct_at,
+            None if pd.isna(row.attempts_to_first_correct) else int(row.attempts_to_first_correct),
+        ) for row in df.itertuples()}
+
+    create_table()
+    first = list(generate_records(1500, spread_hours=30, users=40, assignments=5))
+    second = list(generate_records(1500, start='2023-06-01 06:00:00', spread_hours=30, users=40, assignments=5))
+    insert_data(as_dicts(process_data(first)))
+    assert actual_progress() == expected_progress(as_dicts(process_data(first)))
+    # Вторая загрузка (пачками по столбцам) пересчитывает только затронутые пары; повторные записи не считаются
+    insert_attempts(process_data(second + first[:100]), batch_size=400)
+    progress = actual_progress()
+    assert progress == expected_progress(as_dicts(process_data(first + second)))
+    rebuild_progress()
+    assert actual_progress() == progress
+
+    df = query_progress(solved=True)
+    assert len(df) == sum(1 for value in progress.values() if value[4] is not None)
+    assert (df['success_rate'] == df['correct_submits'] / df['submits']).all()
+    assert (df['run_submit_ratio'] == df['runs'] / df['submits']).all()
+    sourcedid = df['lis_result_sourcedid'].iloc[0]
+    summary = assignment_progress([sourcedid]).iloc[0]
+    rows = query_progress(sourcedids=[sourcedid])
+    assert summary['users'] == len(rows) and summary['total_attempts'] == rows['total_attempts'].sum()
+    assert summary['avg_attempts_to_first_correct'] == pytest.approx(rows['attempts_to_first_correct'].mean())
+
+def test_flowtrack_cli_imports_lazily(monkeypatch, tmp_path):
+    """flowtrack.py импортирует скрипт команды только при запуске; ingest не тянет pandas и pyarrow"""
+    import subprocess
+    import sys
+    import email_sender
+    import flowtrack
+    from benchmarks import parse_importtime
+
+    code = ("import sys, flowtrack; flowtrack.parse_args(['ingest', '--incremental']); before = set(sys.modules); "
+            "import main; print(sorted({'config', 'pandas', 'pyarrow', 'numpy'} & before), "
+            "sorted({'pandas', 'pyarrow', 'numpy', 'analytics'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            check=True, capture_output=True, text=True).stdout
+    assert output.strip() == "[] []"
+
+    sent = []
+    monkeypatch.setattr(email_sender, 'send_email_report', lambda **kwargs: sent.append(kwargs) or True)
+    assert flowtrack.main(['email', '--failed', '--file', 'report.csv']) == 0
+    assert sent == [{'success': False, 'local_file_path': 'report.csv'}]
+
+    entries = parse_importtime("import time: self [us] | cumulative | imported package\n"
+                               "import time:       120 |        120 |     json.decoder\n"
+                               "import time:       300 |        420 |   json\n"
+                               "import time:        80 |        500 | flowtrack\n")
+    assert entries == [('json.decoder', 2, 120, 120), ('json', 1, 300, 420), ('flowtrack', 0, 80, 500)]
+
+    # Код выхода benchmarks.main: 0 без регрессий, 1 — при регрессии относительно baseline
+    import json
+    import benchmarks
+    output = os.path.join(str(tmp_path), 'imports.json')
+    assert benchmarks.main(['--output', output, 'imports', '--commands', 'cli', '--repeat', '1']) == 0
+    with open(output, encoding='utf-8') as f:
+        run = json.load(f)
+    run['results'][0]['import_ms'] /= 100
+    baseline = os.path.join(str(tmp_path), 'baseline.json')
+    with open(baseline, 'w', encoding='utf-8') as f:
+        json.dump(run, f)
+    assert benchmarks.main(['--output', output, '--baseline', baseline, 'imports', '--commands', 'cli',
+                            '--repeat', '1']) == 1
+
+def test_ingest_empty_fetch_is_success(test_db, monkeypatch):
+    """Пустой ответ API — успешный запуск без новых строк; ошибка запроса — неуспешный, watermark не двигается"""
+    import requests
+    import main
+    from mock_api import MockStatisticsAPI
+    from rejects import RejectLog
+
+    start = (datetime.now() - timedelta(hours=2)).strftime(main.API_DATETIME_FORMAT)
+    monkeypatch.setattr(main, 'START_PARSE', start)
+    monkeypatch.setattr(main, 'FETCH_MODE', 'windowed')
+    monkeypatch.setattr(main, 'open_cache', lambda: None)
+    monkeypatch.setattr(main, 'REJECTS', RejectLog(quarantine_dir='', quarantine_db=False))
+    args = main.parse_args(['--incremental'])
+    with MockStatisticsAPI([]) as api:
+        monkeypatch.setattr(main, 'API_URL', api.url)
+        assert main.run(args) is True
+        assert api.stats['requests'] > 0 and main.get_watermark(main.CLIENT) is None
+    with MockStatisticsAPI([], fail_every=1, fail_status=400) as api:
+        monkeypatch.setattr(main, 'API_URL', api.url)
+        assert main.run(args) is False
+        with pytest.raises(requests.HTTPError):
+            main.fetch_data_from_api(start, start)
+
+def test_parallel_processing_matches_sequential(monkeypatch):
+    """iter_processed_parallel отдаёт те же записи в том же порядке, что iter_processed, с теми же отказами"""
+    import main
+    from synthetic import generate_records
+
+    class Rejects:
+        def __init__(self):
+            self.calls = []
+
+        def reject(self, i, reason, detail, record):
+            self.calls.append((i, reason, detail, record))
+
+    raw = list(generate_records(1000, invalid_ratio=0.2))
+    sequential, parallel = Rejects(), Rejects()
+    monkeypatch.setattr(main, 'REJECTS', sequential)
+    expected_stats = {}
+    expected = list(main.iter_processed(raw, expected_stats))
+    monkeypatch.setattr(main, 'REJECTS', parallel)
+    stats = {}
+    # Генератор на входе и кусок меньше входа: 1000 записей режутся на 28 кусков
+    assert list(main.iter_processed_parallel(iter(raw), stats, workers=2, chunk_size=37)) == expected
+    assert stats == expected_stats and stats['total'] == 1000 and sum(stats['rejected'].values()) > 100
+    assert parallel.calls == sequential.calls
+    assert all(raw[i] is record for i, _, _, record in parallel.calls)
+
+def test_windowed_fetch_splits_and_retries_windows(monkeypatch):
+    """Тяжёлое окно дробится пополам (много записей или таймаут), упавшее окно повторяется; записи полные и по порядку"""
+    import requests
+    import main
+    from mock_api import MockStatisticsAPI
+    from synthetic import generate_records
+
+    start, end = '2023-05-31 00:00:00.000000', '2023-05-31 23:59:59.999999'
+    assert main.halve_window(start, '2023-05-31 00:01:59.000000', min_seconds=60) is None
+    assert main.halve_window(start, '2023-05-31 00:02:00.000000', min_seconds=60) == \
+        [(start, '2023-05-31 00:01:00.000000'), ('2023-05-31 00:01:00.000001', '2023-05-31 00:02:00.000000')]
+
+    request_window = main.request_window
+    calls = []
+
+    def flaky(session, window_start, window_end, timeout=60):
+        """Первый запрос окна failing[0] падает с исключением failing[1]"""
+        calls.append((window_start, window_end))
+        if (window_start, window_end) == failing[0] and calls.count(failing[0]) == 1:
+            raise failing[1]
+        return request_window(session, window_start, window_end, timeout)
+
+    monkeypatch.setattr(main, 'request_window', flaky)
+    with MockStatisticsAPI(generate_records(2000)) as api:
+        monkeypatch.setattr(main, 'API_URL', api.url)
+        expected = api.window(start, end)
+        session = main.get_session_with_retries(retry_read_timeouts=False)
+
+        # Таймаут на целом дне и ответы по 300+ записей: окно дробится, пока ответы не станут меньше
+        failing = ((start, end), requests.Timeout("таймаут"))
+        data = main.fetch_window_adaptive(session, start, end, timeout=5, max_rows=300, min_window=60)
+        assert data == expected and len(data) == 2000
+        assert calls[0] == (start, end) and len(calls) > 8 and len(set(calls)) == len(calls)
+
+        # Окно, упавшее в параллельном проходе, загружается повторно по одному
+        calls.clear()
+        windows = main.split_time_range(start, end, 'hour')
+        failing = (windows[5], requests.ConnectionError("сбой соединения"))
+        data = main.fetch_data_windowed(start, end, window='hour', workers=4)
+        assert data == expected
+        assert len(calls) == len(windows) + 1 and calls.count(windows[5]) == 2
+        assert [record['created_at'] for record in data] == sorted(record['created_at'] for record in data)
+        session.close()
+
+def test_plain_attempts_migrated_to_partitions(test_db):
+    """Обычная attempts прошлых версий переводится в секционированную на месте; строки из attempts_default
+    переносятся в новую секцию месяца"""
+    from database import create_table, prepare_partitions
+    from db_pool import get_connection
+    from schema import attempts_kind
+
+    rows = [
+        (f'u{i % 4}', 'key', f's{i % 3}', 'url', i % 2 == 0, 'submit' if i % 2 else 'run',
+         f'2023-0{5 + i % 2}-{10 + i % 5} 12:00:00')
+        for i in range(20)
+    ]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE attempts (
+                id SERIAL PRIMARY KEY, user_id VARCHAR(100), oauth_consumer_key TEXT, lis_result_sourcedid TEXT,
+                lis_outcome_service_url TEXT, is_correct BOOLEAN, attempt_type VARCHAR(10), created_at TIMESTAMP
+            )
+        ''')
+        # Дубли по ключу дедупликации: первые пять строк ещё раз
+        cur.executemany("INSERT INTO attempts (user_id, oauth_consumer_key, lis_result_sourcedid, "
+                        "lis_outcome_service_url, is_correct, attempt_type, created_at) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s)", rows + rows[:5])
+        cur.execute("SELECT count(DISTINCT (user_id, lis_result_sourcedid, attempt_type, created_at)), max(id) "
+                    "FROM attempts")
+        unique, last_id = cur.fetchone()
+        conn.commit()
+        cur.close()
+    assert unique == 20 and last_id == 25
+
+    create_table()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        assert attempts_kind(cur) == 'partitioned'
+        cur.execute("SELECT to_regclass('attempts_legacy')")
+        assert cur.fetchone()[0] is None
+        cur.execute("SELECT count(*), count(DISTINCT (user_id, lis_result_sourcedid, attempt_type, created_at)), "
+                    "count(*) FILTER (WHERE tableoid = 'attempts_2023_05'::regclass) FROM attempts")
+        assert cur.fetchone() == (20, 20, 10)
+        cur.execute("INSERT INTO attempts (user_id, attempt_type, created_at) "
+                    "VALUES ('new', 'run', '2023-05-20'), ('old', 'run', '2021-01-15') RETURNING id")
+        assert min(row[0] for row in cur.fetchall()) > last_id
+        cur.execute("SELECT count(*) FROM attempts_default")
+        assert cur.fetchone()[0] == 1
+        conn.commit()
+
+        # Секция месяца создаётся, и строка из attempts_default переносится в неё
+        prepare_partitions('2021-01-01', '2021-01-31')
+        cur.execute("SELECT tableoid::regclass::text, user_id FROM attempts WHERE created_at < '2022-01-01'")
+        assert cur.fetchall() == [('attempts_2021_01', 'old')]
+        cur.execute("SELECT count(*) FROM attempts_default")
+        assert cur.fetchone()[0] == 0
+        cur.close()
+
+def test_iter_json_array():
+    """Потоковый разбор JSON-массива не зависит от того, как ответ порезан на куски"""
+    import json
+    from main import iter_json_array
+
+    data = [{'lti_user_id': 'пользователь', 'is_correct': None}, {'a': [1, 2.5, True]}, 12345]
+    raw = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    for size in (1, 3, 7, len(raw)):
+        chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+        assert list(iter_json_array(chunks)) == data
+
+def test_parse_passback_params():
+    """Быстрый разбор passback_params совпадает с ast.literal_eval, включая запасной путь"""
+    import ast
+    from passback import PASSBACK_FIELDS, parse_passback_params
+
+    samples = [
+        "{'oauth_consumer_key': '', 'lis_result_sourcedid': 'course-v1:SF+1:abc', 'lis_outcome_service_url': 'https://lms/x'}",
+        "{'oauth_consumer_key': None, 'lis_result_sourcedid': \"it's\", 'lis_outcome_service_url': 'https://lms/y'}",
+        "{'lis_result_sourcedid': 'only\\\\slash'}",
+        # Не в формате repr: быстрый путь не подходит, но результат тот же
+        "{'lis_result_sourcedid':'compact', 'oauth_consumer_key': 1e3}",
+        # Апостроф внутри значения: склейка строк питона, которой нет в JSON
+        "{'lis_result_sourcedid': 'it''s', 'oauth_consumer_key': 'a'', ''b'}",
+    ]
+    for raw in samples:
+        expected = ast.literal_eval(raw)
+        assert parse_passback_params(raw) == {field: expected.get(field) for field in PASSBACK_FIELDS}
+    # Литералы JSON и апостроф, разрывающий строку: literal_eval их не примет — быстрый путь тоже
+    for raw in ("{'lis_result_sourcedid': true}", "{'lis_result_sourcedid': null}",
+                "{'oauth_consumer_key': false, 'lis_result_sourcedid': 's'}", "{'lis_result_sourcedid': 'it's'}"):
+        with pytest.raises((ValueError, SyntaxError)):
+            ast.literal_eval(raw)
+        assert parse_passback_params(raw) is None
+    assert parse_passback_params("{'broken': ") is None
+    assert parse_passback_params(None) is None
+
+def test_sheets_sync_sends_only_changes(tmp_path):
+    """Выгрузка в фейковый Sheets: первая — целиком, повторная — только изменённые ячейки; 429 повторяется"""
+    import requests
+    from fake_sheets import FakeSheetsServer
+    from sheets_sync import SheetsSync, mount_retries
+
+    rows = [['Метрика', 'Значение']] + [[f'm{i}', i] for i in range(10)]
+    with FakeSheetsServer() as fake:
+        sync = SheetsSync('sheet-id', mount_retries(requests.Session(), backoff_factor=0), base_url=fake.url,
+                          snapshot_dir=str(tmp_path), max_cells=8)
+        fake.throttle = 1
+        first = sync.sync({'Лист1': rows})
+        assert fake.grid('Лист1') == rows
+        assert first['cells'] == 22 and first['requests'] == 1 + 3  # очистка + 3 части по ≤ 8 ячеек
+
+        changed = [row[:] for row in rows[:-1]]  # последняя строка удалена
+        changed[3][1] = 100
+        second = sync.sync({'Лист1': changed, 'По дням': [['day'], ['2023-05-31']]})
+        assert fake.grid('Лист1') == changed and fake.grid('По дням') == [['day'], ['2023-05-31']]
+        assert second['ranges'] == 3 and second['cells'] == 1 + 2 + 2
+
 def main():
     logging.info("=== Запуск скрипта сбора данных ===")
 
@@ -0,0 +1,231 @@
+"""
+Метрики запуска: счётчики, гистограммы и таймеры стадий.
+
+Метрики копятся в памяти процесса (потокобезопасно) и в конце запуска записываются
+функцией write_run_summary:
+    - сводка запуска в JSON: METRICS_DIR/<скрипт>-<дата>.json (METRICS_DIR пустой — не писать);
+    - файл METRICS_TEXTFILE_DIR/flowtrack_<скрипт>.prom в формате Prometheus для textfile
+      collector node_exporter (пустой METRICS_TEXTFILE_DIR — не писать). Файл перезаписывается атомарно.
+
+Имена метрик — snake_case, время в секундах, объём в байтах. Метка задаётся именованным
+аргументом: inc('rejected_records', reason='bad_passback').
+
+    with timer('fetch_window_seconds'):
+        ...
+
+    @timed('process')
+    def process_data(...):
+        ...
+"""
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import METRICS_DIR, METRICS_TEXTFILE_DIR
+
+# Границы корзин гистограмм (секунды; для остальных величин — те же числа)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PREFIX = 'flowtrack_'
+
+
+class Histogram:
+    """Число наблюдений, сумма, минимум, максимум и накопительные корзины BUCKETS"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def as_dict(self):
+        if not self.count:
+            return {'count': 0, 'sum': 0}
+        return {'count': self.count, 'sum': round(self.sum, 6), 'mean': round(self.sum / self.count, 6),
+                'min': round(self.min, 6), 'max': round(self.max, 6)}
+
+
+class Registry:
+    """Хранилище метрик процесса: ключ — (имя, метки)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """Копия счётчиков и гистограмм: ({ключ: значение}, {ключ: словарь гистограммы})"""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: (histogram.as_dict(), list(histogram.buckets))
+                          for key, histogram in self.histograms.items()}
+        return counters, histograms
+
+
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    """Увеличивает счётчик name на value"""
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Добавляет наблюдение в гистограмму name"""
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Замеряет время блока в гистограмму name (секунды), в том числе если блок упал"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(stage):
+    """Декоратор: время вызова функции идёт в гистограмму stage_seconds{stage=...},
+    вызовы с исключением дополнительно считаются в stage_errors{stage=...}"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer('stage_seconds', stage=stage):
+                try:
+                    return function(*args, **kwargs)
+                except Exception:
+                    REGISTRY.inc('stage_errors', stage=stage)
+                    raise
+        return wrapper
+    return decorator
+
+
+def _metric_name(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f"{key}={value}" for key, value in labels) + '}'
+
+
+def run_summary(script, status='ok'):
+    """Сводка запуска: счётчики, гистограммы и скорость стадий (строк в секунду)
+        - скорость считается для пар «счётчик <x>_rows и гистограмма <x>_seconds» с одинаковыми метками
+    """
+    counters, histograms = REGISTRY.snapshot()
+    finished = time.time()
+    throughput = {}
+    for (name, labels), value in counters.items():
+        if name.endswith('_rows'):
+            seconds = histograms.get((name[:-len('_rows')] + '_seconds', labels))
+            if seconds and seconds[0]['sum'] > 0:
+                throughput[_metric_name(name[:-len('_rows')] + '_rows_per_second', labels)] = \
+                    round(value / seconds[0]['sum'], 1)
+    return {
+        'script': script,
+        'status': status,
+        'started_at': datetime.fromtimestamp(REGISTRY.started).isoformat(timespec='seconds'),
+        'finished_at': datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+        'seconds': round(finished - REGISTRY.started, 3),
+        'counters': {_metric_name(name, labels): value for (name, labels), value in sorted(counters.items())},
+        'histograms': {_metric_name(name, labels): summary
+                       for (name, labels), (summary, _) in sorted(histograms.items())},
+        'throughput': throughput,
+    }
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def prometheus_text(script, status='ok'):
+    """Метрики запуска в текстовом формате Prometheus (счётчики — *_total, гистограммы — *_bucket/_sum/_count)"""
+    counters, histograms = REGISTRY.snapshot()
+    run = (('script', script),)
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}_total{_prometheus_labels(run + labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric, labels), (summary, buckets) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(BUCKETS, buckets):
+                lines.append(f"{PREFIX}{name}_bucket{_prometheus_labels(run + labels + (('le', bound),))} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_prometheus_labels(run + labels + (('le', '+Inf'),))} "
+                         f"{summary['count']}")
+            lines.append(f"{PREFIX}{name}_sum{_prometheus_labels(run + labels)} {summary['sum']}")
+            lines.append(f"{PREFIX}{name}_count{_prometheus_labels(run + labels)} {summary['count']}")
+    lines.append(f"# TYPE {PREFIX}last_run_timestamp_seconds gauge")
+    lines.append(f"{PREFIX}last_run_timestamp_seconds{_prometheus_labels(run)} {int(time.time())}")
+    lines.append(f"# TYPE {PREFIX}last_run_success gauge")
+    lines.append(f"{PREFIX}last_run_success{_prometheus_labels(run)} {int(status == 'ok')}")
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_summary(script, status='ok', directory=METRICS_DIR, textfile_dir=METRICS_TEXTFILE_DIR):
+    """Записывает сводку запуска в JSON и (если задан textfile_dir) метрики для node_exporter
+        - status — ok или error; в Prometheus он попадает как flowtrack_last_run_success
+        - ошибка записи только логируется: метрики не должны ронять запуск
+        - возвращает сводку (см. run_summary)
+    """
+    summary = run_summary(script, status)
+    stages = ', '.join(f"{name[len('stage_seconds{stage='):-1]} {value['sum']:.2f} с"
+                       for name, value in summary['histograms'].items() if name.startswith('stage_seconds{'))
+    logging.info(f"Метрики запуска {script} ({status}): {summary['seconds']:.1f} с; стадии: {stages or '—'}; "
+                 f"скорость: {summary['throughput'] or '—'}")
+    try:
+        if directory:
+            path = os.path.join(directory, f"{script}-{datetime.now():%Y%m%d-%H%M%S}.json")
+            _write_atomic(path, json.dumps(summary, ensure_ascii=False, indent=1))
+        if textfile_dir:
+            _write_atomic(os.path.join(textfile_dir, f"flowtrack_{script}.prom"), prometheus_text(script, status))
+    except OSError as e:
+        logging.error(f"Не удалось записать метрики запуска: {e}")
+    return summary
@@ -0,0 +1,120 @@
+"""
+Локальный mock API статистики для тестов и бенчмарков клиентов без реального API.
+
+Отдаёт синтетические записи (synthetic.generate_records), отфильтрованные по start/end,
+как настоящий API. Умеет имитировать задержку ответа и сбои: каждый fail_every-й
+запрос получает ответ fail_status (по умолчанию 503). Считает запросы и максимальное
+число одновременных запросов.
+
+Запуск отдельно (затем API_URL=http://127.0.0.1:8766/):
+    python mock_api.py --records 100000 --port 8766
+"""
+import argparse
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic import generate_records
+
+
+class MockStatisticsAPI:
+    """Mock-сервер в фоновом потоке; используется как контекстный менеджер
+        - records — записи API, упорядоченные по created_at
+        - latency — задержка каждого ответа, секунды
+        - fail_every, fail_status — каждый fail_every-й запрос получает fail_status (0 — без сбоев)
+        - stats — requests, failures, max_concurrent
+    """
+
+    def __init__(self, records, host='127.0.0.1', port=0, latency=0.0, fail_every=0, fail_status=503):
+        self.records = sorted(records, key=lambda record: record['created_at'])
+        self._keys = [record['created_at'] for record in self.records]
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.stats = {'requests': 0, 'failures': 0, 'max_concurrent': 0}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def window(self, start, end):
+        """Записи с created_at в [start, end] (строки в формате API)"""
+        return self.records[bisect_left(self._keys, start):bisect_right(self._keys, end)]
+
+    def _respond(self, query):
+        with self._lock:
+            self.stats['requests'] += 1
+            number = self.stats['requests']
+            self._active += 1
+            self.stats['max_concurrent'] = max(self.stats['max_concurrent'], self._active)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if self.fail_every and number % self.fail_every == 0:
+                with self._lock:
+                    self.stats['failures'] += 1
+                return self.fail_status, b'{"error": "temporary failure"}'
+            params = parse_qs(query)
+            data = self.window(params['start'][0], params['end'][0])
+            return 200, json.dumps(data).encode('utf-8')
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def do_GET(self):
+                status, body = server._respond(urlparse(self.path).query)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock API статистики на синтетических данных")
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--start', default="2023-05-31 00:00:00.000000", help="created_at первой записи")
+    parser.add_argument('--hours', type=int, default=24, help="на сколько часов растянуть записи")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-every', type=int, default=0)
+    args = parser.parse_args()
+    api = MockStatisticsAPI(generate_records(args.records, args.start, args.hours), port=args.port,
+                            latency=args.latency, fail_every=args.fail_every)
+    print(f"API_URL={api.url}")
+    api._httpd.serve_forever()
@@ -0,0 +1,81 @@
+"""
+Быстрый разбор passback_params.
+
+API отдаёт passback_params как repr питоновского словаря:
+    "{'oauth_consumer_key': '', 'lis_result_sourcedid': '...', 'lis_outcome_service_url': '...'}"
+У одного пользователя строка повторяется тысячи раз, поэтому перед разбором стоит LRU-кэш
+по исходной строке. Сам разбор сначала пробует json.loads после замены одинарных кавычек
+на двойные и берёт результат, только если его repr в точности даёт исходную строку;
+иначе (не-repr форматирование, литералы JSON вроде true/null) — ast.literal_eval,
+поэтому результат всегда тот же, что у literal_eval.
+"""
+import ast
+import json
+from functools import lru_cache
+
+from config import PASSBACK_CACHE_SIZE
+
+PASSBACK_FIELDS = ('oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url')
+
+# Счётчики разборов (промахи кэша); попадания в кэш считает lru_cache
+_counters = {'fast_path': 0, 'fallback': 0, 'errors': 0}
+
+
+def _decode(raw_params):
+    """Строка → dict: быстрый путь через json, запасной — через ast.literal_eval"""
+    # Если в строке нет двойных кавычек и экранирования, repr словаря из API после замены ' на "
+    # читается как JSON. Замена может и исказить строку (' внутри значения, true/null, которых
+    # literal_eval не примет), поэтому результат принимается, только если его repr — исходная строка
+    if '"' not in raw_params and '\\' not in raw_params:
+        try:
+            parsed = json.loads(raw_params.replace("'", '"'))
+        except ValueError:
+            parsed = None
+        if type(parsed) is dict and repr(parsed) == raw_params:
+            _counters['fast_path'] += 1
+            return parsed
+    parsed = ast.literal_eval(raw_params)
+    _counters['fallback'] += 1
+    return parsed
+
+
+@lru_cache(maxsize=PASSBACK_CACHE_SIZE)
+def _parse_cached(raw_params):
+    try:
+        parsed = _decode(raw_params)
+        return {field: parsed.get(field) for field in PASSBACK_FIELDS}
+    except Exception:
+        # Не логируем: запись с таким passback_params отклонит и учтёт validate_record (см. rejects.py)
+        _counters['errors'] += 1
+        return None
+
+
+def parse_passback_params(raw_params):
+    """Парсинг passback_params
+        - извлекает oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url
+        - результат кэшируется по исходной строке (LRU на PASSBACK_CACHE_SIZE строк);
+          возвращаемый словарь общий для всех попаданий в кэш — его нельзя изменять
+        - при ошибке возвращает None (ошибки считаются в parse_stats, запись отклоняет validate_record)
+    """
+    if not isinstance(raw_params, str):
+        _counters['errors'] += 1
+        return None
+    return _parse_cached(raw_params)
+
+
+def parse_stats():
+    """Счётчики разбора: попадания/промахи кэша, быстрый путь json, запасной literal_eval, ошибки"""
+    info = _parse_cached.cache_info()
+    return {
+        'cache_hits': info.hits,
+        'cache_misses': info.misses,
+        'cache_size': info.currsize,
+        **_counters,
+    }
+
+
+def reset_parse_stats():
+    """Очищает кэш и обнуляет счётчики"""
+    _parse_cached.cache_clear()
+    for key in _counters:
+        _counters[key] = 0
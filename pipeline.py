@@ -0,0 +1,293 @@
+"""
+Конвейер загрузки без интерактивных вопросов: API → валидация → PostgreSQL → агрегация и выгрузка.
+
+Стадии работают одновременно в отдельных потоках и связаны ограниченными очередями:
+
+    fetch (потоковый запрос к API) → raw → validate (процессы при --workers > 1) → valid → write (COPY в БД)
+
+Пока БД пишет одну пачку, валидируется следующая и скачивается третья, поэтому время прогона
+близко к времени самой медленной стадии, а не к сумме всех. Очередь не даёт быстрой стадии
+уйти вперёд (backpressure): в каждой не больше PIPELINE_QUEUE_SIZE пачек по STREAM_BATCH_SIZE записей.
+Ошибка в любой стадии останавливает остальные; уже закоммиченные пачки остаются в БД.
+После загрузки сдвигается watermark (--incremental) и выполняется агрегация с выгрузкой
+в Google Sheets и email-отчётом (--no-export — пропустить).
+
+Запуск:
+    python pipeline.py [--incremental] [--workers N] [--no-export]
+"""
+import argparse
+import logging
+import queue
+import threading
+import time
+from itertools import chain
+
+from config import CLIENT, START_PARSE, END_PARSE, STREAM_BATCH_SIZE, PIPELINE_QUEUE_SIZE, PROCESS_WORKERS, SYNC_MODE
+from database import create_table, prepare_partitions, insert_attempts, advance_watermark, batched
+from db_pool import check_connection
+from main import setup_logger, fetch_data_stream, incremental_range, _processed, _log_processing_stats
+import metrics
+from rejects import REJECTS
+
+_DONE = object()
+
+
+class Cancelled(Exception):
+    """Конвейер остановлен из-за ошибки в другой стадии"""
+
+
+class PipelineError(Exception):
+    """Одна из стадий конвейера завершилась ошибкой"""
+
+
+def _stage_stats():
+    return {'records': 0, 'seconds': 0.0, 'in_wait': 0.0, 'out_wait': 0.0}
+
+
+class Channel:
+    """Ограниченная очередь пачек между двумя стадиями
+        - put блокируется, пока в очереди maxsize пачек (backpressure)
+        - put и чтение прерываются исключением Cancelled, как только выставлен stop
+        - считает глубину очереди и время ожидания стадий на входе и выходе
+    """
+
+    def __init__(self, name, maxsize, stop):
+        self.name = name
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._stop = stop
+        self.max_depth = 0
+        self._depth_total = 0
+        self._puts = 0
+
+    def _put(self, item):
+        while True:
+            if self._stop.is_set():
+                raise Cancelled()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, batch, stats):
+        started = time.perf_counter()
+        self._put(batch)
+        stats['out_wait'] += time.perf_counter() - started
+        depth = self._queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_total += depth
+        self._puts += 1
+
+    def close(self):
+        """Сообщает читающей стадии, что пачек больше не будет"""
+        self._put(_DONE)
+
+    def batches(self, stats):
+        """Пачки из очереди до close(); время ожидания пишется в stats['in_wait']"""
+        while True:
+            started = time.perf_counter()
+            while True:
+                if self._stop.is_set():
+                    raise Cancelled()
+                try:
+                    batch = self._queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            stats['in_wait'] += time.perf_counter() - started
+            if batch is _DONE:
+                return
+            yield batch
+
+    def records(self, stats):
+        return chain.from_iterable(self.batches(stats))
+
+    def summary(self):
+        average = self._depth_total / self._puts if self._puts else 0
+        return {'max_depth': self.max_depth, 'avg_depth': round(average, 2), 'maxsize': self.maxsize}
+
+
+def _run_stage(name, func, stats, stop, errors):
+    """Поток стадии: при ошибке запоминает её и останавливает весь конвейер"""
+    def run():
+        started = time.perf_counter()
+        try:
+            func()
+        except Cancelled:
+            logging.info(f"Стадия {name} остановлена")
+        except Exception as e:
+            logging.error(f"Ошибка в стадии {name}: {e}")
+            errors.append((name, e))
+            stop.set()
+        finally:
+            stats['seconds'] = time.perf_counter() - started
+
+    thread = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _log_report(report):
+    for name, stats in report['stages'].items():
+        busy = stats['seconds'] - stats['in_wait'] - stats['out_wait']
+        rate = stats['records'] / stats['seconds'] if stats['seconds'] else 0
+        logging.info(f"Стадия {name}: {stats['records']} записей за {stats['seconds']:.2f} с ({rate:.0f} зап/с), "
+                     f"работа {busy:.2f} с, ожидание входа {stats['in_wait']:.2f} с, "
+                     f"выхода {stats['out_wait']:.2f} с")
+        metrics.observe('stage_seconds', stats['seconds'], stage=f"pipeline_{name}")
+        metrics.inc('stage_rows', stats['records'], stage=f"pipeline_{name}")
+    for name, summary in report['queues'].items():
+        logging.info(f"Очередь {name}: макс. глубина {summary['max_depth']}/{summary['maxsize']}, "
+                     f"средняя {summary['avg_depth']}")
+    logging.info(f"Конвейер: {report['seconds']:.2f} с, узкое место — стадия {report['bottleneck']}")
+
+
+def run_pipeline(start, end, workers=1, batch_size=STREAM_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE,
+                 fetch=fetch_data_stream):
+    """Загружает период [start, end] конвейером fetch → validate → write
+        - fetch(start, end) — генератор записей API (по умолчанию потоковый запрос)
+        - workers > 1 — валидация в нескольких процессах
+        - возвращает отчёт: loaded, stages (записи, время работы и ожидания по стадиям),
+          queues (глубина очередей), seconds, bottleneck
+        - при ошибке любой стадии остальные останавливаются и выбрасывается PipelineError
+    """
+    stop = threading.Event()
+    errors = []
+    stages = {name: _stage_stats() for name in ('fetch', 'validate', 'write')}
+    raw = Channel('raw', queue_size, stop)
+    valid = Channel('valid', queue_size, stop)
+    validation = {}
+    result = {'loaded': 0}
+
+    def fetch_stage():
+        for batch in batched(fetch(start, end), batch_size):
+            stages['fetch']['records'] += len(batch)
+            raw.put(batch, stages['fetch'])
+        raw.close()
+
+    def validate_stage():
+        for batch in batched(_processed(raw.records(stages['validate']), validation, workers), batch_size):
+            stages['validate']['records'] += len(batch)
+            valid.put(batch, stages['validate'])
+        valid.close()
+
+    def write_stage():
+        try:
+            result['loaded'] = insert_attempts(valid.records(stages['write']), batch_size=batch_size, client=CLIENT)
+        except Exception as e:
+            result['loaded'] = getattr(e, 'loaded', 0)
+            raise
+        finally:
+            stages['write']['records'] = result['loaded']
+
+    started = time.perf_counter()
+    threads = [
+        _run_stage('fetch', fetch_stage, stages['fetch'], stop, errors),
+        _run_stage('validate', validate_stage, stages['validate'], stop, errors),
+        _run_stage('write', write_stage, stages['write'], stop, errors),
+    ]
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        logging.warning("Прерывание: останавливаем конвейер")
+        stop.set()
+        for thread in threads:
+            thread.join()
+        errors.append(('main', KeyboardInterrupt()))
+
+    report = {
+        'loaded': result['loaded'],
+        'stages': stages,
+        'queues': {'raw': raw.summary(), 'valid': valid.summary()},
+        'seconds': time.perf_counter() - started,
+        'bottleneck': max(stages, key=lambda name: stages[name]['seconds']
+                          - stages[name]['in_wait'] - stages[name]['out_wait']),
+    }
+    if validation:
+        _log_processing_stats(validation, workers)
+    _log_report(report)
+    if errors:
+        name, error = errors[0]
+        raise PipelineError(f"Стадия {name}: {error!r}. Загружено до остановки: {result['loaded']}") from error
+    logging.info(f"Успешно вставлено {result['loaded']} новых записей, "
+                 f"дублей пропущено: {validation.get('valid', 0) - result['loaded']}")
+    return report
+
+
+def export():
+    """Стадия агрегации и выгрузки: метрики → Google Sheets → email-отчёт"""
+    from analytics import aggregate_data
+    from aggregate_to_sheets import export_report
+
+    started = time.perf_counter()
+    metrics_df = aggregate_data()
+    if metrics_df is None or metrics_df.empty:
+        logging.critical("Не удалось агрегировать данные")
+        return False
+    success = export_report(metrics_df)
+    logging.info(f"Стадия export: {time.perf_counter() - started:.2f} с")
+    return success
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Конвейер: API → PostgreSQL → Google Sheets")
+    parser.add_argument('--incremental', action='store_true', default=SYNC_MODE == 'incremental',
+                        help="загрузить только новые данные после watermark (по умолчанию из SYNC_MODE)")
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS,
+                        help="число процессов для валидации записей (по умолчанию из PROCESS_WORKERS)")
+    parser.add_argument('--no-export', action='store_true', help="не выгружать метрики в Google Sheets")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """Конвейер по аргументам командной строки; возвращает код выхода (0 — успех)"""
+    logging.info("=== Запуск конвейера ===")
+
+    try:
+        check_connection()
+    except Exception as e:
+        logging.critical(f"❌ Ошибка подключения к PostgreSQL: {e}")
+        return 1
+    create_table()
+
+    start, end = START_PARSE, END_PARSE
+    if args.incremental:
+        start, end = incremental_range(CLIENT)
+    logging.info(f"Период загрузки: с {start} по {end}")
+
+    try:
+        prepare_partitions(start, end)
+        REJECTS.attach_window(CLIENT, start, end)
+        run_pipeline(start, end, workers=args.workers)
+    except Exception as e:
+        logging.critical(f"❌ Конвейер остановлен: {e}")
+        return 1
+
+    if args.incremental:
+        logging.info(f"Watermark {CLIENT}: {advance_watermark(CLIENT, start, end)}")
+
+    if not args.no_export and not export():
+        logging.critical("=== Конвейер завершён с частичным успехом: выгрузка не удалась ===")
+        return 1
+
+    logging.info("=== Конвейер завершён успешно ===")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    code = 1
+    try:
+        code = run(args)
+    finally:
+        REJECTS.flush()
+        metrics.write_run_summary('pipeline', 'ok' if code == 0 else 'error')
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
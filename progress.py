@@ -0,0 +1,134 @@
+"""
+Прогресс пользователей по заданиям: таблица user_progress.
+
+Одна строка на пару (user_id, lis_result_sourcedid) — пользователь и задание: число попыток,
+run и submit, успешных submit, первая и последняя попытка, первый успешный submit, сколько
+попыток ушло до него (включая его самого) и отношение run к submit. Вопросы вроде «сколько
+попыток до первого верного решения» или «доля успешных submit по заданию» читаются из неё
+по ключу (см. analytics.query_progress, analytics.assignment_progress), без скана attempts.
+
+Строки обновляются только для пар, затронутых загрузкой (см. database.insert_attempts):
+пара пересчитывается по attempts (индекс attempts_natural_key начинается с тех же столбцов)
+и записывается upsert-ом, поэтому повторная загрузка и дубли не искажают счётчики.
+
+Полный пересчёт (например, после ручного DELETE/TRUNCATE attempts):
+    python progress.py --rebuild
+"""
+import argparse
+import logging
+
+from db_pool import get_connection
+
+PROGRESS_COLUMNS = (
+    'total_attempts', 'runs', 'submits', 'correct_submits', 'first_attempt', 'last_attempt',
+    'first_correct_at', 'attempts_to_first_correct',
+)
+
+
+def create_progress_table(cur):
+    """Создаёт user_progress; если она пуста, а в attempts уже есть данные — заполняет её"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_progress (
+            user_id VARCHAR(100) NOT NULL,
+            lis_result_sourcedid TEXT NOT NULL,
+            total_attempts BIGINT NOT NULL,
+            runs BIGINT NOT NULL,
+            submits BIGINT NOT NULL,
+            correct_submits BIGINT NOT NULL,
+            first_attempt TIMESTAMP NOT NULL,
+            last_attempt TIMESTAMP NOT NULL,
+            first_correct_at TIMESTAMP,
+            attempts_to_first_correct BIGINT,
+            run_submit_ratio DOUBLE PRECISION GENERATED ALWAYS AS (runs::double precision / NULLIF(submits, 0)) STORED,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, lis_result_sourcedid)
+        )
+    ''')
+    cur.execute("CREATE INDEX IF NOT EXISTS user_progress_sourcedid_idx ON user_progress (lis_result_sourcedid)")
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM user_progress) AND EXISTS (SELECT 1 FROM attempts)")
+    if cur.fetchone()[0]:
+        logging.info("Таблица user_progress пуста, заполняем по всей истории attempts")
+        _refresh(cur, None)
+
+
+def _refresh(cur, keys):
+    """Пересчитывает строки user_progress для пар keys [(user_id, lis_result_sourcedid)] или все, если keys is None"""
+    if keys is None:
+        cur.execute("TRUNCATE user_progress")
+        source, params = "attempts", ()
+    else:
+        source = '''(
+            SELECT attempts.* FROM attempts
+            JOIN unnest(%s::varchar[], %s::text[]) AS touched (user_id, lis_result_sourcedid)
+                USING (user_id, lis_result_sourcedid)
+        )'''
+        params = ([user_id for user_id, _ in keys], [sourcedid for _, sourcedid in keys])
+
+    cur.execute(f'''
+        INSERT INTO user_progress (user_id, lis_result_sourcedid, {', '.join(PROGRESS_COLUMNS)})
+        SELECT
+            user_id,
+            lis_result_sourcedid,
+            COUNT(*),
+            COUNT(*) FILTER (WHERE attempt_type = 'run'),
+            COUNT(*) FILTER (WHERE attempt_type = 'submit'),
+            COUNT(*) FILTER (WHERE attempt_type = 'submit' AND is_correct),
+            MIN(created_at),
+            MAX(created_at),
+            MIN(first_correct_at),
+            CASE WHEN MIN(first_correct_at) IS NOT NULL
+                 THEN COUNT(*) FILTER (WHERE created_at <= first_correct_at) END
+        FROM (
+            SELECT user_id, lis_result_sourcedid, attempt_type, is_correct, created_at,
+                   MIN(created_at) FILTER (WHERE attempt_type = 'submit' AND is_correct)
+                       OVER (PARTITION BY user_id, lis_result_sourcedid) AS first_correct_at
+            FROM {source} AS touched_attempts
+            WHERE user_id IS NOT NULL AND lis_result_sourcedid IS NOT NULL
+        ) AS progress
+        GROUP BY user_id, lis_result_sourcedid
+        ON CONFLICT (user_id, lis_result_sourcedid) DO UPDATE SET
+            {', '.join(f'{column} = EXCLUDED.{column}' for column in PROGRESS_COLUMNS)},
+            updated_at = now()
+    ''', params)
+
+
+def refresh_progress(keys, cur=None):
+    """Пересчитывает user_progress для затронутых пар одной транзакцией (upsert только этих строк)
+        - keys — итерируемое пар (user_id, lis_result_sourcedid); пары с NULL пропускаются
+        - cur — курсор открытой транзакции: пересчёт идёт в ней, коммит делает вызывающий код
+        - пересчёт идемпотентен: повторный вызов даёт тот же результат
+    """
+    keys = sorted({(user_id, sourcedid) for user_id, sourcedid in keys
+                   if user_id is not None and sourcedid is not None})
+    if not keys:
+        return
+    if cur is not None:
+        _refresh(cur, keys)
+        return
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _refresh(cur, keys)
+        conn.commit()
+        cur.close()
+    logging.info(f"Прогресс пользователей обновлён для {len(keys)} пар пользователь—задание")
+
+
+def rebuild_progress():
+    """Полный пересчёт user_progress по всей истории attempts"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _refresh(cur, None)
+        conn.commit()
+        cur.close()
+    logging.info("Прогресс пользователей пересчитан по всей истории")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Прогресс пользователей по заданиям (user_progress)")
+    parser.add_argument('--rebuild', action='store_true', help="пересчитать user_progress по всей истории")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    if args.rebuild:
+        rebuild_progress()
+    else:
+        parser.print_help()
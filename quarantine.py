@@ -0,0 +1,149 @@
+"""
+Карантин отклонённых записей API: таблица attempts_quarantine.
+
+Записи, которые не прошли validate_record (нет полей, неизвестный attempt_type, битый
+passback_params...), не выбрасываются: исходная запись (payload, JSONB), причина отказа
+и окно загрузки сохраняются в attempts_quarantine тем же путём, что и attempts (COPY пачками).
+Пишет в карантин rejects.py, если включён REJECT_QUARANTINE_DB.
+
+Когда правила разбора исправлены, карантин перепроверяется без повторного запроса к API:
+    python quarantine.py reprocess [--reason bad_passback] [--batch-size 5000]
+Записи, которые теперь проходят проверку, переносятся в attempts: вставка, пересчёт дневных
+агрегатов и user_progress и удаление из карантина идут одной транзакцией на пачку. У остальных обновляются
+причина и описание отказа.
+
+Сколько записей в карантине по причинам:
+    python quarantine.py stats
+"""
+import argparse
+import json
+import logging
+
+from config import QUARANTINE_BATCH_SIZE
+from database import ATTEMPT_COLUMNS, copy_records, load_records
+from db_pool import get_connection
+from progress import refresh_progress
+from rollup import refresh_days
+from schema import ensure_partitions
+
+QUARANTINE_COLUMNS = ('client', 'window_start', 'window_end', 'reason', 'detail', 'record_index', 'payload')
+
+
+def quarantine_records(rows):
+    """Сохраняет отклонённые записи в attempts_quarantine (COPY пачками, как attempts)
+        - rows — словари с ключами QUARANTINE_COLUMNS, payload — исходная запись API
+        - возвращает число сохранённых строк; ошибки пробрасываются (см. load_records)
+    """
+    rows = ({**row, 'payload': json.dumps(row['payload'], ensure_ascii=False, default=str)} for row in rows)
+    return load_records(rows, 'attempts_quarantine', QUARANTINE_COLUMNS, method='copy')
+
+
+def quarantine_stats():
+    """Записи в карантине по причинам: {причина: (число, первый отказ, последний отказ)}"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT reason, count(*), min(rejected_at), max(rejected_at)
+            FROM attempts_quarantine GROUP BY reason ORDER BY reason
+        ''')
+        stats = {reason: (count, first, last) for reason, count, first, last in cur.fetchall()}
+        cur.close()
+    return stats
+
+
+def _reprocess_batch(cur, rows, validate_record):
+    """Перепроверяет пачку [(id, client, payload)] в транзакции вызывающего кода
+        - прошедшие проверку вставляются в attempts (дубли пропускаются) с клиентом из карантина
+          и удаляются из карантина
+        - возвращает (перенесено, новых строк в attempts, осталось в карантине)
+    """
+    passed, passed_ids, still_rejected = [], [], []
+    by_client = {}
+    for quarantine_id, client, payload in rows:
+        record, rejection = validate_record(payload)
+        if rejection:
+            still_rejected.append((*rejection, quarantine_id))
+        else:
+            passed.append(record)
+            passed_ids.append(quarantine_id)
+            by_client.setdefault(client, []).append(record)
+
+    inserted = 0
+    if passed:
+        created = [str(record['created_at']) for record in passed]
+        ensure_partitions(cur, min(created), max(created))
+        # Записи возвращаются со своим клиентом, иначе попадут в watermark каждого (см. advance_watermark)
+        for client, records in by_client.items():
+            inserted += copy_records(cur, 'attempts', ATTEMPT_COLUMNS, records, skip_duplicates=True,
+                                     constants={'client': client} if client else None)
+        refresh_days(created, cur)
+        refresh_progress([(record['user_id'], record['lis_result_sourcedid']) for record in passed], cur)
+        cur.execute("DELETE FROM attempts_quarantine WHERE id = ANY(%s)", (passed_ids,))
+    if still_rejected:
+        # Правила могли измениться: причина отказа обновляется на актуальную
+        cur.executemany("UPDATE attempts_quarantine SET reason = %s, detail = %s WHERE id = %s", still_rejected)
+    return len(passed), inserted, len(still_rejected)
+
+
+def reprocess(batch_size=QUARANTINE_BATCH_SIZE, reasons=None):
+    """Перепроверяет записи карантина текущими правилами validate_record
+        - reasons — только записи с этими причинами отказа (None — все)
+        - пачки по batch_size идут по возрастанию id; каждая — отдельная транзакция,
+          строки пачки блокируются (FOR UPDATE SKIP LOCKED), так что параллельный запуск их пропустит
+        - возвращает {'checked', 'moved', 'inserted', 'rejected'}; inserted меньше moved,
+          если часть записей уже была в attempts
+    """
+    # main тянет за собой клиент API; нужен только здесь
+    from main import validate_record
+
+    result = {'checked': 0, 'moved': 0, 'inserted': 0, 'rejected': 0}
+    condition, params = "", []
+    if reasons:
+        condition, params = "AND reason = ANY(%s)", [list(reasons)]
+    last_id = 0
+    while True:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f'''
+                    SELECT id, client, payload FROM attempts_quarantine
+                    WHERE id > %s {condition}
+                    ORDER BY id LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ''', [last_id, *params, batch_size])
+                rows = cur.fetchall()
+                if rows:
+                    moved, inserted, rejected = _reprocess_batch(cur, rows, validate_record)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        result['checked'] += len(rows)
+        result['moved'] += moved
+        result['inserted'] += inserted
+        result['rejected'] += rejected
+        logging.info(f"Карантин: проверено {result['checked']}, перенесено в attempts {result['moved']}")
+    logging.info(f"Перепроверка карантина завершена: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Карантин отклонённых записей (attempts_quarantine)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('reprocess', help="перепроверить карантин и перенести прошедшие записи в attempts")
+    run.add_argument('--reason', action='append', dest='reasons',
+                     help="только записи с этой причиной отказа (можно повторять)")
+    run.add_argument('--batch-size', type=int, default=QUARANTINE_BATCH_SIZE)
+    subparsers.add_parser('stats', help="число записей в карантине по причинам")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    if args.command == 'reprocess':
+        reprocess(args.batch_size, args.reasons)
+    else:
+        for reason, (count, first, last) in quarantine_stats().items():
+            print(f"{reason:>16} | {count:>9} | {first:%Y-%m-%d %H:%M} — {last:%Y-%m-%d %H:%M}")
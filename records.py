@@ -0,0 +1,182 @@
+"""
+Компактное представление обработанных записей в памяти (process_data).
+
+Словарь на 7 ключей на каждую запись и повторяющиеся строки (user_id, attempt_type,
+oauth_consumer_key, lis_outcome_service_url — одни и те же у тысяч записей) занимают
+основную память при загрузке без потока. AttemptBatch хранит записи по столбцам:
+строковые поля закодированы словарём (StringTable: каждое значение хранится один раз,
+в столбце — его номер в array), is_correct — байт на запись, created_at — как пришёл из API.
+На запись выходит около 30 байт плюс строка created_at вместо ~300 байт словаря.
+
+Загрузчик database.insert_attempts и analytics.records_metrics читают пачку по столбцам
+напрямую; по записи пачка отдаётся как Attempt (__slots__, доступ и по атрибуту, и по ключу),
+прежние словари — адаптером as_dicts.
+"""
+from array import array
+
+# Те же столбцы и порядок, что database.ATTEMPT_COLUMNS
+ATTEMPT_FIELDS = (
+    'user_id', 'oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url',
+    'is_correct', 'attempt_type', 'created_at',
+)
+# Поля, закодированные словарём строк; is_correct — код 1/0/-1 (True/False/None); created_at — список
+ENCODED_FIELDS = ('user_id', 'oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url', 'attempt_type')
+_IS_CORRECT = (False, True, None)
+
+
+class StringTable:
+    """Словарь строк (dictionary encoding): значение → номер, номер → значение"""
+
+    __slots__ = ('values', '_codes')
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        try:
+            code = self._codes.get(value)
+        except TypeError:
+            # Нехэшируемое значение (список из API) хранится отдельно, без общего номера
+            self.values.append(value)
+            return len(self.values) - 1
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Attempt:
+    """Одна обработанная запись: поля ATTEMPT_FIELDS в слотах, без словаря на экземпляр
+        - поле читается как атрибут (record.user_id) и по ключу (record['user_id'])
+        - dict(record) и record.as_dict() дают прежний словарь validate_record
+    """
+
+    __slots__ = ATTEMPT_FIELDS
+
+    def __init__(self, user_id, oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url,
+                 is_correct, attempt_type, created_at):
+        self.user_id = user_id
+        self.oauth_consumer_key = oauth_consumer_key
+        self.lis_result_sourcedid = lis_result_sourcedid
+        self.lis_outcome_service_url = lis_outcome_service_url
+        self.is_correct = is_correct
+        self.attempt_type = attempt_type
+        self.created_at = created_at
+
+    def __getitem__(self, key):
+        if key not in ATTEMPT_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return ATTEMPT_FIELDS
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in ATTEMPT_FIELDS}
+
+    def __eq__(self, other):
+        if not isinstance(other, Attempt):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in ATTEMPT_FIELDS)
+
+    def __repr__(self):
+        return f"Attempt({', '.join(f'{field}={getattr(self, field)!r}' for field in ATTEMPT_FIELDS)})"
+
+
+class AttemptBatch:
+    """Обработанные записи по столбцам со словарным кодированием строк
+        - len, итерация (Attempt), индекс (Attempt) и срез (AttemptBatch с тем же словарём строк)
+        - columns / column_batches — значения по столбцам для COPY, iter_rows — кортежи выбранных полей
+        - словарь строк только пополняется, поэтому срезы и пачка могут делить его
+    """
+
+    __slots__ = ('table', '_columns')
+
+    def __init__(self, table=None, columns=None):
+        self.table = StringTable() if table is None else table
+        self._columns = columns or {
+            **{field: array('I') for field in ENCODED_FIELDS},
+            'is_correct': array('b'),
+            'created_at': [],
+        }
+
+    @classmethod
+    def from_records(cls, records, table=None):
+        """Пачка из словарей validate_record (генератор на входе вычитывается один раз)"""
+        batch = cls(table)
+        batch.extend(records)
+        return batch
+
+    def extend(self, records):
+        encode = self.table.encode
+        columns = self._columns
+        user_id, consumer_key, sourcedid, service_url, attempt_type = (
+            columns[field].append for field in ENCODED_FIELDS)
+        is_correct = columns['is_correct'].append
+        created_at = columns['created_at'].append
+        for record in records:
+            user_id(encode(record['user_id']))
+            consumer_key(encode(record['oauth_consumer_key']))
+            sourcedid(encode(record['lis_result_sourcedid']))
+            service_url(encode(record['lis_outcome_service_url']))
+            attempt_type(encode(record['attempt_type']))
+            correct = record['is_correct']
+            is_correct(-1 if correct is None else 1 if correct else 0)
+            created_at(record['created_at'])
+
+    def append(self, record):
+        self.extend((record,))
+
+    def __len__(self):
+        return len(self._columns['created_at'])
+
+    def _decode(self, field, start=0, stop=None):
+        """Значения столбца field (ленивый итератор) для записей [start, stop)"""
+        values = self._columns[field][start:stop] if start or stop is not None else self._columns[field]
+        if field in ENCODED_FIELDS:
+            return map(self.table.values.__getitem__, values)
+        if field == 'is_correct':
+            return map(_IS_CORRECT.__getitem__, values)
+        return iter(values)
+
+    def iter_rows(self, fields=ATTEMPT_FIELDS):
+        """Кортежи значений fields по записям, без промежуточных объектов на запись"""
+        return zip(*(self._decode(field) for field in fields))
+
+    def columns(self, start=0, stop=None):
+        """{столбец: список значений} для записей [start, stop) — формат database.copy_columns"""
+        return {field: list(self._decode(field, start, stop)) for field in ATTEMPT_FIELDS}
+
+    def column_batches(self, size):
+        """Пачки по size записей в формате columns (для загрузки по столбцам)"""
+        for start in range(0, len(self), size):
+            yield self.columns(start, start + size)
+
+    def __iter__(self):
+        return (Attempt(*row) for row in self.iter_rows())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return AttemptBatch(self.table, {field: values[index] for field, values in self._columns.items()})
+        values = self.table.values
+        columns = self._columns
+        return Attempt(
+            *(values[columns[field][index]] for field in ENCODED_FIELDS[:4]),
+            _IS_CORRECT[columns['is_correct'][index]],
+            values[columns['attempt_type'][index]],
+            columns['created_at'][index],
+        )
+
+    def __repr__(self):
+        return f"AttemptBatch({len(self)} записей, {len(self.table)} строк в словаре)"
+
+
+def as_dicts(records):
+    """Адаптер: записи (AttemptBatch, Attempt или словари) в виде словарей, как возвращает process_data по умолчанию"""
+    if isinstance(records, AttemptBatch):
+        return [dict(zip(ATTEMPT_FIELDS, row)) for row in records.iter_rows()]
+    return [record.as_dict() if isinstance(record, Attempt) else record for record in records]
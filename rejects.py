@@ -0,0 +1,157 @@
+"""
+Учёт отклонённых записей API.
+
+Отказы считаются по причинам (missing_fields, bad_attempt_type, bad_passback, error), но в лог
+полностью попадают не все: по каждой причине первые REJECT_LOG_FIRST записей и дальше каждая
+REJECT_LOG_EVERY-я. Запись форматируется только если её действительно пишут в лог, поэтому
+поток из сотен тысяч битых записей не тратит время на repr словарей и не забивает диск.
+
+Если задан REJECT_QUARANTINE_DIR, все отклонённые записи сохраняются в карантин —
+файл JSON Lines REJECT_QUARANTINE_DIR/rejected-YYYY-MM-DD.jsonl (по строке на запись:
+причина, описание, номер записи, исходная запись). Строки копятся в буфере и дописываются
+пачками по REJECT_FLUSH_SIZE.
+
+Если включён REJECT_QUARANTINE_DB и запуск указал окно загрузки (attach_window), те же пачки
+сохраняются в таблицу attempts_quarantine (см. quarantine.py) — оттуда их можно перепроверить
+после исправления правил командой python quarantine.py reprocess.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+
+from config import (
+    REJECT_LOG_FIRST, REJECT_LOG_EVERY, REJECT_QUARANTINE_DIR, REJECT_FLUSH_SIZE, REJECT_QUARANTINE_DB,
+)
+
+
+class RejectLog:
+    """Счётчики отказов по причинам, выборочный лог и буферизованный карантин (JSON Lines и таблица)"""
+
+    def __init__(self, log_first=REJECT_LOG_FIRST, log_every=REJECT_LOG_EVERY,
+                 quarantine_dir=REJECT_QUARANTINE_DIR, flush_size=REJECT_FLUSH_SIZE,
+                 quarantine_db=REJECT_QUARANTINE_DB):
+        self.log_first = log_first
+        self.log_every = log_every
+        self.quarantine_dir = quarantine_dir
+        self.flush_size = flush_size
+        self.quarantine_db = quarantine_db
+        self.window = None
+        self.counts = Counter()
+        self.logged = 0
+        self.quarantined = 0
+        self.quarantined_db = 0
+        self._buffer = []
+        # _lock — счётчики и буфер (короткие секции в потоках валидации),
+        # _io_lock — запись карантина в файл и БД: пачки пишутся по одной и по порядку
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach_window(self, client, start, end, thread_only=False):
+        """Включает карантин в attempts_quarantine для окна загрузки [start, end) клиента client
+            - thread_only — окно только для отказов из текущего потока (scheduler.py грузит
+              окна нескольких клиентов одновременно), иначе — для всего процесса
+            - окно запоминается с каждым отказом, поэтому буфер при смене окна не сбрасывается
+            - без REJECT_QUARANTINE_DB ничего не делает
+        """
+        if not self.quarantine_db:
+            return
+        if thread_only:
+            self._local.window = (client, start, end)
+        else:
+            self.window = (client, start, end)
+
+    def _current_window(self):
+        return getattr(self._local, 'window', None) or self.window
+
+    def _sampled(self, count):
+        """Писать ли в лог отказ с порядковым номером count (с единицы) внутри своей причины"""
+        return count <= self.log_first or (self.log_every > 0 and count % self.log_every == 0)
+
+    def reject(self, i, reason, detail, record):
+        """Учитывает отклонённую запись i
+            - detail — короткое описание причины (без самой записи)
+            - record — исходная запись API: в лог попадает только выборочно, в карантин — всегда
+        """
+        with self._lock:
+            self.counts[reason] += 1
+            count = self.counts[reason]
+            window = self._current_window()
+            full = False
+            if self.quarantine_dir or window:
+                self._buffer.append((i, reason, detail, record, window))
+                full = len(self._buffer) >= self.flush_size
+        if full:
+            # Сброс идёт вне _lock: остальные потоки продолжают валидацию, пока пачка пишется в файл и БД
+            self.flush()
+        if self._sampled(count):
+            self.logged += 1
+            # Форматирование ленивое: строка собирается, только если уровень логирования включён
+            level = logging.ERROR if reason == 'error' else logging.WARNING
+            logging.log(level, "Отклонена запись %s (%s, %s-я по этой причине): %s. Запись: %r",
+                        i, reason, count, detail, record)
+
+    def _flush(self):
+        """Дописывает буфер в файл и таблицу карантина (вызывается под _io_lock)"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        windowed = [entry for entry in buffer if entry[4]]
+        if windowed:
+            self._flush_table(windowed)
+        if self.quarantine_dir:
+            self._flush_file(buffer)
+
+    def _flush_table(self, buffer):
+        # quarantine тянет за собой пул соединений с БД; нужен, только когда окно указано
+        from quarantine import quarantine_records
+
+        rows = ({'client': client, 'window_start': start, 'window_end': end, 'reason': reason,
+                 'detail': detail, 'record_index': i, 'payload': record}
+                for i, reason, detail, record, (client, start, end) in buffer)
+        try:
+            self.quarantined_db += quarantine_records(rows)
+        except Exception as e:
+            # Отказ карантина не должен ронять загрузку: записи остаются в счётчиках и в файле
+            logging.error(f"Не удалось сохранить {len(buffer)} отклонённых записей в attempts_quarantine: {e}")
+
+    def _flush_file(self, buffer):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        path = os.path.join(self.quarantine_dir, f"rejected-{datetime.now():%Y-%m-%d}.jsonl")
+        rejected_at = datetime.now().isoformat(timespec='seconds')
+        lines = [json.dumps({'rejected_at': rejected_at, 'reason': reason, 'detail': detail, 'index': i,
+                             'record': record}, ensure_ascii=False, default=str) + '\n'
+                 for i, reason, detail, record, _ in buffer]
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        self.quarantined += len(lines)
+
+    def flush(self):
+        """Сбрасывает буфер карантина; ошибки только логируются — сбой карантина не должен прерывать загрузку"""
+        with self._io_lock:
+            try:
+                self._flush()
+            except Exception as e:
+                logging.error(f"Не удалось записать карантин отклонённых записей: {e}")
+
+    def summary(self):
+        """Итог по отказам одной строкой для лога (и сброс буфера карантина)"""
+        self.flush()
+        total = sum(self.counts.values())
+        line = f"Отклонено записей: {total} {dict(self.counts)}, в лог выведено {self.logged}"
+        if self.quarantine_dir:
+            line += f", в карантине {self.quarantined} ({self.quarantine_dir})"
+        if self.quarantined_db:
+            line += f", в attempts_quarantine {self.quarantined_db}"
+        return line
+
+
+REJECTS = RejectLog()
+# Запуски сбрасывают карантин сами; это — страховка для файла карантина. Буфер с окном загрузки
+# сбрасывает в БД db_pool.close_pool до закрытия пула (его atexit срабатывает раньше этого)
+atexit.register(REJECTS.flush)
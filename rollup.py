@@ -0,0 +1,126 @@
+"""
+Дневные агрегаты по таблице attempts.
+
+attempts_daily — по одной строке на день: число попыток, успешных, submit, run,
+первая и последняя попытка. attempts_daily_users — множество пользователей по дням,
+из него считается число уникальных пользователей за любой период.
+Агрегаты пересчитываются только для дней, затронутых загрузкой (см. database.insert_attempts).
+
+Полный пересчёт (например, после ручного DELETE/TRUNCATE attempts):
+    python rollup.py --rebuild
+"""
+import argparse
+import logging
+from datetime import date, timedelta
+
+from db_pool import get_connection
+
+
+def create_rollup_tables(cur):
+    """Создаёт таблицы агрегатов; если они пусты, а в attempts уже есть данные — заполняет их"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS attempts_daily (
+            day DATE PRIMARY KEY,
+            total_attempts BIGINT NOT NULL,
+            correct_attempts BIGINT NOT NULL,
+            submits BIGINT NOT NULL,
+            runs BIGINT NOT NULL,
+            first_attempt TIMESTAMP,
+            last_attempt TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS attempts_daily_users (
+            day DATE NOT NULL,
+            user_id VARCHAR(100) NOT NULL,
+            PRIMARY KEY (day, user_id)
+        )
+    ''')
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM attempts_daily) AND EXISTS (SELECT 1 FROM attempts)")
+    if cur.fetchone()[0]:
+        logging.info("Таблицы агрегатов пусты, заполняем по всей истории attempts")
+        _refresh(cur, None)
+
+
+def _refresh(cur, days):
+    """Пересчитывает агрегаты за дни days (список date) или за всю историю, если days is None"""
+    if days is None:
+        cur.execute("TRUNCATE attempts_daily, attempts_daily_users")
+        where, params = "created_at IS NOT NULL", ()
+    else:
+        # Параллельные загрузчики (scheduler.py, pipeline.py, quarantine.py) могут пересчитывать один день:
+        # блокировка дня до конца транзакции выстраивает их по очереди, и следующий пересчёт видит строки,
+        # закоммиченные предыдущим. Дни блокируются по возрастанию, поэтому взаимоблокировок нет
+        cur.execute('''
+            SELECT pg_advisory_xact_lock(hashtext('rollup' || day))
+            FROM (SELECT day FROM unnest(%s::date[]) AS day ORDER BY day) AS locked
+        ''', (days,))
+        cur.execute("DELETE FROM attempts_daily WHERE day = ANY(%s)", (days,))
+        cur.execute("DELETE FROM attempts_daily_users WHERE day = ANY(%s)", (days,))
+        # Диапазон по created_at позволяет использовать индекс, ANY отсекает дни между затронутыми
+        where = "created_at >= %s AND created_at < %s AND created_at::date = ANY(%s)"
+        params = (min(days), max(days) + timedelta(days=1), days)
+
+    cur.execute(f'''
+        INSERT INTO attempts_daily
+            (day, total_attempts, correct_attempts, submits, runs, first_attempt, last_attempt)
+        SELECT
+            created_at::date,
+            COUNT(*),
+            COUNT(CASE WHEN is_correct THEN 1 END),
+            COUNT(CASE WHEN attempt_type = 'submit' THEN 1 END),
+            COUNT(CASE WHEN attempt_type = 'run' THEN 1 END),
+            MIN(created_at),
+            MAX(created_at)
+        FROM attempts
+        WHERE {where}
+        GROUP BY created_at::date
+    ''', params)
+    cur.execute(f'''
+        INSERT INTO attempts_daily_users (day, user_id)
+        SELECT DISTINCT created_at::date, user_id
+        FROM attempts
+        WHERE {where} AND user_id IS NOT NULL
+    ''', params)
+
+
+def refresh_days(days, cur=None):
+    """Пересчитывает дневные агрегаты за затронутые дни одной транзакцией
+        - days — итерируемое date или строк 'YYYY-MM-DD...'
+        - cur — курсор открытой транзакции: пересчёт идёт в ней, коммит делает вызывающий код
+        - пересчёт идемпотентен: повторный вызов даёт тот же результат
+    """
+    days = sorted({day if isinstance(day, date) else date.fromisoformat(str(day)[:10]) for day in days})
+    if not days:
+        return
+    if cur is not None:
+        _refresh(cur, days)
+        return
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _refresh(cur, days)
+        conn.commit()
+        cur.close()
+    logging.info(f"Дневные агрегаты обновлены за {len(days)} дн. ({days[0]} — {days[-1]})")
+
+
+def rebuild_rollups():
+    """Полный пересчёт агрегатов по всей истории attempts"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _refresh(cur, None)
+        conn.commit()
+        cur.close()
+    logging.info("Дневные агрегаты пересчитаны по всей истории")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Дневные агрегаты attempts")
+    parser.add_argument('--rebuild', action='store_true', help="пересчитать агрегаты по всей истории")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    if args.rebuild:
+        rebuild_rollups()
+    else:
+        parser.print_help()
@@ -0,0 +1,344 @@
+"""
+Планировщик загрузки нескольких клиентов API в одном процессе (вместо cron-задачи на клиента).
+
+Клиенты описываются в JSON-файле CLIENTS_FILE:
+    [
+        {"name": "Skillfactory", "key": "M2MGWS",
+         "start": "2023-04-01 00:00:00.000000", "end": "2023-04-30 23:59:59.999999"},
+        {"name": "Other", "key": "...", "incremental": true, "concurrency": 4, "api_url": "https://..."}
+    ]
+Необязательные поля: start/end (по умолчанию START_PARSE/END_PARSE), incremental (SYNC_MODE),
+concurrency (SCHEDULER_CLIENT_CONCURRENCY), window (FETCH_WINDOW), api_url (API_URL).
+Без файла загружается один клиент из config.py (CLIENT, CLIENT_KEY).
+
+Период клиента делится на окна; окно — задача: потоковый запрос к API, валидация и загрузка
+в attempts пачками с attempts.client = имя клиента. Задачи выполняет общий пул из
+SCHEDULER_WORKERS потоков:
+    - задачи раздаются клиентам по кругу, и у клиента одновременно выполняется не больше
+      concurrency окон, поэтому медленный клиент занимает только свои потоки;
+    - запись в БД идёт через FairWriteGate: одновременно пишется не больше SCHEDULER_DB_WRITERS
+      пачек, очередь на запись обслуживается по кругу между клиентами;
+    - упавшее окно повторяется SCHEDULER_RETRIES раз; если оно так и не загрузилось, клиент
+      помечается упавшим и его оставшиеся окна снимаются, остальные клиенты продолжают.
+Watermark (sync_state) у каждого клиента свой и сдвигается, только если загружены все его окна.
+Дневные агрегаты и user_progress пересчитываются один раз в конце — за дни и пары
+(пользователь, задание), затронутые всеми клиентами.
+
+Запуск:
+    python scheduler.py [--clients clients.json] [--workers 8] [--db-writers 2]
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from config import (CLIENT, CLIENT_KEY, CLIENTS_FILE, END_PARSE, FETCH_WINDOW, SCHEDULER_CLIENT_CONCURRENCY,
+                    SCHEDULER_DB_WRITERS, SCHEDULER_RETRIES, SCHEDULER_WORKERS, START_PARSE, STREAM_BATCH_SIZE,
+                    SYNC_MODE)
+from database import (advance_watermark, batched, create_table, insert_attempts, prepare_partitions,
+                      refresh_touched)
+from db_pool import check_connection
+from main import fetch_data_stream, incremental_range, iter_processed, setup_logger, split_time_range
+import metrics
+from rejects import REJECTS
+
+
+def load_clients(path=CLIENTS_FILE):
+    """Клиенты из JSON-файла path (см. описание модуля) с подставленными значениями по умолчанию
+        - без файла — один клиент CLIENT из config.py
+        - ошибки описания (нет name/key, повтор имени, нет периода) — ValueError
+    """
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    else:
+        logging.info(f"Файл клиентов {path} не найден, загружается один клиент {CLIENT}")
+        entries = [{'name': CLIENT, 'key': CLIENT_KEY}]
+
+    clients = []
+    for entry in entries:
+        missing = [field for field in ('name', 'key') if not entry.get(field)]
+        if missing:
+            raise ValueError(f"В описании клиента нет полей {missing}: {entry}")
+        client = {
+            'name': entry['name'],
+            'key': entry['key'],
+            'url': entry.get('api_url'),
+            'start': entry.get('start', START_PARSE),
+            'end': entry.get('end', END_PARSE),
+            'incremental': entry.get('incremental', SYNC_MODE == 'incremental'),
+            'concurrency': max(1, int(entry.get('concurrency', SCHEDULER_CLIENT_CONCURRENCY))),
+            'window': entry.get('window', FETCH_WINDOW),
+        }
+        if not client['incremental'] and not (client['start'] and client['end']):
+            raise ValueError(f"У клиента {client['name']} не задан период (start, end) и не включён incremental")
+        if any(other['name'] == client['name'] for other in clients):
+            raise ValueError(f"Клиент {client['name']} описан дважды")
+        clients.append(client)
+    return clients
+
+
+class FairWriteGate:
+    """Не больше slots одновременных записей в БД; ожидающие обслуживаются по кругу между клиентами
+        - освободившееся место передаётся первому ожидающему следующего по очереди клиента,
+          поэтому клиент с длинной очередью пачек не вытесняет остальных
+    """
+
+    def __init__(self, slots):
+        self._lock = threading.Lock()
+        self._free = slots
+        self._waiting = {}  # клиент → очередь событий ожидающих потоков
+        self._turns = deque()  # клиенты с ожидающими, в порядке обслуживания
+
+    @contextmanager
+    def slot(self, client):
+        started = time.perf_counter()
+        self.acquire(client)
+        metrics.observe('db_write_wait_seconds', time.perf_counter() - started, client=client)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, client):
+        with self._lock:
+            if self._free and not self._turns:
+                self._free -= 1
+                return
+            event = threading.Event()
+            if client not in self._waiting:
+                self._waiting[client] = deque()
+                self._turns.append(client)
+            self._waiting[client].append(event)
+        event.wait()
+
+    def release(self):
+        with self._lock:
+            if not self._turns:
+                self._free += 1
+                return
+            client = self._turns.popleft()
+            waiters = self._waiting[client]
+            event = waiters.popleft()
+            if waiters:
+                self._turns.append(client)
+            else:
+                del self._waiting[client]
+            # Место не возвращается в _free, а сразу переходит ожидающему
+            event.set()
+
+
+class ClientRun:
+    """Состояние загрузки одного клиента: очередь окон, прогресс, счётчики и итог"""
+
+    def __init__(self, client, start, end):
+        self.client = client
+        self.name = client['name']
+        self.start, self.end = start, end
+        self.pending = deque((window_start, window_end, 0)
+                             for window_start, window_end in split_time_range(start, end, client['window']))
+        self.windows = len(self.pending)
+        self.done = 0
+        self.running = 0
+        self.loaded = 0
+        self.stats = {'total': 0, 'valid': 0, 'rejected': Counter()}
+        self.status = 'ok'
+        self.error = None
+        self.watermark = None
+        self.started = None
+        self.seconds = 0.0
+
+    def summary(self):
+        return {
+            'status': self.status, 'start': self.start, 'end': self.end, 'windows': self.windows, 'done': self.done,
+            'loaded': self.loaded, 'total': self.stats['total'], 'valid': self.stats['valid'],
+            'rejected': dict(self.stats['rejected']), 'seconds': round(self.seconds, 3),
+            'watermark': self.watermark, 'error': self.error,
+        }
+
+
+class Scheduler:
+    """Загрузка нескольких клиентов общим пулом потоков (см. описание модуля)
+        - fetch(start, end, client=, client_key=, url=) — генератор записей API окна
+          (по умолчанию потоковый запрос main.fetch_data_stream)
+    """
+
+    def __init__(self, clients, workers=SCHEDULER_WORKERS, db_writers=SCHEDULER_DB_WRITERS,
+                 retries=SCHEDULER_RETRIES, batch_size=STREAM_BATCH_SIZE, fetch=fetch_data_stream):
+        self.clients = clients
+        self.workers = workers
+        self.gate = FairWriteGate(db_writers)
+        self.retries = retries
+        self.batch_size = batch_size
+        self.fetch = fetch
+        self.days = set()
+        self.keys = set()
+        self.runs = []
+        self._turn = 0
+
+    def _load_window(self, run, start, end):
+        """Задача: одно окно клиента API → валидация → attempts; возвращает (загружено, счётчики валидации)"""
+        REJECTS.attach_window(run.name, start, end, thread_only=True)
+        client = run.client
+        stats = {}
+        loaded = 0
+        records = self.fetch(start, end, client=client['name'], client_key=client['key'], url=client['url'])
+        try:
+            for batch in batched(iter_processed(records, stats), self.batch_size):
+                with self.gate.slot(run.name):
+                    loaded += insert_attempts(batch, batch_size=len(batch), client=run.name,
+                                              days=self.days, keys=self.keys)
+        except Exception as e:
+            # Пачки, закоммиченные до ошибки, остаются в attempts
+            e.loaded = loaded + getattr(e, 'loaded', 0)
+            raise
+        return loaded, stats
+
+    def _next_job(self):
+        """Следующее окно: клиенты по кругу, пропуская упавших и занявших свой предел concurrency"""
+        for offset in range(len(self.runs)):
+            index = (self._turn + offset) % len(self.runs)
+            run = self.runs[index]
+            if run.pending and run.status == 'ok' and run.running < run.client['concurrency']:
+                self._turn = index + 1
+                return run, run.pending.popleft()
+        return None
+
+    def _finish(self, run, window, future):
+        """Учитывает завершённое окно (вызывается только из основного потока)"""
+        start, end, attempt = window
+        run.running -= 1
+        try:
+            loaded, stats = future.result()
+        except Exception as e:
+            run.loaded += getattr(e, 'loaded', 0)
+            if attempt < self.retries:
+                logging.warning(f"Клиент {run.name}: окно {start} — {end} не загружено ({e}), повторим")
+                metrics.inc('scheduler_windows', client=run.name, status='retry')
+                run.pending.append((start, end, attempt + 1))
+            else:
+                logging.error(f"Клиент {run.name}: окно {start} — {end} не загружено: {e}. "
+                              f"Клиент остановлен, оставшиеся окна ({len(run.pending)}) сняты")
+                metrics.inc('scheduler_windows', client=run.name, status='failed')
+                run.status = 'failed'
+                run.error = f"{type(e).__name__}: {e}"
+                run.pending.clear()
+        else:
+            run.done += 1
+            run.loaded += loaded
+            run.stats['total'] += stats.get('total', 0)
+            run.stats['valid'] += stats.get('valid', 0)
+            run.stats['rejected'].update(stats.get('rejected', {}))
+            metrics.inc('scheduler_windows', client=run.name, status='ok')
+            logging.info(f"Клиент {run.name}: окно {run.done}/{run.windows} ({start} — {end}), "
+                         f"новых записей {loaded}, всего {run.loaded}")
+        if not run.running and not run.pending:
+            run.seconds = time.perf_counter() - run.started
+
+    def _prepare(self):
+        """Периоды клиентов (с учётом watermark) и секции attempts под них"""
+        for client in self.clients:
+            if client['incremental']:
+                start, end = incremental_range(client['name'], first_start=client['start'])
+            else:
+                start, end = client['start'], client['end']
+            prepare_partitions(start, end)
+            self.runs.append(ClientRun(client, start, end))
+            logging.info(f"Клиент {client['name']}: период {start} — {end}, окон {self.runs[-1].windows}, "
+                         f"одновременно до {client['concurrency']}")
+
+    def _complete(self, run):
+        """Итог клиента: watermark сдвигается, только если загружены все окна"""
+        if run.status == 'ok' and run.client['incremental']:
+            try:
+                run.watermark = advance_watermark(run.name, run.start, run.end)
+            except Exception as e:
+                run.status, run.error = 'failed', f"watermark: {e}"
+        metrics.inc('scheduler_rows', run.loaded, client=run.name)
+        metrics.inc('scheduler_clients', status=run.status)
+        level = logging.INFO if run.status == 'ok' else logging.ERROR
+        logging.log(level, f"Клиент {run.name}: {run.status}, окон {run.done}/{run.windows}, "
+                           f"новых записей {run.loaded}, валидных {run.stats['valid']} из {run.stats['total']}, "
+                           f"отклонено {dict(run.stats['rejected'])}, {run.seconds:.2f} с"
+                           + (f", ошибка: {run.error}" if run.error else ""))
+
+    def run(self):
+        """Загружает всех клиентов; возвращает отчёт {клиент: summary()}"""
+        self._prepare()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler') as executor:
+            running = {}
+            while True:
+                while len(running) < self.workers:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    run, window = job
+                    run.running += 1
+                    if run.started is None:
+                        run.started = time.perf_counter()
+                    running[executor.submit(self._load_window, run, window[0], window[1])] = (run, window)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finish(*running.pop(future), future)
+
+        REJECTS.flush()
+        refresh_touched(self.days, self.keys)
+        for run in self.runs:
+            self._complete(run)
+        return {run.name: run.summary() for run in self.runs}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Загрузка нескольких клиентов API: API → PostgreSQL")
+    parser.add_argument('--clients', default=CLIENTS_FILE, help="JSON-файл со списком клиентов")
+    parser.add_argument('--workers', type=int, default=SCHEDULER_WORKERS, help="окон одновременно по всем клиентам")
+    parser.add_argument('--db-writers', type=int, default=SCHEDULER_DB_WRITERS,
+                        help="пачек, записываемых в БД одновременно")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """Планировщик по аргументам командной строки; возвращает код выхода (0 — все клиенты загружены)"""
+    logging.info("=== Запуск планировщика клиентов ===")
+    try:
+        check_connection()
+    except Exception as e:
+        logging.critical(f"❌ Ошибка подключения к PostgreSQL: {e}")
+        return 1
+    create_table()
+
+    try:
+        clients = load_clients(args.clients)
+    except (OSError, ValueError) as e:
+        logging.critical(f"❌ Ошибка в списке клиентов: {e}")
+        return 1
+    report = Scheduler(clients, workers=args.workers, db_writers=args.db_writers).run()
+    failed = [name for name, summary in report.items() if summary['status'] != 'ok']
+    if failed:
+        logging.critical(f"=== Планировщик завершён, не загружены клиенты: {failed} ===")
+        return 1
+    logging.info("=== Планировщик завершён успешно ===")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    code = 1
+    try:
+        code = run(args)
+    finally:
+        REJECTS.flush()
+        metrics.write_run_summary('scheduler', 'ok' if code == 0 else 'error')
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
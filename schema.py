@@ -0,0 +1,210 @@
+"""
+Схема таблицы attempts: секционирование по месяцам и индексы.
+
+attempts секционирована по диапазону created_at (одна секция на месяц, attempts_YYYY_MM)
+плюс секция attempts_default для строк вне созданных секций. Старые месяцы можно удалять
+быстро: DROP TABLE attempts_2023_05 вместо DELETE.
+"""
+import logging
+from datetime import date, datetime
+
+from config import MIGRATION_BATCH_SIZE
+
+ATTEMPTS_DDL = '''
+    CREATE TABLE IF NOT EXISTS attempts (
+        id SERIAL,
+        user_id VARCHAR(100),
+        oauth_consumer_key TEXT,
+        lis_result_sourcedid TEXT,
+        lis_outcome_service_url TEXT,
+        is_correct BOOLEAN,
+        attempt_type VARCHAR(10),
+        created_at TIMESTAMP NOT NULL,
+        client TEXT,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+'''
+
+# Столбцы, добавленные после первой версии: таблицы прошлых версий дополняются ими на месте
+ATTEMPTS_ADDED_COLUMNS = [
+    # Клиент (источник API), от которого пришла строка; NULL — строки, загруженные до его появления
+    "ALTER TABLE attempts ADD COLUMN IF NOT EXISTS client TEXT",
+]
+
+ATTEMPTS_INDEXES = [
+    # Ключ дедупликации (NULL в lis_result_sourcedid индекс не считает равными)
+    "CREATE UNIQUE INDEX IF NOT EXISTS attempts_natural_key "
+    "ON attempts (user_id, lis_result_sourcedid, attempt_type, created_at)",
+    "CREATE INDEX IF NOT EXISTS attempts_created_at_idx ON attempts (created_at)",
+    "CREATE INDEX IF NOT EXISTS attempts_user_id_idx ON attempts (user_id)",
+    "CREATE INDEX IF NOT EXISTS attempts_type_correct_idx ON attempts (attempt_type, is_correct)",
+    # Срезы отчётов по потребителю LTI за период (analytics.query_metrics)
+    "CREATE INDEX IF NOT EXISTS attempts_consumer_created_idx ON attempts (oauth_consumer_key, created_at)",
+    # Watermark и отчёты по клиенту (scheduler.py)
+    "CREATE INDEX IF NOT EXISTS attempts_client_created_idx ON attempts (client, created_at)",
+]
+
+# Карантин отклонённых записей (см. quarantine.py): исходная запись API, причина отказа и окно загрузки
+QUARANTINE_DDL = '''
+    CREATE TABLE IF NOT EXISTS attempts_quarantine (
+        id BIGSERIAL PRIMARY KEY,
+        client TEXT,
+        window_start TIMESTAMP,
+        window_end TIMESTAMP,
+        reason VARCHAR(20) NOT NULL,
+        detail TEXT,
+        record_index BIGINT,
+        payload JSONB NOT NULL,
+        rejected_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+'''
+
+
+def month_start(value):
+    """Первое число месяца для date, datetime или строки 'YYYY-MM-DD...'"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def attempts_kind(cur):
+    """'partitioned', 'plain' или None, если таблицы attempts нет"""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('attempts')")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return 'partitioned' if row[0] == 'p' else 'plain'
+
+
+def create_partitioned_attempts(cur):
+    """Создаёт секционированную attempts с секцией по умолчанию и индексами (если их нет)"""
+    cur.execute(ATTEMPTS_DDL)
+    cur.execute("CREATE TABLE IF NOT EXISTS attempts_default PARTITION OF attempts DEFAULT")
+    for statement in ATTEMPTS_ADDED_COLUMNS + ATTEMPTS_INDEXES:
+        cur.execute(statement)
+
+
+def create_quarantine_table(cur):
+    """Создаёт таблицу карантина attempts_quarantine (если её нет)"""
+    cur.execute(QUARANTINE_DDL)
+    cur.execute("CREATE INDEX IF NOT EXISTS attempts_quarantine_reason_idx ON attempts_quarantine (reason)")
+
+
+def _existing_partitions(cur):
+    cur.execute('''
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass('attempts')
+    ''')
+    return {row[0] for row in cur.fetchall()}
+
+
+def _create_partition(cur, month):
+    """Создаёт секцию за месяц; строки этого месяца, попавшие в attempts_default, переносятся в неё"""
+    name = f"attempts_{month:%Y_%m}"
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    cur.execute(f"CREATE TABLE {name} (LIKE attempts INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cur.execute(f'''
+        WITH moved AS (
+            DELETE FROM attempts_default WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', (lower, upper))
+    if cur.rowcount:
+        logging.info(f"Перенесено в {name} из attempts_default: {cur.rowcount} строк")
+    cur.execute(f"ALTER TABLE attempts ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    logging.info(f"Создана секция {name}")
+
+
+def ensure_partitions(cur, start, end):
+    """Создаёт недостающие месячные секции за период [start, end]
+        - а также за месяцы, строки которых уже лежат в attempts_default
+        - транзакцией управляет вызывающий код
+    """
+    months = set()
+    month, last = month_start(start), month_start(end)
+    while month <= last:
+        months.add(month)
+        month = add_months(month, 1)
+    cur.execute("SELECT DISTINCT date_trunc('month', created_at)::date FROM attempts_default")
+    months.update(row[0] for row in cur.fetchall())
+
+    existing = _existing_partitions(cur)
+    for month in sorted(months):
+        if f"attempts_{month:%Y_%m}" not in existing:
+            _create_partition(cur, month)
+
+
+def migrate_to_partitioned(conn, batch_size=MIGRATION_BATCH_SIZE):
+    """Переводит обычную таблицу attempts в секционированную на месте
+        - старая таблица переименовывается в attempts_legacy, рядом создаётся секционированная
+          attempts с секциями за весь период данных; счётчик id продолжается со старого значения
+        - строки переносятся пачками по batch_size (DELETE ... RETURNING → INSERT),
+          каждая пачка — отдельная транзакция; прерванную миграцию продолжает повторный запуск
+        - дубли по ключу дедупликации при переносе отбрасываются
+        - строки без created_at в секционированную таблицу не попадают и остаются в attempts_legacy
+    """
+    cur = conn.cursor()
+    if attempts_kind(cur) == 'plain':
+        logging.info("Миграция attempts в секционированную таблицу")
+        cur.execute("ALTER TABLE attempts RENAME TO attempts_legacy")
+        cur.execute("ALTER TABLE attempts_legacy RENAME CONSTRAINT attempts_pkey TO attempts_legacy_pkey")
+        cur.execute("ALTER INDEX IF EXISTS attempts_natural_key RENAME TO attempts_legacy_natural_key")
+    create_partitioned_attempts(cur)
+
+    cur.execute("SELECT to_regclass('attempts_legacy')")
+    if cur.fetchone()[0] is None:
+        conn.commit()
+        return
+
+    cur.execute('''
+        SELECT setval(pg_get_serial_sequence('attempts', 'id'),
+                      GREATEST((SELECT MAX(id) FROM attempts_legacy), (SELECT MAX(id) FROM attempts), 1))
+    ''')
+    cur.execute("SELECT MIN(created_at), MAX(created_at) FROM attempts_legacy")
+    first, last = cur.fetchone()
+    if first is not None:
+        ensure_partitions(cur, first, last)
+    conn.commit()
+
+    moved = 0
+    while True:
+        cur.execute('''
+            WITH batch AS (
+                DELETE FROM attempts_legacy
+                WHERE id IN (
+                    SELECT id FROM attempts_legacy WHERE created_at IS NOT NULL ORDER BY id LIMIT %s
+                )
+                RETURNING id, user_id, oauth_consumer_key, lis_result_sourcedid, lis_outcome_service_url,
+                          is_correct, attempt_type, created_at
+            ), inserted AS (
+                INSERT INTO attempts (id, user_id, oauth_consumer_key, lis_result_sourcedid,
+                                      lis_outcome_service_url, is_correct, attempt_type, created_at)
+                SELECT * FROM batch
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM batch), (SELECT COUNT(*) FROM inserted)
+        ''', (batch_size,))
+        taken, inserted = cur.fetchone()
+        conn.commit()
+        if not taken:
+            break
+        moved += inserted
+        logging.info(f"Миграция attempts: перенесено {moved} строк (дублей в пачке: {taken - inserted})")
+
+    cur.execute("SELECT COUNT(*) FROM attempts_legacy")
+    left = cur.fetchone()[0]
+    if left:
+        logging.warning(f"В attempts_legacy осталось {left} строк без created_at — они не перенесены")
+    else:
+        cur.execute("DROP TABLE attempts_legacy")
+        logging.info("Миграция attempts завершена, attempts_legacy удалена")
+    conn.commit()
+    cur.close()
@@ -0,0 +1,242 @@
+"""
+Синхронизация таблиц с Google Sheets по разнице с последней выгрузкой.
+
+Снимок последних выгруженных значений хранится локально (SHEETS_SNAPSHOT_DIR/<spreadsheet_id>.json).
+При выгрузке новые значения сравниваются со снимком, и в Sheets уходят только изменившиеся
+диапазоны — одним запросом values:batchUpdate на все листы (или несколькими, если изменено
+больше SHEETS_MAX_CELLS_PER_REQUEST ячеек). На 429 и 5xx запрос повторяется с экспоненциальной
+задержкой (с учётом заголовка Retry-After).
+
+Если лист правили вручную, снимок устаревает — тогда выгрузку запускают с force=True:
+лист очищается и записывается целиком.
+
+Адрес API задаётся SHEETS_API_URL; для проверки без Google можно поднять fake_sheets.py.
+"""
+import json
+import logging
+import math
+import os
+from functools import lru_cache
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (SSL_VERIFY, SHEETS_API_URL, SHEETS_SNAPSHOT_DIR, SHEETS_MAX_CELLS_PER_REQUEST,
+                    SHEETS_MAX_RETRIES, SHEETS_BACKOFF)
+import metrics
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+
+def mount_retries(session, retries=SHEETS_MAX_RETRIES, backoff_factor=SHEETS_BACKOFF):
+    """Повтор запросов сессии на 429 и 5xx с экспоненциальной задержкой и учётом Retry-After
+        - повторяются и POST: запись значений в диапазоны идемпотентна
+    """
+    retry_strategy = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@lru_cache(maxsize=None)
+def get_sheets_session(credentials_path='credentials.json'):
+    """Авторизованная сессия сервисного аккаунта, одна на процесс для каждого файла ключа
+        - токен доступа обновляется сессией сам, повторная авторизация на каждую выгрузку не нужна
+    """
+    from google.oauth2 import service_account
+    from google.auth.transport.requests import AuthorizedSession
+
+    creds = service_account.Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
+    session = AuthorizedSession(creds)
+    session.verify = SSL_VERIFY
+    return mount_retries(session)
+
+
+def column_letter(index):
+    """Буква столбца по номеру с нуля: 0 → A, 26 → AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(ord('A') + rest) + letters
+    return letters
+
+
+def a1_range(sheet, row, col, height=1, width=1):
+    """Диапазон в нотации A1 для прямоугольника от (row, col) с нуля"""
+    title = "'" + sheet.replace("'", "''") + "'"
+    return f"{title}!{column_letter(col)}{row + 1}:{column_letter(col + width - 1)}{row + height}"
+
+
+def cell_value(value):
+    """Значение ячейки, которое можно отправить в JSON: числа и bool как есть, пустые — '', прочее — строкой"""
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        value = value.item()  # numpy-скаляры
+    if value is None or isinstance(value, float) and math.isnan(value):
+        return ''
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def dataframe_rows(df):
+    """Строки листа из DataFrame: заголовок и значения"""
+    return [[cell_value(column) for column in df.columns]] + \
+        [[cell_value(value) for value in row] for row in df.itertuples(index=False, name=None)]
+
+
+def diff_ranges(old, new):
+    """Прямоугольники изменившихся ячеек: [(row, col, values)]
+        - в строке подряд идущие изменённые ячейки объединяются в отрезок, отрезки с одинаковыми
+          столбцами в соседних строках — в прямоугольник
+        - ячейки, которые были в old, но пропали из new, записываются пустыми
+    """
+    height = max(len(old), len(new))
+    runs = []
+    for r in range(height):
+        old_row = old[r] if r < len(old) else []
+        new_row = new[r] if r < len(new) else []
+        width = max(len(old_row), len(new_row))
+        c = 0
+        while c < width:
+            value = new_row[c] if c < len(new_row) else ''
+            if value == (old_row[c] if c < len(old_row) else ''):
+                c += 1
+                continue
+            start, values = c, []
+            while c < width:
+                value = new_row[c] if c < len(new_row) else ''
+                if value == (old_row[c] if c < len(old_row) else ''):
+                    break
+                values.append(value)
+                c += 1
+            runs.append((r, start, values))
+
+    rectangles = []
+    for r, start, values in runs:
+        if rectangles:
+            last_row, last_start, last_values = rectangles[-1]
+            if (last_start == start and len(last_values[0]) == len(values)
+                    and last_row + len(last_values) == r):
+                last_values.append(values)
+                continue
+        rectangles.append((r, start, [values]))
+    return rectangles
+
+
+def split_rectangle(row, col, values, max_cells):
+    """Делит прямоугольник по строкам на части не больше max_cells ячеек (строку не делит)"""
+    rows_per_part = max(1, max_cells // max(len(values[0]), 1))
+    for offset in range(0, len(values), rows_per_part):
+        yield row + offset, col, values[offset:offset + rows_per_part]
+
+
+class SheetsSync:
+    """Выгрузка таблиц в одну Google Таблицу по разнице со снимком прошлой выгрузки"""
+
+    def __init__(self, spreadsheet_id, session, base_url=SHEETS_API_URL, snapshot_dir=SHEETS_SNAPSHOT_DIR,
+                 max_cells=SHEETS_MAX_CELLS_PER_REQUEST, timeout=60):
+        self.spreadsheet_id = spreadsheet_id
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.snapshot_path = os.path.join(snapshot_dir, f"{spreadsheet_id}.json")
+        self.max_cells = max_cells
+        self.timeout = timeout
+        self._titles = None
+
+    def _request(self, method, suffix, **kwargs):
+        url = f"{self.base_url}/spreadsheets/{self.spreadsheet_id}{suffix}"
+        with metrics.timer('sheets_request_seconds', method=method):
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        metrics.inc('sheets_requests', method=method, status=response.status_code)
+        response.raise_for_status()
+        return response.json()
+
+    def sheet_titles(self):
+        """Названия листов по порядку (запрашиваются один раз)"""
+        if self._titles is None:
+            meta = self._request('GET', '', params={'fields': 'sheets.properties.title'})
+            self._titles = [sheet['properties']['title'] for sheet in meta.get('sheets', [])]
+        return self._titles
+
+    def _ensure_sheets(self, titles):
+        missing = [title for title in titles if title not in self.sheet_titles()]
+        if missing:
+            self._request('POST', ':batchUpdate', json={
+                'requests': [{'addSheet': {'properties': {'title': title}}} for title in missing],
+            })
+            self._titles.extend(missing)
+            logging.info(f"Созданы листы: {missing}")
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning(f"Снимок {self.snapshot_path} повреждён, листы будут записаны целиком")
+            return {}
+
+    def _save_snapshot(self, snapshot):
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def sync(self, tables, force=False):
+        """Выгружает таблицы {название листа: строки (списки значений)}
+            - отправляются только ячейки, изменившиеся относительно снимка
+            - лист без снимка (или все листы при force=True) очищается и записывается целиком
+            - снимок обновляется только после успешной отправки всех изменений
+            - возвращает статистику: ranges, cells, requests
+        """
+        tables = {title: [[cell_value(value) for value in row] for row in rows] for title, rows in tables.items()}
+        snapshot = self.load_snapshot()
+        self._ensure_sheets(tables)
+
+        stats = {'ranges': 0, 'cells': 0, 'requests': 0}
+        rewrite = [title for title in tables if force or title not in snapshot]
+        if rewrite:
+            self._request('POST', '/values:batchClear', json={
+                'ranges': ["'" + title.replace("'", "''") + "'" for title in rewrite],
+            })
+            stats['requests'] += 1
+
+        data = []
+        for title, rows in tables.items():
+            old = [] if title in rewrite else snapshot[title]
+            for row, col, values in diff_ranges(old, rows):
+                for part in split_rectangle(row, col, values, self.max_cells):
+                    data.append(part + (title,))
+
+        def send(chunk):
+            self._request('POST', '/values:batchUpdate', json={'valueInputOption': 'USER_ENTERED', 'data': chunk})
+            stats['requests'] += 1
+
+        chunk, chunk_cells = [], 0
+        for row, col, values, title in data:
+            cells = len(values) * len(values[0])
+            if chunk and chunk_cells + cells > self.max_cells:
+                send(chunk)
+                chunk, chunk_cells = [], 0
+            chunk.append({'range': a1_range(title, row, col, len(values), len(values[0])), 'values': values})
+            chunk_cells += cells
+            stats['ranges'] += 1
+            stats['cells'] += cells
+        if chunk:
+            send(chunk)
+
+        snapshot.update(tables)
+        self._save_snapshot(snapshot)
+        logging.info(f"Google Sheets: изменено {stats['cells']} ячеек в {stats['ranges']} диапазонах, "
+                     f"запросов: {stats['requests']}")
+        return stats
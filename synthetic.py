@@ -0,0 +1,100 @@
+"""
+Генератор синтетических данных в формате API статистики.
+Используется в бенчмарках и тестах вместо реального API.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+
+API_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+COURSE = "course-v1:SkillFactory+DST-3.0+28FEB2021"
+LMS_URL = "https://lms.skillfactory.ru/courses"
+
+
+def make_passback(user_id, block_id):
+    """Строка passback_params в том виде, в каком её отдаёт API (repr питоновского словаря)"""
+    return str({
+        'oauth_consumer_key': '',
+        'lis_result_sourcedid': f"{COURSE}:lms.skillfactory.ru-{block_id}:{user_id}",
+        'lis_outcome_service_url': f"{LMS_URL}/{COURSE}/xblock/block-v1:SkillFactory+DST-3.0+28FEB2021"
+                                   f"+type@lti+block@{block_id}/handler_noauth/outcome_service_handler",
+    })
+
+
+# Виды брака, которые встречаются в ответах API; каждый отклоняется validate_record
+INVALID_KINDS = ('missing_user', 'empty_created_at', 'bad_attempt_type', 'bad_passback', 'no_is_correct')
+
+
+def corrupt_record(record, kind):
+    """Портит запись API одним из INVALID_KINDS (изменяет и возвращает её)"""
+    if kind == 'missing_user':
+        del record['lti_user_id']
+    elif kind == 'empty_created_at':
+        record['created_at'] = ''
+    elif kind == 'bad_attempt_type':
+        record['attempt_type'] = 'check'
+    elif kind == 'bad_passback':
+        record['passback_params'] = record['passback_params'][:40]
+    elif kind == 'no_is_correct':
+        del record['is_correct']
+    return record
+
+
+def generate_records(count, start="2023-05-31 00:00:00.000000", spread_hours=24, users=1000, assignments=50,
+                     duplicate_ratio=None, invalid_ratio=0.0, seed=42):
+    """Генерирует count записей API (генератор)
+        - created_at равномерно распределены в [start, start + spread_hours)
+          и идут по возрастанию, как в ответе API
+        - пользователей users, заданий assignments
+        - duplicate_ratio — доля записей, чья строка passback_params уже встречалась раньше;
+          по умолчанию строка определяется парой (пользователь, задание), как в реальном API
+        - run приходит с is_correct = None, submit — с 0 или 1
+        - invalid_ratio — доля бракованных записей (см. INVALID_KINDS), виды брака чередуются
+    """
+    rng = random.Random(seed)
+    user_ids = [f"{rng.getrandbits(128):032x}" for _ in range(users)]
+    block_ids = [f"{rng.getrandbits(128):032x}" for _ in range(assignments)]
+    begin = datetime.fromisoformat(start)
+    step = timedelta(hours=spread_hours) / max(count, 1)
+    seen_passbacks = []
+
+    for i in range(count):
+        user_id = rng.choice(user_ids)
+        attempt_type = 'submit' if rng.random() < 0.3 else 'run'
+        if duplicate_ratio is None:
+            passback = make_passback(user_id, rng.choice(block_ids))
+        elif seen_passbacks and rng.random() < duplicate_ratio:
+            passback = rng.choice(seen_passbacks)
+        else:
+            passback = make_passback(user_id, f"{rng.getrandbits(128):032x}")
+            seen_passbacks.append(passback)
+        record = {
+            'lti_user_id': user_id,
+            'passback_params': passback,
+            'is_correct': rng.randint(0, 1) if attempt_type == 'submit' else None,
+            'attempt_type': attempt_type,
+            'created_at': (begin + step * i).strftime(API_DATETIME_FORMAT),
+        }
+        if invalid_ratio and rng.random() < invalid_ratio:
+            corrupt_record(record, INVALID_KINDS[i % len(INVALID_KINDS)])
+        yield record
+
+
+def iter_json_bytes(records, chunk_size=64 * 1024):
+    """Сериализует записи в JSON-массив и отдаёт его кусками байт по chunk_size,
+    как iter_content у потокового ответа requests"""
+    buffer = bytearray(b'[')
+    first = True
+    for record in records:
+        if not first:
+            buffer += b','
+        buffer += json.dumps(record).encode('utf-8')
+        first = False
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    buffer += b']'
+    while buffer:
+        yield bytes(buffer[:chunk_size])
+        del buffer[:chunk_size]
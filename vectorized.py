@@ -0,0 +1,112 @@
+"""
+Векторная валидация записей API (PROCESS_ENGINE=vectorized).
+
+Пачка записей раскладывается по столбцам (numpy, dtype=object — значения не приводятся),
+проверки обязательных полей и attempt_type дают булевы маски, отказы и принятые строки
+выбираются по маскам целыми столбцами, а passback_params разбирается только для
+уникальных строк пачки. Результат — принятые строки по столбцам
+(ATTEMPT_COLUMNS), их без промежуточных словарей забирает database.copy_columns.
+
+Итог совпадает с validate_record запись в запись: те же принятые строки, те же причины
+и описания отказов — отклонённые маской строки (их немного) проверяются самой validate_record,
+поэтому тексты отказов берутся у неё, а не дублируются здесь. Если в пачке встретилось что-то, что не укладывается в столбцы
+(запись не словарь, нехэшируемый passback_params), пачка целиком проверяется validate_record.
+"""
+import numpy as np
+
+from passback import PASSBACK_FIELDS, parse_passback_params
+
+REQUIRED_FIELDS = ('lti_user_id', 'passback_params', 'attempt_type', 'created_at')
+RAW_FIELDS = REQUIRED_FIELDS + ('is_correct',)
+OUTPUT_COLUMNS = (
+    'user_id', 'oauth_consumer_key', 'lis_result_sourcedid', 'lis_outcome_service_url',
+    'is_correct', 'attempt_type', 'created_at',
+)
+
+
+class _Missing:
+    """Значение отсутствующего ключа: ложно, как и пустые значения"""
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+def _scalar_batch(records, offset, validate_record):
+    """Запасной путь: пачка через validate_record, результат в том же формате"""
+    columns = {column: [] for column in OUTPUT_COLUMNS}
+    rejections = []
+    for i, record in enumerate(records, offset):
+        row, rejection = validate_record(record)
+        if rejection:
+            rejections.append((i, *rejection))
+            continue
+        for column in OUTPUT_COLUMNS:
+            columns[column].append(row[column])
+    return columns, rejections
+
+
+def validate_batch(records, offset=0):
+    """Валидирует пачку записей по столбцам
+        - records — список записей API, offset — номер первой записи (для текстов отказов)
+        - возвращает (столбцы принятых строк {столбец: список}, отказы [(номер, причина, описание)]);
+          сами отклонённые записи вызывающий берёт из records по номеру
+        - ничего не логирует: так её можно вызывать в дочерних процессах
+    """
+    from main import validate_record
+
+    if not all(type(record) is dict for record in records):
+        return _scalar_batch(records, offset, validate_record)
+    try:
+        return _validate_columns(records, offset, validate_record)
+    except TypeError:
+        # Нехэшируемый passback_params (list/dict)
+        return _scalar_batch(records, offset, validate_record)
+
+
+def _column(records, field):
+    """Значения поля по всем записям пачки (numpy, dtype=object — значения не приводятся)"""
+    return np.fromiter((record.get(field, MISSING) for record in records), dtype=object, count=len(records))
+
+
+def _mask(function, values):
+    return np.fromiter(map(function, values), dtype=bool, count=len(values))
+
+
+def _validate_columns(records, offset, validate_record):
+    raw = {field: _column(records, field) for field in RAW_FIELDS}
+
+    complete = np.logical_and.reduce([_mask(bool, raw[field]) for field in REQUIRED_FIELDS])
+    type_ok = _mask(lambda value: value in ('run', 'submit'), raw['attempt_type'])
+    candidates = complete & type_ok
+
+    # Разбор passback_params — по разу на уникальную строку пачки
+    raw_passback = raw['passback_params'][candidates]
+    parsed = {}
+    for value in raw_passback:
+        if value not in parsed:
+            parsed[value] = parse_passback_params(value)
+    passback_ok = np.zeros(len(records), dtype=bool)
+    passback_ok[candidates] = _mask(lambda value: parsed[value] is not None, raw_passback)
+
+    # Без ключа is_correct validate_record отклоняет запись (отказ 'error')
+    has_is_correct = _mask(lambda value: value is not MISSING, raw['is_correct'])
+    accepted = candidates & passback_ok & has_is_correct
+
+    columns = {
+        'user_id': raw['lti_user_id'][accepted].tolist(),
+        'attempt_type': raw['attempt_type'][accepted].tolist(),
+        'created_at': raw['created_at'][accepted].tolist(),
+    }
+    accepted_passback = [parsed[value] for value in raw_passback[accepted[candidates]]]
+    for field in PASSBACK_FIELDS:
+        columns[field] = [passback[field] for passback in accepted_passback]
+    is_correct = raw['is_correct'][accepted]
+    known = is_correct != None  # noqa: E711
+    is_correct[known] = _mask(bool, is_correct[known])
+    columns['is_correct'] = is_correct.tolist()
+
+    # Причину и описание отказа даёт validate_record — по одному вызову на отклонённую строку
+    rejections = [(offset + int(i), *validate_record(records[i])[1]) for i in np.flatnonzero(~accepted)]
+    return {column: columns[column] for column in OUTPUT_COLUMNS}, rejections